@@ -0,0 +1,288 @@
+"""Teste de carga das rotas públicas: vazão e latência por nível de concorrência.
+
+Mede quanto UM processo do uvicorn aguenta quando várias requisições esperam o
+banco ao mesmo tempo. Com as rotas numa AsyncSession, a vazão deve crescer com
+a concorrência até o limite do pool (DB_POOL_SIZE + DB_MAX_OVERFLOW) ou da CPU;
+com sessões síncronas dentro de rotas `async def`, ela fica parada na vazão de
+concorrência 1 (o event loop espera cada consulta).
+
+Uso:
+    uvicorn main:app --workers 1 --port 8000 &
+    python bench_concorrencia.py --url http://localhost:8000 --album a1b2c3d4
+    python bench_concorrencia.py --url http://localhost:8000 --album a1b2c3d4 --pedido 42 \\
+        --concorrencias 1 4 16 64 --duracao 15
+
+Rode contra um banco com dados reais (Postgres de staging): no SQLite local a
+latência do banco é quase zero e a diferença entre os modelos não aparece.
+
+Sem um Postgres à mão, --comparar mede os dois modelos lado a lado num SQLite
+temporário (populado com --albuns álbuns) com --latencia-banco ms de espera
+por statement, gasta na thread que executa a consulta — como a ida e volta ao
+servidor do banco. Sobe o app duas vezes: com as rotas na AsyncSession e com
+uma sessão síncrona no lugar dela (as mesmas rotas, bloqueando o event loop):
+
+    python bench_concorrencia.py --comparar --latencia-banco 5 --concorrencias 1 4 16
+"""
+import os
+import sys
+import time
+import uuid
+import shutil
+import asyncio
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+import httpx
+
+MODELOS = ("assincrono", "sincrono")
+
+
+def _rotas(args) -> list:
+    rotas = ["/api/albuns", "/api/albuns?busca=a"]
+    if args.album:
+        rotas += [f"/api/album/{args.album}/fotos", f"/{args.album}"]
+    if args.pedido:
+        rotas.append(f"/api/status-pagamento/{args.pedido}")
+    return rotas
+
+
+async def _cliente_virtual(http: httpx.AsyncClient, rotas: list, fim: float, latencias: list, erros: list, inicio: int):
+    """Faz requisições em sequência (percorrendo as rotas) até o fim da janela."""
+    i = inicio
+    while time.perf_counter() < fim:
+        rota = rotas[i % len(rotas)]
+        i += 1
+        t0 = time.perf_counter()
+        try:
+            resposta = await http.get(rota)
+            if resposta.status_code >= 400:
+                erros.append(resposta.status_code)
+                continue
+        except httpx.HTTPError as exc:
+            erros.append(type(exc).__name__)
+            continue
+        latencias.append(time.perf_counter() - t0)
+
+
+async def medir(url: str, rotas: list, concorrencia: int, duracao: float) -> dict:
+    limites = httpx.Limits(max_connections=concorrencia, max_keepalive_connections=concorrencia)
+    async with httpx.AsyncClient(base_url=url, limits=limites, timeout=30) as http:
+        # Aquecimento: conexões abertas e caches do servidor preenchidos antes de medir
+        await asyncio.gather(*(http.get(rota) for rota in rotas))
+        latencias, erros = [], []
+        fim = time.perf_counter() + duracao
+        await asyncio.gather(*(
+            _cliente_virtual(http, rotas, fim, latencias, erros, n) for n in range(concorrencia)
+        ))
+    latencias.sort()
+
+    def percentil(p: float) -> float:
+        return latencias[min(len(latencias) - 1, int(len(latencias) * p))] * 1000 if latencias else 0.0
+
+    return {
+        "rps": len(latencias) / duracao,
+        "p50": statistics.median(latencias) * 1000 if latencias else 0.0,
+        "p95": percentil(0.95),
+        "p99": percentil(0.99),
+        "erros": len(erros),
+    }
+
+
+async def principal(args) -> dict:
+    """Mede cada nível de concorrência e imprime a tabela. Retorna {concorrência: resultado}."""
+    rotas = _rotas(args)
+    print(f"Rotas: {', '.join(rotas)}")
+    print(f"{'concorrência':>12} | {'req/s':>8} | {'escala':>7} | {'p50 (ms)':>9} | {'p95 (ms)':>9} | {'p99 (ms)':>9} | {'erros':>6}")
+    print("-" * 78)
+    base = None
+    resultados = {}
+    for concorrencia in args.concorrencias:
+        r = resultados[concorrencia] = await medir(args.url, rotas, concorrencia, args.duracao)
+        base = base or r["rps"]
+        print(f"{concorrencia:>12} | {r['rps']:>8.1f} | {r['rps'] / max(base, 1e-9):>6.1f}x | "
+              f"{r['p50']:>9.1f} | {r['p95']:>9.1f} | {r['p99']:>9.1f} | {r['erros']:>6}")
+    print("\nescala = vazão / vazão com concorrência 1 (mesmo processo do servidor)")
+    return resultados
+
+
+# ==========================================
+# --comparar: servidor com latência injetada no banco
+# ==========================================
+
+class _SessaoSincrona:
+    """Session síncrona com a interface awaitable da AsyncSession que as rotas usam.
+
+    Cada consulta bloqueia o event loop até o banco responder — o modelo antigo
+    (SessionLocal dentro de rotas `async def`), para comparação.
+    """
+
+    def __init__(self, db):
+        self._db = db
+
+    async def execute(self, *args, **kwargs):
+        return self._db.execute(*args, **kwargs)
+
+    async def scalars(self, *args, **kwargs):
+        return self._db.scalars(*args, **kwargs)
+
+    async def scalar(self, *args, **kwargs):
+        return self._db.scalar(*args, **kwargs)
+
+    async def get(self, *args, **kwargs):
+        return self._db.get(*args, **kwargs)
+
+    async def flush(self):
+        self._db.flush()
+
+    async def commit(self):
+        self._db.commit()
+
+    async def rollback(self):
+        self._db.rollback()
+
+    async def run_sync(self, funcao, *args, **kwargs):
+        return funcao(self._db, *args, **kwargs)
+
+    def __getattr__(self, nome):
+        return getattr(self._db, nome)  # add, delete, ...
+
+
+def _atrasar_conexoes(motor, latencia: float):
+    """Cada statement espera `latencia` segundos na thread que o executa (a do event loop no
+    pysqlite, a da conexão no aiosqlite), antes de rodar no SQLite."""
+    from sqlalchemy import event
+
+    @event.listens_for(motor, "connect")
+    def _ao_conectar(conexao_dbapi, _registro):
+        aiosqlite = getattr(conexao_dbapi, "_connection", None)
+        sqlite = aiosqlite._conn if aiosqlite is not None else conexao_dbapi
+        sqlite.set_trace_callback(lambda _sql: time.sleep(latencia))
+
+
+def servir(args):
+    """Sobe o app (um worker) com a latência e o modelo de sessão pedidos."""
+    import uvicorn
+    import main
+    import models
+
+    if models.engine.url.get_backend_name() != "sqlite":
+        raise SystemExit("--latencia-banco só simula latência no SQLite; num Postgres a latência já é real")
+    latencia = args.latencia_banco / 1000
+    _atrasar_conexoes(models.engine, latencia)
+    _atrasar_conexoes(models.async_engine.sync_engine, latencia)
+    if args.modelo == "sincrono":
+        async def sessao_sincrona():
+            db = models.SessionLocal()
+            try:
+                yield _SessaoSincrona(db)
+            finally:
+                db.close()
+        main.app.dependency_overrides[main.get_db] = sessao_sincrona
+    uvicorn.run(main.app, host="127.0.0.1", port=args.porta, log_level="warning")
+
+
+def _popular(quantidade: int) -> str:
+    """Cria `quantidade` álbuns com fotos prontas no banco de DATABASE_URL. Retorna o hash de um deles."""
+    import json
+    import migracoes
+    import processamento
+    from models import SessionLocal, Album, Foto, Fotografo
+
+    migracoes.migrar()
+    db = SessionLocal()
+    try:
+        fotografo = Fotografo(nome="Bench", email="bench@exemplo.com", senha_hash="x")
+        db.add(fotografo)
+        db.flush()
+        for i in range(quantidade):
+            album = Album(titulo=f"Evento {i}", hash_url=uuid.uuid4().hex[:8], cidade=f"Cidade {i % 5}",
+                          categoria="Esportes", fotografo_id=fotografo.id)
+            db.add(album)
+            db.flush()
+            fotos = [Foto(album_id=album.id, caminho_alta_res=f"{uuid.uuid4().hex}.jpg",
+                          caminho_baixa_res=f"/static/vitrine/{uuid.uuid4().hex}.jpg", preco_baixa=5.0, preco_alta=15.0,
+                          status_processamento=processamento.STATUS_PRONTA, derivados=json.dumps({}),
+                          marca_dagua_versao=0)
+                     for _ in range(12)]
+            db.add_all(fotos)
+            db.flush()
+            album.qtd_fotos, album.capa_foto_id = len(fotos), fotos[0].id
+        db.commit()
+        return album.hash_url
+    finally:
+        db.close()
+
+
+async def _esperar_servidor(url: str, processo: subprocess.Popen):
+    async with httpx.AsyncClient(base_url=url) as http:
+        for _ in range(100):
+            if processo.poll() is not None:
+                raise SystemExit(f"O servidor de teste saiu com código {processo.returncode}")
+            try:
+                await http.get("/api/albuns")
+                return
+            except httpx.HTTPError:
+                await asyncio.sleep(0.2)
+    raise SystemExit("O servidor de teste não respondeu")
+
+
+def comparar(args):
+    pasta = tempfile.mkdtemp(prefix="bench_concorrencia_")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(pasta, 'bench.db')}"
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    args.album = args.album or _popular(args.albuns)
+    args.url = f"http://127.0.0.1:{args.porta}"
+    print(f"SQLite temporário com {args.albuns} álbuns, {args.latencia_banco:g} ms de latência por statement\n")
+
+    resultados = {}
+    try:
+        for modelo in MODELOS:
+            print(f"== sessão {modelo} ==")
+            processo = subprocess.Popen([
+                sys.executable, os.path.abspath(__file__), "--servir", "--modelo", modelo,
+                "--latencia-banco", str(args.latencia_banco), "--porta", str(args.porta),
+            ])
+            try:
+                asyncio.run(_esperar_servidor(args.url, processo))
+                resultados[modelo] = asyncio.run(principal(args))
+            finally:
+                processo.terminate()
+                processo.wait()
+            print()
+    finally:
+        shutil.rmtree(pasta, ignore_errors=True)
+
+    print(f"{'concorrência':>12} | {'async req/s':>11} | {'sync req/s':>10} | {'ganho':>6}")
+    print("-" * 50)
+    for concorrencia in args.concorrencias:
+        assincrono, sincrono = resultados["assincrono"][concorrencia]["rps"], resultados["sincrono"][concorrencia]["rps"]
+        print(f"{concorrencia:>12} | {assincrono:>11.1f} | {sincrono:>10.1f} | {assincrono / max(sincrono, 1e-9):>5.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--album", help="hash_url de um álbum com fotos (galeria e página do álbum)")
+    parser.add_argument("--pedido", type=int, help="id de um pedido (status do pagamento)")
+    parser.add_argument("--concorrencias", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument("--duracao", type=float, default=10.0, help="segundos medidos em cada nível")
+    parser.add_argument("--comparar", action="store_true",
+                        help="mede sessão assíncrona vs. síncrona num SQLite temporário com latência injetada")
+    parser.add_argument("--latencia-banco", type=float, default=5.0, help="ms por statement com --comparar")
+    parser.add_argument("--albuns", type=int, default=200, help="álbuns criados no banco do --comparar")
+    parser.add_argument("--porta", type=int, default=8765, help="porta do servidor do --comparar")
+    parser.add_argument("--servir", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--modelo", choices=MODELOS, default="assincrono", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.servir:
+        servir(args)
+    elif args.comparar:
+        comparar(args)
+    else:
+        asyncio.run(principal(args))
+
+
+if __name__ == "__main__":
+    main()
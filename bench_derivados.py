@@ -0,0 +1,160 @@
+"""Benchmark da geração de derivados: processamento.processar_foto com o
+original decodificado inteiro (caminho antigo) vs. reduzido pelo draft do JPEG.
+
+Os dois motores gravam os mesmos arquivos (escada de derivados com marca
+d'água e cópia limpa de 800px, orientação do EXIF aplicada); só o decode muda.
+
+Cada motor roda num processo novo, então o pico de memória (RSS) medido é só
+dele. Use fotos de câmera reais — o ganho do draft depende da resolução:
+
+Uso:
+    python bench_derivados.py --corpus ./amostras_camera
+    python bench_derivados.py --sinteticas 10 --megapixels 24 45 --repeticoes 3
+
+Com --sinteticas, gera JPEGs com ruído (o decode custa como o de uma foto
+real) e metade deles com EXIF de orientação 6 (retrato de câmera).
+"""
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+import multiprocessing
+
+import numpy as np
+from PIL import Image, ImageOps
+
+import processamento
+
+
+def _abrir_inteira(origem: str, lado_minimo: int) -> "tuple[Image.Image, int, bytes | None]":
+    """processamento.abrir_reduzida sem o draft: decode em resolução cheia, o resto igual."""
+    with Image.open(origem) as original:
+        maior_lado = max(original.size)
+        perfil_cor = original.info.get("icc_profile")
+        img = ImageOps.exif_transpose(original)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    img.info = {}
+    return img, maior_lado, perfil_cor
+
+
+def derivados_antigo(origem: str, destino_vitrine: str) -> dict:
+    """processamento.processar_foto decodificando o original inteiro.
+
+    Mesma escada, marca d'água, cópia limpa e arquivos de saída do motor novo:
+    a única diferença medida é o decode em escala cheia vs. o draft da DCT.
+    """
+    abrir_reduzida = processamento.abrir_reduzida
+    processamento.abrir_reduzida = _abrir_inteira
+    try:
+        return processamento.processar_foto(origem, destino_vitrine)
+    finally:
+        processamento.abrir_reduzida = abrir_reduzida
+
+
+MOTORES = {"antigo": derivados_antigo, "draft": processamento.processar_foto}
+
+
+def _rss_maximo_mb() -> float:
+    # No Linux, VmHWM: o ru_maxrss herda o RSS do processo pai no fork, antes do exec do spawn
+    try:
+        with open("/proc/self/status") as f:
+            return next(int(l.split()[1]) for l in f if l.startswith("VmHWM:")) / 1024
+    except (OSError, StopIteration):
+        pass
+    import resource
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return pico / 1024 / 1024 if os.uname().sysname == "Darwin" else pico / 1024  # bytes no macOS, KB no Linux
+
+
+def _rodar_motor(nome: str, arquivos: list, repeticoes: int, fila):
+    """Executado no processo filho: tempos por foto (s) e pico de RSS (MB)."""
+    saida = tempfile.mkdtemp(prefix=f"bench_{nome}_")
+    tempos = []
+    try:
+        # A cópia limpa é gravada ao lado do original: copia o corpus para não sujar a pasta de amostras
+        arquivos = [shutil.copy(origem, os.path.join(saida, f"{i}_original.jpg")) for i, origem in enumerate(arquivos)]
+        for _ in range(repeticoes):
+            for i, origem in enumerate(arquivos):
+                t0 = time.perf_counter()
+                MOTORES[nome](origem, os.path.join(saida, f"{i}_vitrine.jpg"))
+                tempos.append(time.perf_counter() - t0)
+        fila.put((tempos, _rss_maximo_mb()))
+    finally:
+        shutil.rmtree(saida, ignore_errors=True)
+
+
+def medir(nome: str, arquivos: list, repeticoes: int) -> dict:
+    contexto = multiprocessing.get_context("spawn")
+    fila = contexto.Queue()
+    processo = contexto.Process(target=_rodar_motor, args=(nome, arquivos, repeticoes, fila))
+    processo.start()
+    tempos, rss = fila.get()
+    processo.join()
+    return {"ms_media": statistics.mean(tempos) * 1000, "ms_p50": statistics.median(tempos) * 1000,
+            "ms_max": max(tempos) * 1000, "rss_mb": rss}
+
+
+def gerar_sinteticas(pasta: str, quantidade: int, megapixels: list) -> list:
+    rng = np.random.default_rng(0)
+    caminhos = []
+    for i in range(quantidade):
+        mp = megapixels[i % len(megapixels)]
+        largura = int((mp * 1e6 * 3 / 2) ** 0.5) // 4 * 4
+        altura = largura * 2 // 3 // 4 * 4
+        # Gradiente + ruído: sem o ruído o JPEG fica pequeno demais e o decode barato demais
+        base = np.linspace(0, 255, largura, dtype=np.float32)[None, :, None]
+        ruido = rng.normal(0, 18, (altura // 4, largura // 4, 3)).astype(np.float32)
+        ruido = np.kron(ruido, np.ones((4, 4, 1), np.float32))
+        pixels = np.clip(base + ruido + 40, 0, 255).astype(np.uint8)
+        exif = Image.Exif()
+        exif[0x010F] = "Camera"
+        exif[0x0112] = 6 if i % 2 else 1
+        caminho = os.path.join(pasta, f"sintetica_{i}_{mp}mp.jpg")
+        Image.fromarray(pixels).save(caminho, "JPEG", quality=92, exif=exif.tobytes())
+        caminhos.append(caminho)
+    return caminhos
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="pasta com JPEGs de câmera")
+    parser.add_argument("--sinteticas", type=int, default=0, help="gera N JPEGs sintéticos em vez de usar --corpus")
+    parser.add_argument("--megapixels", type=int, nargs="+", default=[24, 45])
+    parser.add_argument("--repeticoes", type=int, default=1, help="passadas sobre o corpus em cada motor")
+    args = parser.parse_args()
+
+    temporaria = None
+    if args.sinteticas:
+        temporaria = tempfile.mkdtemp(prefix="bench_corpus_")
+        arquivos = gerar_sinteticas(temporaria, args.sinteticas, args.megapixels)
+    elif args.corpus:
+        extensoes = (".jpg", ".jpeg")
+        arquivos = sorted(os.path.join(args.corpus, n) for n in os.listdir(args.corpus) if n.lower().endswith(extensoes))
+    else:
+        parser.error("informe --corpus ou --sinteticas")
+    if not arquivos:
+        raise SystemExit(f"Nenhum JPEG em {args.corpus}")
+
+    try:
+        tamanho_medio = statistics.mean(os.path.getsize(a) for a in arquivos) / 1024 / 1024
+        print(f"{len(arquivos)} fotos (média {tamanho_medio:.1f} MB), formatos {', '.join(processamento.FORMATOS_DERIVADOS)}, "
+              f"tamanhos {processamento.TAMANHOS_DERIVADOS}")
+        print(f"{'motor':>8} | {'ms/foto':>9} | {'p50 (ms)':>9} | {'máx (ms)':>9} | {'pico RSS (MB)':>14}")
+        print("-" * 62)
+        resultados = {}
+        for nome in MOTORES:
+            r = resultados[nome] = medir(nome, arquivos, args.repeticoes)
+            print(f"{nome:>8} | {r['ms_media']:>9.0f} | {r['ms_p50']:>9.0f} | {r['ms_max']:>9.0f} | {r['rss_mb']:>14.0f}")
+        antigo, novo = resultados["antigo"], resultados["draft"]
+        print(f"\nganho: {antigo['ms_media'] / novo['ms_media']:.1f}x no tempo, "
+              f"{antigo['rss_mb'] - novo['rss_mb']:.0f} MB a menos de pico por processo do pool")
+    finally:
+        if temporaria:
+            shutil.rmtree(temporaria, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Benchmark da busca facial: caminho antigo (decodifica + extrai rostos de cada
+foto a cada selfie) vs. índice pré-computado (uma distância vetorizada).
+
+Uso:
+    python bench_facial.py --fotos ./static/fotos_baixa_res --selfie minha_selfie.jpg
+    python bench_facial.py --fotos ./amostras --selfie s.jpg --tamanhos 50 200 2000 --max-antigo 200
+
+As fotos da pasta são repetidas em ciclo até atingir cada tamanho de álbum.
+Tamanhos acima de --max-antigo têm o tempo antigo extrapolado a partir do
+custo médio por foto (rodar 2.000 fotos pelo caminho antigo leva minutos).
+"""
+import os
+import time
+import argparse
+import itertools
+
+import numpy as np
+
+import facial
+
+
+def _listar_fotos(pasta: str) -> list:
+    extensoes = (".jpg", ".jpeg", ".png", ".webp")
+    return sorted(os.path.join(pasta, n) for n in os.listdir(pasta) if n.lower().endswith(extensoes))
+
+
+def busca_antiga(caminhos: list, selfie_encoding) -> list:
+    """Reproduz o loop antigo de /api/facial: load_image_file + face_encodings por foto."""
+    encontradas = []
+    for i, caminho in enumerate(caminhos):
+        fr = facial._carregar_fr()
+        img = fr.load_image_file(caminho)
+        encodings = fr.face_encodings(img)
+        if encodings and True in fr.compare_faces(encodings, selfie_encoding, tolerance=facial.TOLERANCIA):
+            encontradas.append(i)
+    return encontradas
+
+
+def busca_indexada(foto_ids: np.ndarray, blobs: list, selfie_encoding) -> list:
+    """Mesmo cálculo de facial.buscar_no_album, sem o SELECT."""
+    matriz = facial._empilhar(blobs)
+    distancias = np.linalg.norm(matriz - selfie_encoding, axis=1)
+    return np.unique(foto_ids[distancias <= facial.TOLERANCIA]).tolist()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fotos", required=True, help="pasta com fotos de amostra (vitrines)")
+    parser.add_argument("--selfie", required=True, help="arquivo da selfie")
+    parser.add_argument("--tamanhos", type=int, nargs="+", default=[50, 200, 500, 2000])
+    parser.add_argument("--max-antigo", type=int, default=200, help="maior álbum medido de fato no caminho antigo")
+    args = parser.parse_args()
+
+    if not facial._INSTALADO:
+        raise SystemExit("face_recognition não está instalado.")
+
+    amostras = _listar_fotos(args.fotos)
+    if not amostras:
+        raise SystemExit(f"Nenhuma imagem em {args.fotos}")
+    with open(args.selfie, "rb") as f:
+        selfie_encoding = facial.codificar_selfie(f.read())
+    if selfie_encoding is None:
+        raise SystemExit("Nenhum rosto na selfie.")
+
+    # Extração única (o que o upload faz) — encodings por foto de amostra
+    rostos_por_amostra = [[enc.tobytes() for enc, _ in facial.extrair_rostos(c)] for c in amostras]
+
+    print(f"{'fotos':>7} | {'antigo (s)':>12} | {'indexado (ms)':>14} | {'ganho':>9}")
+    print("-" * 52)
+    custo_por_foto = None
+    for tamanho in args.tamanhos:
+        caminhos = list(itertools.islice(itertools.cycle(amostras), tamanho))
+
+        if tamanho <= args.max_antigo or custo_por_foto is None:
+            t0 = time.perf_counter()
+            busca_antiga(caminhos, selfie_encoding)
+            antigo = time.perf_counter() - t0
+            custo_por_foto = antigo / tamanho
+            marca = ""
+        else:
+            antigo = custo_por_foto * tamanho
+            marca = "*"
+
+        foto_ids, blobs = [], []
+        for i, rostos in zip(range(tamanho), itertools.cycle(rostos_por_amostra)):
+            foto_ids.extend([i] * len(rostos))
+            blobs.extend(rostos)
+        foto_ids = np.asarray(foto_ids, dtype=np.int64)
+        repeticoes = 20
+        t0 = time.perf_counter()
+        for _ in range(repeticoes):
+            busca_indexada(foto_ids, blobs, selfie_encoding)
+        indexado = (time.perf_counter() - t0) / repeticoes
+
+        print(f"{tamanho:>7} | {antigo:>11.2f}{marca or ' '} | {indexado * 1000:>14.3f} | {antigo / max(indexado, 1e-9):>8.0f}x")
+    print("\n* extrapolado pelo custo médio por foto do último tamanho medido")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Cache em disco dos ZIPs de download, indexado pelo `token_download` do pedido.
+
+O ZIP é montado em segundo plano assim que o pagamento é aprovado, então o
+clique no link do e-mail (e os cliques repetidos, links compartilhados com a
+família...) vira um FileResponse com suporte a Range. O cache tem tamanho
+máximo (CACHE_ZIP_MAX_MB): ao estourar, saem primeiro os ZIPs acessados há
+mais tempo (o mtime é renovado a cada download). ZIPs de links expirados são
+apagados pela limpeza periódica.
+"""
+import os
+import uuid
+import asyncio
+from datetime import datetime, timedelta
+from typing import List
+
+from starlette.concurrency import run_in_threadpool
+
+from models import Pedido, SessionLocal
+from zip_stream import ZipStream, EntradaZip
+
+DIRETORIO_CACHE_ZIP = "./cache_downloads"
+CACHE_ZIP_MAX_BYTES = int(os.getenv("CACHE_ZIP_MAX_MB", "5120")) * 1024 * 1024
+INTERVALO_LIMPEZA_SEGUNDOS = 3600
+
+os.makedirs(DIRETORIO_CACHE_ZIP, exist_ok=True)
+
+
+def caminho_cache(token: str) -> str:
+    return os.path.join(DIRETORIO_CACHE_ZIP, f"{token}.zip")
+
+
+def obter(token: str) -> "str | None":
+    """Caminho do ZIP em cache (e renova sua posição no LRU), ou None."""
+    caminho = caminho_cache(token)
+    try:
+        os.utime(caminho)
+    except FileNotFoundError:
+        return None
+    return caminho
+
+
+def montar(token: str, entradas: List[EntradaZip]):
+    """Grava o ZIP do pedido no cache. Bloqueante — rode em background/threadpool."""
+    destino = caminho_cache(token)
+    temporario = f"{destino}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(temporario, "wb") as f:
+            for bloco in ZipStream(entradas):
+                f.write(bloco)
+        os.replace(temporario, destino)  # Atômico: nunca servimos um ZIP pela metade
+    except Exception as exc:
+        print(f"⚠️  Falha ao montar o ZIP em cache do token {token}: {exc}")
+        if os.path.exists(temporario):
+            os.remove(temporario)
+        return
+    aplicar_limite()
+
+
+def remover(token: str):
+    try:
+        os.remove(caminho_cache(token))
+    except FileNotFoundError:
+        pass
+
+
+def _arquivos_cache() -> list:
+    arquivos = []
+    for entrada in os.scandir(DIRETORIO_CACHE_ZIP):
+        if entrada.is_file() and entrada.name.endswith(".zip"):
+            st = entrada.stat()
+            arquivos.append((st.st_mtime, st.st_size, entrada.path))
+    return arquivos
+
+
+def aplicar_limite():
+    """Remove os ZIPs menos usados até o cache caber em CACHE_ZIP_MAX_BYTES."""
+    arquivos = _arquivos_cache()
+    total = sum(tamanho for _, tamanho, _ in arquivos)
+    for _, tamanho, caminho in sorted(arquivos):
+        if total <= CACHE_ZIP_MAX_BYTES:
+            break
+        try:
+            os.remove(caminho)
+            total -= tamanho
+        except FileNotFoundError:
+            pass
+
+
+def purgar_expirados(validade_dias: int) -> int:
+    """Apaga ZIPs cujo pedido não existe mais, não está pago ou teve o link expirado."""
+    tokens = {os.path.basename(c)[:-len(".zip")]: c for _, _, c in _arquivos_cache()}
+    if not tokens:
+        return 0
+    limite = datetime.utcnow() - timedelta(days=validade_dias)
+    db = SessionLocal()
+    try:
+        validos = {
+            token for (token,) in db.query(Pedido.token_download).filter(
+                Pedido.token_download.in_(list(tokens)),
+                Pedido.status_pagamento == "Pago",
+                Pedido.data_pedido >= limite,
+            )
+        }
+    finally:
+        db.close()
+    removidos = 0
+    for token, caminho in tokens.items():
+        if token not in validos:
+            try:
+                os.remove(caminho)
+                removidos += 1
+            except FileNotFoundError:
+                pass
+    return removidos
+
+
+async def limpeza_periodica(validade_dias: int):
+    """Loop de background: purga os ZIPs expirados de hora em hora."""
+    while True:
+        try:
+            removidos = await run_in_threadpool(purgar_expirados, validade_dias)
+            if removidos:
+                print(f"🧹 {removidos} ZIPs expirados removidos do cache.")
+        except Exception as exc:
+            print(f"⚠️  Falha na limpeza do cache de downloads: {exc}")
+        await asyncio.sleep(INTERVALO_LIMPEZA_SEGUNDOS)
@@ -0,0 +1,253 @@
+"""Caixa de entrada dos webhooks do Mercado Pago.
+
+O endpoint do webhook só grava a notificação crua em `notificacoes_webhook` e
+responde 200 na hora, sem falar com o Mercado Pago. Notificações repetidas do
+mesmo pagamento e ação (o MP reenvia até receber o 200) viram uma linha só.
+
+Um worker no processo web drena a caixa em lotes: reserva as pendentes,
+consulta os pagamentos no MP em paralelo e aplica a transição do pedido com
+UPDATE condicional (só sai de 'Pendente'; o pagamento aprovado também tira
+de 'Expirado' — PIX pago perto do vencimento, processado depois da varredura),
+então processar a mesma notificação duas vezes — reentrega, outro worker,
+retentativa — não paga nem notifica o pedido duas vezes. Falha na consulta volta para a fila com backoff;
+reservas de um worker que caiu expiram e são retomadas.
+"""
+import json
+import uuid
+import random
+import asyncio
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from starlette.concurrency import run_in_threadpool
+
+import emails
+import eventos_pedido
+import metricas
+from models import ItemPedido, NotificacaoWebhook, Pedido, SessionLocal
+from pagamento_pix import consultar_pagamento
+
+STATUS_PENDENTE = "Pendente"
+STATUS_PROCESSANDO = "Processando"
+STATUS_PROCESSADA = "Processada"
+STATUS_ERRO = "Erro"
+
+# Pedidos que um pagamento aprovado ainda pode levar a 'Pago'
+_STATUS_PAGAVEIS = ("Pendente", "Expirado")
+
+TAMANHO_LOTE = 50
+CONSULTAS_SIMULTANEAS = 10
+MAX_TENTATIVAS = 8
+BACKOFF_BASE_SEGUNDOS = 15
+RESERVA_EXPIRA_SEGUNDOS = 300
+INTERVALO_VARREDURA_SEGUNDOS = 30
+
+_acordar = asyncio.Event()
+
+
+# ==========================================
+# ENTRADA (endpoint do webhook)
+# ==========================================
+
+def registrar(db, payload: dict) -> bool:
+    """Grava a notificação de pagamento na caixa. Retorna False se o payload não for de pagamento."""
+    payment_id = (payload.get("data") or {}).get("id")
+    if payload.get("type") != "payment" or not payment_id:
+        return False
+    payment_id, acao = str(payment_id), str(payload.get("action") or "")
+    cru = json.dumps(payload, ensure_ascii=False)
+    try:
+        with db.begin_nested():
+            db.add(NotificacaoWebhook(payment_id=payment_id, acao=acao, payload=cru))
+    except IntegrityError:
+        # Já está na caixa. Se já foi processada, rearma: o MP repete a mesma ação
+        # ('payment.updated') quando o status muda, e a consulta é idempotente
+        db.query(NotificacaoWebhook).filter(
+            NotificacaoWebhook.payment_id == payment_id,
+            NotificacaoWebhook.acao == acao,
+            NotificacaoWebhook.status.in_((STATUS_PROCESSADA, STATUS_ERRO)),
+        ).update({
+            NotificacaoWebhook.status: STATUS_PENDENTE,
+            NotificacaoWebhook.payload: cru,
+            NotificacaoWebhook.tentativas: 0,
+            NotificacaoWebhook.proxima_tentativa_em: datetime.utcnow(),
+        }, synchronize_session=False)
+    db.commit()
+    return True
+
+
+def acordar():
+    """Avisa o worker que chegou notificação nova (chame depois do commit)."""
+    _acordar.set()
+
+
+# ==========================================
+# WORKER
+# ==========================================
+
+def _reservar_lote(reserva: str) -> list:
+    """Marca até TAMANHO_LOTE notificações prontas como nossas. Retorna [(id, payment_id, tentativas)]."""
+    agora = datetime.utcnow()
+    reserva_expirada = agora - timedelta(seconds=RESERVA_EXPIRA_SEGUNDOS)
+    db = SessionLocal()
+    try:
+        ids = [i for (i,) in db.query(NotificacaoWebhook.id).filter(
+            ((NotificacaoWebhook.status == STATUS_PENDENTE) & (NotificacaoWebhook.proxima_tentativa_em <= agora))
+            | ((NotificacaoWebhook.status == STATUS_PROCESSANDO) & (NotificacaoWebhook.reservada_em < reserva_expirada))
+        ).order_by(NotificacaoWebhook.id).limit(TAMANHO_LOTE)]
+        if not ids:
+            return []
+        # O UPDATE repete o filtro: se outro worker reservou no meio, a linha não é nossa
+        db.query(NotificacaoWebhook).filter(
+            NotificacaoWebhook.id.in_(ids),
+            (NotificacaoWebhook.status == STATUS_PENDENTE)
+            | ((NotificacaoWebhook.status == STATUS_PROCESSANDO) & (NotificacaoWebhook.reservada_em < reserva_expirada)),
+        ).update({
+            NotificacaoWebhook.status: STATUS_PROCESSANDO,
+            NotificacaoWebhook.reserva: reserva,
+            NotificacaoWebhook.reservada_em: agora,
+        }, synchronize_session=False)
+        db.commit()
+        return db.query(
+            NotificacaoWebhook.id, NotificacaoWebhook.payment_id, NotificacaoWebhook.tentativas,
+        ).filter(NotificacaoWebhook.reserva == reserva, NotificacaoWebhook.status == STATUS_PROCESSANDO).all()
+    finally:
+        db.close()
+
+
+def _pedido_a_verificar(payment_id: str) -> "tuple | None":
+    """(pedido_id, token do fotógrafo) se o pagamento for de um pedido ainda não pago ('Pendente' ou 'Expirado')."""
+    db = SessionLocal()
+    try:
+        pedido = db.query(Pedido).filter(Pedido.pix_txid == payment_id).first()
+        if not pedido or pedido.status_pagamento not in _STATUS_PAGAVEIS or not pedido.fotografo.mp_access_token:
+            return None
+        return pedido.id, pedido.fotografo.mp_access_token
+    finally:
+        db.close()
+
+
+def _aplicar_status(pedido_id: int, payment_id: str, mp_status: str) -> "str | None":
+    """Aplica o status do MP ao pedido ainda não pago. Retorna o novo status, se mudou.
+
+    'approved' vale também para o pedido já 'Expirado' pela varredura: o PIX (o mesmo pix_txid) foi pago.
+    """
+    db = SessionLocal()
+    try:
+        do_pagamento = (Pedido.id == pedido_id, Pedido.pix_txid == payment_id)
+        filtro = (*do_pagamento, Pedido.status_pagamento == "Pendente")
+        if mp_status == "approved":
+            pagavel = (*do_pagamento, Pedido.status_pagamento.in_(_STATUS_PAGAVEIS))
+            if not db.query(Pedido).filter(*pagavel).update({Pedido.status_pagamento: "Pago"}, synchronize_session=False):
+                return None  # Outro worker chegou antes
+            pedido = db.query(Pedido).filter(Pedido.id == pedido_id).first()
+            metricas.registrar_pagamento(db, pedido)
+            # Link de download para o cliente: na caixa de saída, na mesma transação do 'Pago'
+            emails.enfileirar_download(
+                db, pedido.id,
+                email_cliente=pedido.cliente.email,
+                nome_cliente=pedido.cliente.nome or "Cliente",
+                token_download=pedido.token_download,
+                qtd_fotos=db.query(func.count(ItemPedido.id)).filter(ItemPedido.pedido_id == pedido.id).scalar(),
+            )
+            db.commit()
+            metricas.invalidar_fotografo(pedido.fotografo_id)
+            print(f"\n💰 SUCESSO! Pedido {pedido_id} foi pago.")
+            return "Pago"
+        if mp_status in ("cancelled", "expired"):
+            if db.query(Pedido).filter(*filtro).update({Pedido.status_pagamento: "Expirado"}, synchronize_session=False):
+                db.commit()
+                print(f"\n⏰ Pedido {pedido_id} expirado/cancelado no MP.")
+                return "Expirado"
+        return None
+    finally:
+        db.close()
+
+
+def _concluir(notificacao_id: int, reserva: str, tentativas: int, erro: Optional[str] = None):
+    """Fecha a notificação, ou devolve à fila com backoff se a consulta falhou."""
+    db = SessionLocal()
+    try:
+        agora = datetime.utcnow()
+        if erro is None:
+            valores = {NotificacaoWebhook.status: STATUS_PROCESSADA, NotificacaoWebhook.processada_em: agora,
+                       NotificacaoWebhook.ultimo_erro: None}
+        else:
+            tentativas += 1
+            espera = BACKOFF_BASE_SEGUNDOS * (2 ** (tentativas - 1)) * (0.5 + random.random())
+            valores = {
+                NotificacaoWebhook.status: STATUS_ERRO if tentativas >= MAX_TENTATIVAS else STATUS_PENDENTE,
+                NotificacaoWebhook.tentativas: tentativas,
+                NotificacaoWebhook.proxima_tentativa_em: agora + timedelta(seconds=espera),
+                NotificacaoWebhook.ultimo_erro: erro,
+            }
+        # Só fecha se a reserva ainda for nossa (não expirou e foi pega por outro worker)
+        db.query(NotificacaoWebhook).filter(
+            NotificacaoWebhook.id == notificacao_id, NotificacaoWebhook.reserva == reserva,
+        ).update(valores, synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+async def _processar(notificacao, reserva: str, limite: asyncio.Semaphore, ao_pagar: Optional[Callable[[int], None]]):
+    notificacao_id, payment_id, tentativas = notificacao
+    try:
+        alvo = await run_in_threadpool(_pedido_a_verificar, payment_id)
+        if alvo is None:
+            # Pedido já pago/expirado, ou pagamento que não é nosso: nada a fazer
+            await run_in_threadpool(_concluir, notificacao_id, reserva, tentativas)
+            return
+        pedido_id, token = alvo
+        async with limite:
+            payment_info = await consultar_pagamento(token, payment_id)
+        if payment_info is None:
+            await run_in_threadpool(_concluir, notificacao_id, reserva, tentativas, "Falha ao consultar o pagamento no MP")
+            return
+        novo_status = await run_in_threadpool(_aplicar_status, pedido_id, payment_id, payment_info.get("status"))
+        await run_in_threadpool(_concluir, notificacao_id, reserva, tentativas)
+    except Exception as exc:
+        print(f"⚠️  Falha ao processar a notificação {notificacao_id}: {exc!r}")
+        await run_in_threadpool(_concluir, notificacao_id, reserva, tentativas, repr(exc))
+        return
+    if novo_status is None:
+        return
+    # Avisa na hora a tela de pagamento que está acompanhando o pedido (SSE)
+    eventos_pedido.publicar(pedido_id, novo_status)
+    if novo_status != "Pago":
+        return
+    emails.acordar()
+    if ao_pagar is not None:
+        try:
+            await run_in_threadpool(ao_pagar, pedido_id)
+        except Exception as exc:
+            print(f"⚠️  Falha no pós-pagamento do pedido {pedido_id}: {exc!r}")
+
+
+async def drenar(ao_pagar: Optional[Callable[[int], None]] = None) -> int:
+    """Processa a caixa em lotes até esvaziar o que está pronto. Retorna quantas notificações tratou."""
+    limite = asyncio.Semaphore(CONSULTAS_SIMULTANEAS)
+    total = 0
+    while True:
+        reserva = uuid.uuid4().hex
+        lote = await run_in_threadpool(_reservar_lote, reserva)
+        if not lote:
+            return total
+        await asyncio.gather(*(_processar(n, reserva, limite, ao_pagar) for n in lote))
+        total += len(lote)
+
+
+async def processar_periodicamente(ao_pagar: Optional[Callable[[int], None]] = None):
+    """Loop de background: drena quando o webhook avisa, e varre a caixa de tempos em tempos (retentativas)."""
+    while True:
+        _acordar.clear()
+        try:
+            await drenar(ao_pagar)
+        except Exception as exc:
+            print(f"⚠️  Falha ao drenar a caixa de webhooks: {exc!r}")
+        try:
+            await asyncio.wait_for(_acordar.wait(), timeout=INTERVALO_VARREDURA_SEGUNDOS)
+        except asyncio.TimeoutError:
+            pass
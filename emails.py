@@ -0,0 +1,260 @@
+"""E-mails transacionais com caixa de saída.
+
+Quem dispara um e-mail só grava a mensagem pronta em `emails_saida`, na mesma
+transação do evento (ex.: o pedido virando 'Pago'): se a transação cair, o
+e-mail não existe; se ela for commitada, o e-mail sai mesmo que o processo
+reinicie logo depois.
+
+Um worker no processo web envia a fila em lotes por uma única sessão SMTP
+autenticada (EHLO/STARTTLS/login uma vez), mantida aberta enquanto chegarem
+mensagens e fechada depois de um intervalo ocioso. Falha temporária (conexão,
+4xx) volta para a fila com backoff; recusa definitiva (5xx) vai para 'Erro'.
+
+Teste local sem servidor de verdade:
+    python -m aiosmtpd -n -l localhost:8025
+    SMTP_HOST=localhost SMTP_PORT=8025 SMTP_STARTTLS=0
+"""
+import os
+import uuid
+import random
+import asyncio
+import smtplib
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+from starlette.concurrency import run_in_threadpool
+
+from models import EmailSaida, SessionLocal
+
+# Configuração SMTP para notificações automáticas
+SMTP_HOST = os.getenv("SMTP_HOST", "")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_USER = os.getenv("SMTP_USER", "")
+SMTP_PASS = os.getenv("SMTP_PASS", "")
+SMTP_FROM = os.getenv("SMTP_FROM", SMTP_USER)
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "1") != "0"
+SMTP_TIMEOUT_SEGUNDOS = 10
+
+BASE_URL = os.getenv("BASE_URL", "https://yshpics.com")
+
+STATUS_PENDENTE = "Pendente"
+STATUS_ENVIANDO = "Enviando"
+STATUS_ENVIADO = "Enviado"
+STATUS_ERRO = "Erro"
+
+TAMANHO_LOTE = 100
+MAX_TENTATIVAS = 6
+BACKOFF_BASE_SEGUNDOS = 30
+RESERVA_EXPIRA_SEGUNDOS = 600
+INTERVALO_VARREDURA_SEGUNDOS = 30
+
+_acordar = asyncio.Event()
+
+
+def smtp_configurado() -> bool:
+    return bool(SMTP_HOST)
+
+
+# ==========================================
+# ENFILEIRAMENTO (na transação de quem dispara)
+# ==========================================
+
+def enfileirar(db, destinatario: str, assunto: str, html: str, pedido_id: "int | None" = None):
+    """Adiciona o e-mail à caixa de saída. Não faz commit — vai junto com a transação do chamador."""
+    if not smtp_configurado():
+        return
+    db.add(EmailSaida(pedido_id=pedido_id, destinatario=destinatario, assunto=assunto, html=html))
+
+
+def enfileirar_download(db, pedido_id: int, email_cliente: str, nome_cliente: str, token_download: str, qtd_fotos: int):
+    """E-mail com o link de download, enviado ao cliente quando o pagamento é confirmado."""
+    link = f"{BASE_URL}/baixar/{token_download}"
+    html = f"""
+        <div style="font-family:Inter,sans-serif;max-width:520px;margin:0 auto;padding:32px 24px;color:#1f2937;">
+          <h2 style="color:#3b82f6;font-size:1.5rem;margin:0 0 8px;">Pagamento confirmado! 🎉</h2>
+          <p style="margin:0 0 20px;color:#6b7280;">Olá, <strong>{nome_cliente}</strong>! Suas <strong>{qtd_fotos} foto{'s' if qtd_fotos != 1 else ''}</strong> em alta resolução estão prontas para download.</p>
+          <a href="{link}" style="display:inline-block;background:#3b82f6;color:#fff;font-weight:700;padding:14px 32px;border-radius:12px;text-decoration:none;font-size:1rem;">
+            Baixar minhas fotos (ZIP)
+          </a>
+          <p style="margin:24px 0 0;font-size:0.8rem;color:#9ca3af;">O link expira em 7 dias. Caso precise de ajuda, responda este e-mail.</p>
+        </div>
+        """
+    enfileirar(db, email_cliente, "✅ Suas fotos estão prontas! — yshpics", html, pedido_id=pedido_id)
+
+
+def acordar():
+    """Avisa o worker que há e-mail novo na fila (chame depois do commit, de dentro do event loop)."""
+    _acordar.set()
+
+
+def profundidade_fila(db) -> dict:
+    """Tamanho da caixa de saída, para monitoramento."""
+    contagens = dict(db.query(EmailSaida.status, func.count(EmailSaida.id)).filter(
+        EmailSaida.status.in_((STATUS_PENDENTE, STATUS_ENVIANDO, STATUS_ERRO))
+    ).group_by(EmailSaida.status).all())
+    mais_antigo = db.query(func.min(EmailSaida.criado_em)).filter(
+        EmailSaida.status.in_((STATUS_PENDENTE, STATUS_ENVIANDO))
+    ).scalar()
+    return {
+        "pendentes": contagens.get(STATUS_PENDENTE, 0),
+        "enviando": contagens.get(STATUS_ENVIANDO, 0),
+        "com_erro": contagens.get(STATUS_ERRO, 0),
+        "mais_antigo_em": mais_antigo.strftime("%Y-%m-%dT%H:%M:%S") if mais_antigo else None,
+    }
+
+
+# ==========================================
+# WORKER
+# ==========================================
+
+class _SessaoSMTP:
+    """Uma conexão SMTP autenticada, reaproveitada entre mensagens e lotes."""
+
+    def __init__(self):
+        self._smtp: "smtplib.SMTP | None" = None
+
+    def obter(self) -> smtplib.SMTP:
+        if self._smtp is not None:
+            try:
+                if self._smtp.noop()[0] == 250:
+                    return self._smtp
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.fechar()
+        smtp = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT_SEGUNDOS)
+        try:
+            smtp.ehlo()
+            if SMTP_STARTTLS:
+                smtp.starttls()
+                smtp.ehlo()
+            if SMTP_USER:
+                smtp.login(SMTP_USER, SMTP_PASS)
+        except Exception:
+            smtp.close()
+            raise
+        self._smtp = smtp
+        return smtp
+
+    def fechar(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                self._smtp.close()
+            self._smtp = None
+
+
+_sessao = _SessaoSMTP()
+
+
+def _montar_mensagem(email: EmailSaida) -> str:
+    msg = MIMEMultipart("alternative")
+    msg["Subject"] = email.assunto
+    msg["From"] = f"yshpics <{SMTP_FROM}>"
+    msg["To"] = email.destinatario
+    msg.attach(MIMEText(email.html, "html"))
+    return msg.as_string()
+
+
+def _falha_definitiva(exc: Exception) -> bool:
+    """Recusa permanente do servidor (5xx): repetir não adianta."""
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        return all(codigo >= 500 for codigo, _ in exc.recipients.values())
+    return isinstance(exc, smtplib.SMTPResponseException) and exc.smtp_code >= 500
+
+
+def _reagendar(email: EmailSaida, erro: str, contar_tentativa: bool = True):
+    if contar_tentativa:
+        email.tentativas = (email.tentativas or 0) + 1
+    email.ultimo_erro = erro
+    espera = BACKOFF_BASE_SEGUNDOS * (2 ** max(email.tentativas - 1, 0)) * (0.5 + random.random())
+    email.status = STATUS_PENDENTE
+    email.proxima_tentativa_em = datetime.utcnow() + timedelta(seconds=espera)
+    email.reserva = None
+
+
+def _enviar_lote() -> int:
+    """Reserva um lote da fila e envia pela sessão compartilhada. Bloqueante — roda no threadpool.
+
+    O status de cada mensagem é commitado logo depois do envio; uma queda no
+    meio do lote só deixa em 'Enviando' (e reenvia quando a reserva vencer)
+    o que ainda não tinha saído.
+    """
+    agora = datetime.utcnow()
+    reserva = uuid.uuid4().hex
+    db = SessionLocal()
+    try:
+        prontos = (
+            ((EmailSaida.status == STATUS_PENDENTE) & (EmailSaida.proxima_tentativa_em <= agora))
+            | ((EmailSaida.status == STATUS_ENVIANDO)
+               & (EmailSaida.reservada_em < agora - timedelta(seconds=RESERVA_EXPIRA_SEGUNDOS)))
+        )
+        ids = [i for (i,) in db.query(EmailSaida.id).filter(prontos).order_by(EmailSaida.id).limit(TAMANHO_LOTE)]
+        if not ids:
+            return 0
+        # O UPDATE repete o filtro: o que outro processo reservou no meio não vem para nós
+        db.query(EmailSaida).filter(EmailSaida.id.in_(ids), prontos).update(
+            {EmailSaida.status: STATUS_ENVIANDO, EmailSaida.reserva: reserva, EmailSaida.reservada_em: agora},
+            synchronize_session=False,
+        )
+        db.commit()
+        lote = db.query(EmailSaida).filter(EmailSaida.reserva == reserva).order_by(EmailSaida.id).all()
+
+        for indice, email in enumerate(lote):
+            try:
+                smtp = _sessao.obter()
+            except Exception as exc:
+                # Servidor fora ou login recusado: o lote inteiro volta, sem gastar tentativa
+                print(f"⚠️  Sem conexão SMTP ({exc!r}); {len(lote) - indice} e-mails voltam para a fila.")
+                for restante in lote[indice:]:
+                    _reagendar(restante, repr(exc), contar_tentativa=False)
+                break
+            try:
+                smtp.sendmail(SMTP_FROM, [email.destinatario], _montar_mensagem(email))
+            except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused) as exc:
+                # O servidor recusou só esta mensagem; a sessão segue boa
+                if _falha_definitiva(exc) or (email.tentativas or 0) + 1 >= MAX_TENTATIVAS:
+                    email.tentativas = (email.tentativas or 0) + 1
+                    email.status = STATUS_ERRO
+                    email.ultimo_erro = repr(exc)
+                    print(f"⚠️  E-mail {email.id} para {email.destinatario} desistido: {exc}")
+                else:
+                    _reagendar(email, repr(exc))
+            except Exception as exc:
+                # Conexão caiu no meio do envio: só a mensagem em curso gasta tentativa
+                print(f"⚠️  Sessão SMTP perdida ({exc!r}); {len(lote) - indice} e-mails voltam para a fila.")
+                _sessao.fechar()
+                _reagendar(email, repr(exc))
+                for restante in lote[indice + 1:]:
+                    _reagendar(restante, repr(exc), contar_tentativa=False)
+                break
+            else:
+                email.status = STATUS_ENVIADO
+                email.enviado_em = datetime.utcnow()
+                email.ultimo_erro = None
+                email.reserva = None
+            # Commit por mensagem: se o processo cair no meio do lote, o que já saiu não é reenviado
+            db.commit()
+        db.commit()
+        return len(lote)
+    finally:
+        db.close()
+
+
+async def enviar_periodicamente():
+    """Loop de background: esvazia a caixa de saída quando acordado ou a cada INTERVALO_VARREDURA_SEGUNDOS."""
+    while True:
+        _acordar.clear()
+        if smtp_configurado():
+            try:
+                while await run_in_threadpool(_enviar_lote):
+                    pass
+            except Exception as exc:
+                print(f"⚠️  Falha ao enviar a caixa de saída de e-mails: {exc!r}")
+        try:
+            await asyncio.wait_for(_acordar.wait(), timeout=INTERVALO_VARREDURA_SEGUNDOS)
+        except asyncio.TimeoutError:
+            # Um intervalo inteiro sem e-mail novo: não segura a conexão aberta à toa
+            await run_in_threadpool(_sessao.fechar)
@@ -0,0 +1,38 @@
+"""Pub/sub em memória das mudanças de status dos pedidos.
+
+A tela de pagamento assina o pedido por Server-Sent Events e recebe o 'Pago'
+no mesmo instante em que o worker da caixa de webhooks aplica a transição,
+sem ficar consultando o banco. Só vale dentro do processo: com vários workers
+web, a conexão SSE pode estar num processo diferente do que processou o
+webhook, e é a rechecagem periódica do stream que cobre esse caso.
+
+Tudo aqui roda no event loop (publicar e assinar não são thread-safe).
+"""
+import asyncio
+from contextlib import contextmanager
+
+_assinantes = {}  # pedido_id -> set de asyncio.Queue
+
+
+def publicar(pedido_id: int, status: str):
+    """Entrega o novo status a quem está acompanhando o pedido neste processo."""
+    for fila in list(_assinantes.get(pedido_id, ())):
+        try:
+            fila.put_nowait(status)
+        except asyncio.QueueFull:
+            pass  # Assinante travado; a rechecagem do stream pega o status do banco
+
+
+@contextmanager
+def assinar(pedido_id: int):
+    """Fila com os status publicados para o pedido enquanto o bloco estiver aberto."""
+    fila = asyncio.Queue(maxsize=8)
+    _assinantes.setdefault(pedido_id, set()).add(fila)
+    try:
+        yield fila
+    finally:
+        filas = _assinantes.get(pedido_id)
+        if filas is not None:
+            filas.discard(fila)
+            if not filas:
+                del _assinantes[pedido_id]
@@ -0,0 +1,73 @@
+"""Expiração dos pedidos PIX não pagos.
+
+Uma varredura periódica marca como 'Expirado', num único UPDATE pelo índice
+(status_pagamento, pix_expiracao), todos os pedidos pendentes cujo PIX já
+venceu — inclusive os que ninguém voltou a abrir. As telas e o endpoint de
+status só leem: entre o vencimento e a próxima varredura, mostram o pedido
+vencido como expirado sem gravar nada. Pedidos sem pix_expiracao (anteriores
+ao campo) vencem por data_pedido + EXPIRACAO_PADRAO, como em `expiracao()`.
+
+Expirar não é definitivo: se o webhook do PIX pago chegar depois da
+varredura, o pedido vai de 'Expirado' para 'Pago' (ver caixa_webhook).
+"""
+import asyncio
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, or_, update
+from starlette.concurrency import run_in_threadpool
+
+import eventos_pedido
+import qr_pix
+from models import Pedido, SessionLocal
+
+# Pedidos anteriores ao campo pix_expiracao vencem 30 min depois de criados
+EXPIRACAO_PADRAO = timedelta(minutes=30)
+INTERVALO_VARREDURA_SEGUNDOS = 60
+
+
+def expiracao(pix_expiracao: "datetime | None", data_pedido: datetime) -> datetime:
+    return pix_expiracao or (data_pedido + EXPIRACAO_PADRAO)
+
+
+def status_visivel(status: str, pix_expiracao: "datetime | None", data_pedido: datetime) -> str:
+    """Status para exibir: 'Expirado' se o PIX venceu e a varredura ainda não passou."""
+    if status == "Pendente" and datetime.utcnow() > expiracao(pix_expiracao, data_pedido):
+        return "Expirado"
+    return status
+
+
+def expirar_vencidos() -> list:
+    """Expira de uma vez os pedidos pendentes com PIX vencido. Retorna os ids afetados."""
+    agora = datetime.utcnow()
+    vencido = or_(
+        Pedido.pix_expiracao < agora,
+        and_(Pedido.pix_expiracao.is_(None), Pedido.data_pedido < agora - EXPIRACAO_PADRAO),
+    )
+    db = SessionLocal()
+    try:
+        ids = db.execute(
+            update(Pedido)
+            .where(Pedido.status_pagamento == "Pendente", vencido)
+            .values(status_pagamento="Expirado")
+            .returning(Pedido.id)
+            .execution_options(synchronize_session=False)
+        ).scalars().all()
+        db.commit()
+        return ids
+    finally:
+        db.close()
+
+
+async def varrer_periodicamente():
+    """Loop de background: expira os PIX vencidos (e apaga QRs antigos) a cada INTERVALO_VARREDURA_SEGUNDOS."""
+    while True:
+        try:
+            ids = await run_in_threadpool(expirar_vencidos)
+            for pedido_id in ids:
+                eventos_pedido.publicar(pedido_id, "Expirado")
+            if ids:
+                print(f"⏰ {len(ids)} pedidos com PIX vencido marcados como expirados.")
+            await run_in_threadpool(qr_pix.purgar_antigos)
+        except Exception as exc:
+            print(f"⚠️  Falha na varredura de PIX vencidos: {exc!r}")
+        await asyncio.sleep(INTERVALO_VARREDURA_SEGUNDOS)
@@ -0,0 +1,443 @@
+"""Índice facial do yshpics.
+
+Os encodings dos rostos são extraídos uma única vez, quando a foto entra no
+sistema, e gravados em `rostos_foto`. A busca por selfie carrega os encodings
+do álbum numa matriz NumPy e calcula todas as distâncias de uma vez.
+
+O `face_recognition` (dlib + modelos, segundos de import e centenas de MB) não
+é importado no processo web: detecção e encoding rodam num pool de processos
+próprio, iniciado na primeira vez que alguém precisa dele, que carrega os
+modelos uma vez por processo. FACE_RECOGNITION_DISPONIVEL reflete a saúde
+desse pool — se um processo morre ou o import falha, a busca facial fica
+indisponível e o pool é recriado depois de REINICIO_POOL_SEGUNDOS.
+
+O pool tem FACIAL_WORKERS vagas. Selfies passam na frente da extração do
+upload, e a fila de selfies é curta (FILA_SELFIES_MAX): cheia, a busca é
+recusada na hora com uma estimativa de quando tentar de novo, em vez de
+acumular espera. O encoding de cada selfie fica em cache pelo hash do arquivo
+(o mesmo convidado repete a busca, a família usa a mesma selfie em vários
+álbuns). `estatisticas()` separa tempo de fila e de cálculo.
+
+Backfill de álbuns antigos:
+    python facial.py                 # todas as fotos ainda não indexadas
+    python facial.py --album a1b2c3  # só um álbum (pelo hash_url)
+    python facial.py --refazer       # reindexa tudo do zero
+"""
+import os
+import io
+import math
+import time
+import asyncio
+import hashlib
+import argparse
+import importlib.util
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+from models import Album, Foto, RostoFoto, engine
+
+# Reconhecimento facial — opcional, e só importado dentro dos processos do pool (ou do backfill)
+_INSTALADO = importlib.util.find_spec("face_recognition") is not None
+_fr = None
+
+# True enquanto o pool facial está saudável (ou ainda não foi iniciado e a biblioteca existe)
+FACE_RECOGNITION_DISPONIVEL = _INSTALADO
+
+TOLERANCIA = 0.55       # Mesma tolerância do antigo compare_faces
+DIMENSOES = 128         # Tamanho do encoding do dlib
+
+# Processos do pool facial; cada um carrega os modelos do dlib (~100–200 MB)
+FACIAL_WORKERS = int(os.getenv("FACIAL_WORKERS", "1"))
+REINICIO_POOL_SEGUNDOS = 60
+
+# Selfies esperando vaga no pool além das que estão sendo calculadas; acima disso, "ocupado"
+FILA_SELFIES_MAX = int(os.getenv("FILA_SELFIES_MAX", "0")) or 4 * FACIAL_WORKERS
+SELFIE_CACHE_TTL_SEGUNDOS = 900
+SELFIE_CACHE_MAX = 2000
+
+_pool: "ProcessPoolExecutor | None" = None
+_indisponivel_ate = 0.0
+
+
+class FacialIndisponivel(RuntimeError):
+    """O pool facial não está de pé (biblioteca ausente ou processo que caiu)."""
+
+
+class FacialOcupado(RuntimeError):
+    """Fila de selfies cheia; `tentar_em` é a estimativa (s) para a fila andar."""
+
+    def __init__(self, tentar_em: int):
+        super().__init__(f"Busca facial ocupada, tente em {tentar_em}s")
+        self.tentar_em = tentar_em
+
+
+def _carregar_fr():
+    """Importa o face_recognition neste processo (só nos processos do pool e no backfill)."""
+    global _fr
+    if _fr is None:
+        import face_recognition
+        _fr = face_recognition
+    return _fr
+
+
+def extrair_rostos(imagem) -> list:
+    """Retorna [(encoding float32, (top, right, bottom, left)), ...] para um caminho, arquivo ou array."""
+    fr = _carregar_fr()
+    if isinstance(imagem, (str, bytes, io.IOBase)):
+        imagem = fr.load_image_file(imagem)
+    caixas = fr.face_locations(imagem)
+    if not caixas:
+        return []
+    encodings = fr.face_encodings(imagem, known_face_locations=caixas)
+    return [(np.asarray(enc, dtype=np.float32), caixa) for enc, caixa in zip(encodings, caixas)]
+
+
+def codificar_selfie(selfie_bytes: bytes) -> "np.ndarray | None":
+    """Encoding do primeiro rosto da selfie, ou None se nenhum rosto foi detectado."""
+    fr = _carregar_fr()
+    imagem = fr.load_image_file(io.BytesIO(selfie_bytes))
+    encodings = fr.face_encodings(imagem)
+    if not encodings:
+        return None
+    return np.asarray(encodings[0], dtype=np.float32)
+
+
+def _rostos_serializados(caminho: str) -> list:
+    """extrair_rostos com os encodings já em bytes, no formato gravado em `rostos_foto`."""
+    return [(enc.tobytes(), caixa) for enc, caixa in extrair_rostos(caminho)]
+
+
+# ==========================================
+# POOL FACIAL (chamado pelo processo web)
+# ==========================================
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # O initializer carrega os modelos na subida de cada processo, não na primeira selfie
+        _pool = ProcessPoolExecutor(max_workers=FACIAL_WORKERS, initializer=_carregar_fr)
+    return _pool
+
+
+def _pool_caiu(exc: Exception):
+    global _pool, _indisponivel_ate, FACE_RECOGNITION_DISPONIVEL
+    print(f"⚠️  Pool facial indisponível, nova tentativa em {REINICIO_POOL_SEGUNDOS}s: {exc!r}")
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+    FACE_RECOGNITION_DISPONIVEL = False
+    _indisponivel_ate = time.monotonic() + REINICIO_POOL_SEGUNDOS
+
+
+def disponivel() -> bool:
+    """Se vale mandar trabalho ao pool agora. Depois de uma queda, libera uma nova tentativa passado o intervalo."""
+    global FACE_RECOGNITION_DISPONIVEL
+    if _INSTALADO and not FACE_RECOGNITION_DISPONIVEL and time.monotonic() >= _indisponivel_ate:
+        FACE_RECOGNITION_DISPONIVEL = True
+    return FACE_RECOGNITION_DISPONIVEL
+
+
+class _Admissao:
+    """Vagas do pool facial (uma por processo). Quem espera selfie passa na frente do upload.
+
+    Roda só no event loop, como eventos_pedido.
+    """
+
+    def __init__(self):
+        self.em_uso = 0
+        self.filas = {True: deque(), False: deque()}  # interativa? -> futures esperando vaga
+
+    def esperando(self, interativa: bool) -> int:
+        return len(self.filas[interativa])
+
+    async def entrar(self, interativa: bool):
+        if self.em_uso < FACIAL_WORKERS and not self.filas[True] and not self.filas[False]:
+            self.em_uso += 1
+            return
+        vaga = asyncio.get_running_loop().create_future()
+        self.filas[interativa].append(vaga)
+        try:
+            await vaga
+        except asyncio.CancelledError:
+            if vaga.done() and not vaga.cancelled():
+                self.sair()  # A vaga chegou junto com o cancelamento: devolve
+            else:
+                try:
+                    self.filas[interativa].remove(vaga)
+                except ValueError:
+                    pass
+            raise
+
+    def sair(self):
+        # A vaga passa direto para o próximo da fila (selfies primeiro)
+        for fila in (self.filas[True], self.filas[False]):
+            while fila:
+                vaga = fila.popleft()
+                if not vaga.done():
+                    vaga.set_result(None)
+                    return
+        self.em_uso -= 1
+
+
+class _Medicoes:
+    """Tempo de fila vs. de cálculo no pool, por tipo de trabalho."""
+
+    def __init__(self):
+        self.recentes = deque(maxlen=500)  # (tipo, espera, calculo)
+        self.contadores = {"cache_acertos": 0, "cache_erros": 0, "recusadas": 0}
+        self.calculo_medio = {"selfie": 1.0, "vitrine": 1.0}  # Média móvel (s), base da estimativa do "tente em"
+
+    def registrar(self, tipo: str, espera: float, calculo: float):
+        self.recentes.append((tipo, espera, calculo))
+        self.calculo_medio[tipo] = 0.8 * self.calculo_medio[tipo] + 0.2 * calculo
+
+    def resumo(self) -> dict:
+        resumo = {}
+        for tipo in ("selfie", "vitrine"):
+            linhas = [(e, c) for t, e, c in self.recentes if t == tipo]
+            if not linhas:
+                resumo[tipo] = {"amostras": 0}
+                continue
+            esperas, calculos = np.array(linhas).T * 1000
+            resumo[tipo] = {
+                "amostras": len(linhas),
+                "espera_p50_ms": round(float(np.percentile(esperas, 50)), 1),
+                "espera_p95_ms": round(float(np.percentile(esperas, 95)), 1),
+                "calculo_p50_ms": round(float(np.percentile(calculos, 50)), 1),
+                "calculo_p95_ms": round(float(np.percentile(calculos, 95)), 1),
+            }
+        return resumo
+
+
+_admissao = _Admissao()
+_medicoes = _Medicoes()
+_cache_selfies = OrderedDict()  # sha256 da selfie -> (expira_em, encoding | None)
+_selfies_em_calculo = {}        # sha256 -> [tarefa, requisições esperando], para selfies iguais enviadas juntas
+
+
+async def _no_pool(tipo: str, funcao, *args):
+    if not disponivel():
+        raise FacialIndisponivel()
+    loop = asyncio.get_running_loop()
+    chegada = loop.time()
+    await _admissao.entrar(interativa=(tipo == "selfie"))
+    inicio = loop.time()
+    try:
+        futuro = asyncio.wrap_future(_get_pool().submit(funcao, *args))
+    except BrokenProcessPool as exc:
+        _admissao.sair()
+        _pool_caiu(exc)
+        raise FacialIndisponivel() from exc
+    except BaseException:
+        _admissao.sair()
+        raise
+    # A vaga volta quando o processo do pool termina, não quando quem espera desiste:
+    # cancelar a espera não interrompe o cálculo que já está no processo
+    futuro.add_done_callback(_devolver_vaga)
+    try:
+        resultado = await asyncio.shield(futuro)
+    except BrokenProcessPool as exc:
+        _pool_caiu(exc)
+        raise FacialIndisponivel() from exc
+    _medicoes.registrar(tipo, inicio - chegada, loop.time() - inicio)
+    return resultado
+
+
+def _devolver_vaga(futuro: asyncio.Future):
+    if not futuro.cancelled():
+        futuro.exception()  # Consome o erro de um cálculo que ninguém mais espera (sem aviso no log)
+    _admissao.sair()
+
+
+def _tentar_em() -> int:
+    """Segundos estimados para a fila de selfies ter vaga de novo."""
+    na_frente = len(_selfies_em_calculo)
+    return max(1, min(30, math.ceil(na_frente * _medicoes.calculo_medio["selfie"] / FACIAL_WORKERS)))
+
+
+def _do_cache(chave: str):
+    """(True, encoding) se a selfie está no cache e não venceu; (False, None) se não."""
+    item = _cache_selfies.get(chave)
+    if item is None or item[0] < time.monotonic():
+        _cache_selfies.pop(chave, None)
+        return False, None
+    _cache_selfies.move_to_end(chave)
+    return True, item[1]
+
+
+def _guardar_no_cache(chave: str, encoding: "np.ndarray | None"):
+    _cache_selfies[chave] = (time.monotonic() + SELFIE_CACHE_TTL_SEGUNDOS, encoding)
+    _cache_selfies.move_to_end(chave)
+    while len(_cache_selfies) > SELFIE_CACHE_MAX:
+        _cache_selfies.popitem(last=False)
+
+
+async def encoding_da_selfie(selfie_bytes: bytes) -> "np.ndarray | None":
+    """codificar_selfie no pool facial, com cache pelo conteúdo. Levanta FacialIndisponivel ou FacialOcupado."""
+    chave = hashlib.sha256(selfie_bytes).hexdigest()
+    achou, encoding = _do_cache(chave)
+    if achou:
+        _medicoes.contadores["cache_acertos"] += 1
+        return encoding
+    em_calculo = _selfies_em_calculo.get(chave)
+    if em_calculo is not None:
+        # A mesma selfie já está no pool (outro álbum da mesma família): espera o mesmo resultado
+        _medicoes.contadores["cache_acertos"] += 1
+    else:
+        _medicoes.contadores["cache_erros"] += 1
+        # Selfies em cálculo = as que estão no pool + as que esperam vaga
+        if disponivel() and len(_selfies_em_calculo) >= FACIAL_WORKERS + FILA_SELFIES_MAX:
+            _medicoes.contadores["recusadas"] += 1
+            raise FacialOcupado(_tentar_em())
+        tarefa = asyncio.ensure_future(_no_pool("selfie", codificar_selfie, selfie_bytes))
+        tarefa.add_done_callback(lambda _: _selfies_em_calculo.pop(chave, None))
+        em_calculo = _selfies_em_calculo[chave] = [tarefa, 0]
+
+    em_calculo[1] += 1
+    try:
+        encoding = await asyncio.shield(em_calculo[0])
+    except asyncio.CancelledError:
+        # Cliente desconectou: o cálculo só é abandonado se ninguém mais espera por ele
+        em_calculo[1] -= 1
+        if not em_calculo[1]:
+            em_calculo[0].cancel()
+        raise
+    _guardar_no_cache(chave, encoding)
+    return encoding
+
+
+async def rostos_da_vitrine(caminho: str) -> list:
+    """Rostos da vitrine [(encoding bytes, caixa), ...], extraídos no pool facial. Levanta FacialIndisponivel."""
+    return await _no_pool("vitrine", _rostos_serializados, caminho)
+
+
+def estatisticas() -> dict:
+    """Saúde, fila e tempos do pool facial (monitoramento)."""
+    return {
+        "disponivel": FACE_RECOGNITION_DISPONIVEL,
+        "processos": FACIAL_WORKERS,
+        "em_uso": _admissao.em_uso,
+        "fila_selfies": _admissao.esperando(True),
+        "fila_uploads": _admissao.esperando(False),
+        "selfies_em_cache": len(_cache_selfies),
+        **_medicoes.contadores,
+        **_medicoes.resumo(),
+    }
+
+
+def encerrar():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def gravar_rostos(db, foto: Foto, rostos) -> int:
+    """Grava em `rostos_foto` os rostos já extraídos da foto ([(encoding bytes/array, caixa), ...]).
+
+    Não faz commit — quem chama decide.
+    """
+    for encoding, (topo, direita, base, esquerda) in rostos:
+        if isinstance(encoding, np.ndarray):
+            encoding = encoding.astype(np.float32).tobytes()
+        db.add(RostoFoto(
+            foto_id=foto.id,
+            album_id=foto.album_id,
+            encoding=encoding,
+            caixa_topo=topo, caixa_direita=direita, caixa_base=base, caixa_esquerda=esquerda,
+        ))
+    foto.rostos_indexados = True
+    return len(rostos)
+
+
+def indexar_foto(db, foto: Foto) -> int:
+    """Extrai os rostos da vitrine da foto e grava em `rostos_foto`. Retorna quantos rostos achou.
+
+    Usado pelo backfill (no próprio processo); no upload a extração roda no pool facial.
+    """
+    if not _INSTALADO:
+        return 0
+    import processamento  # Aqui dentro: processamento importa este módulo
+    # A cópia limpa, sem marca d'água; fotos antigas só têm a vitrine
+    caminho = processamento.caminho_web(foto)
+    if not os.path.exists(caminho):
+        caminho = processamento.caminho_baixa(foto)
+    rostos = []
+    if os.path.exists(caminho):
+        try:
+            rostos = extrair_rostos(caminho)
+        except Exception as exc:
+            print(f"⚠️  Falha ao extrair rostos da foto {foto.id}: {exc}")
+    return gravar_rostos(db, foto, rostos)
+
+
+def _empilhar(blobs) -> np.ndarray:
+    """Concatena os blobs float32 numa matriz (N, 128) sem copiar rosto a rosto."""
+    if not blobs:
+        return np.empty((0, DIMENSOES), dtype=np.float32)
+    return np.frombuffer(b"".join(blobs), dtype=np.float32).reshape(-1, DIMENSOES)
+
+
+def buscar_no_album(db, album_id: int, selfie_encoding: np.ndarray, tolerancia: float = TOLERANCIA) -> list:
+    """IDs (ordenados) das fotos do álbum que têm algum rosto a até `tolerancia` da selfie."""
+    linhas = db.query(RostoFoto.foto_id, RostoFoto.encoding).filter(RostoFoto.album_id == album_id).all()
+    if not linhas:
+        return []
+    foto_ids = np.fromiter((fid for fid, _ in linhas), dtype=np.int64, count=len(linhas))
+    matriz = _empilhar([enc for _, enc in linhas])
+    distancias = np.linalg.norm(matriz - selfie_encoding.astype(np.float32), axis=1)
+    return [int(fid) for fid in np.unique(foto_ids[distancias <= tolerancia])]
+
+
+def reindexar(db, hash_url: "str | None" = None, refazer: bool = False, lote: int = 50) -> int:
+    """Backfill: indexa as fotos que ainda não passaram pela extração de rostos. Retorna quantas fotos processou."""
+    if not _INSTALADO:
+        raise RuntimeError("face_recognition não está instalado.")
+    consulta = db.query(Foto)
+    if hash_url:
+        album = db.query(Album).filter(Album.hash_url == hash_url).first()
+        if not album:
+            raise SystemExit(f"Álbum '{hash_url}' não encontrado.")
+        consulta = consulta.filter(Foto.album_id == album.id)
+    if refazer:
+        ids = [fid for (fid,) in consulta.with_entities(Foto.id).all()]
+        if ids:
+            db.query(RostoFoto).filter(RostoFoto.foto_id.in_(ids)).delete(synchronize_session=False)
+            db.query(Foto).filter(Foto.id.in_(ids)).update({Foto.rostos_indexados: False}, synchronize_session=False)
+            db.commit()
+    # Fotos ainda na fila de processamento são indexadas pelo próprio pool
+    pendentes = consulta.filter(Foto.status_processamento == "Pronta", Foto.rostos_indexados.isnot(True)).order_by(Foto.id)
+
+    processadas = 0
+    while True:
+        fotos = pendentes.limit(lote).all()
+        if not fotos:
+            break
+        for foto in fotos:
+            indexar_foto(db, foto)
+            processadas += 1
+        db.commit()
+        print(f"  {processadas} fotos indexadas...")
+    return processadas
+
+
+if __name__ == "__main__":
+    from sqlalchemy.orm import sessionmaker
+
+    parser = argparse.ArgumentParser(description="Backfill do índice facial (rostos_foto).")
+    parser.add_argument("--album", help="hash_url de um álbum específico")
+    parser.add_argument("--refazer", action="store_true", help="apaga e recalcula os rostos já indexados")
+    args = parser.parse_args()
+
+    if not _INSTALADO:
+        raise SystemExit("face_recognition não está instalado.")
+
+    db = sessionmaker(bind=engine)()
+    try:
+        total = reindexar(db, hash_url=args.album, refazer=args.refazer)
+        print(f"✅ {total} fotos indexadas.")
+    finally:
+        db.close()
@@ -0,0 +1,267 @@
+"""Busca facial entre álbuns ("me encontre"), por cidade/categoria.
+
+A busca por álbum (facial.buscar_no_album) compara a selfie com todos os
+rostos do álbum — ótimo para algumas centenas ou milhares de rostos, lento
+para uma temporada inteira de liga. Aqui os rostos ficam num índice IVF em
+memória, um por partição (cidade, categoria) dos álbuns:
+
+- k-means (em amostra) divide os encodings em ~sqrt(N) listas;
+- na busca, só são lidas as listas cujo centroide está perto o bastante da
+  selfie: pela desigualdade triangular, uma lista com centroide c e raio r só
+  pode ter rosto a até `tolerancia` se |selfie - c| - r <= tolerancia. Até
+  MAX_LISTAS_SONDADAS listas (as mais próximas) — é aí que vira aproximado.
+
+O índice é montado numa thread de fundo, disparado pela primeira busca da
+partição e refeito depois de TTL_INDICE_SEGUNDOS: uma montagem por vez por
+partição, e as buscas seguem com o índice anterior até o novo ser trocado. Os
+rostos gravados depois da montagem entram por força bruta, lidos partição a
+partição (só os ids acima do último indexado nela). Enquanto a primeira
+montagem não termina, a partição vai inteira por força bruta se tiver até
+FORCA_BRUTA_MAX_ROSTOS rostos; maior que isso, a busca responde "ocupado". Cada rosto ocupa ~520 bytes: INDICE_FACIAL_MAX_ROSTOS
+limita a memória do processo, descartando as partições usadas há mais tempo.
+Bloqueante (NumPy + SQL síncrono) — chame via run_in_threadpool.
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from sqlalchemy import func, select
+
+import facial
+from models import Album, RostoFoto, SessionLocal
+
+TTL_INDICE_SEGUNDOS = 1800
+INDICE_FACIAL_MAX_ROSTOS = int(os.getenv("INDICE_FACIAL_MAX_ROSTOS", "500000"))
+MIN_ROSTOS_IVF = 2000          # Abaixo disso uma lista só (força bruta) já responde em milissegundos
+AMOSTRA_TREINO = 20000
+ITERACOES_KMEANS = 8
+MAX_LISTAS_SONDADAS = 48
+BLOCO_ATRIBUICAO = 8192
+FRACAO_NOVOS_RECONSTRUIR = 0.1  # Rostos novos acima disso antecipam a reconstrução
+FORCA_BRUTA_MAX_ROSTOS = int(os.getenv("INDICE_FACIAL_FORCA_BRUTA_MAX", "20000"))  # Partição sem índice, por busca
+TENTAR_EM_MONTAGEM_SEGUNDOS = 10
+
+
+def _mais_proximos(vetores: np.ndarray, centroides: np.ndarray) -> "tuple[np.ndarray, np.ndarray]":
+    """(rótulo, distância) do centroide mais próximo de cada vetor, em blocos de produto matricial."""
+    norma_c = np.einsum("ij,ij->i", centroides, centroides)
+    rotulos = np.empty(len(vetores), dtype=np.int64)
+    distancias = np.empty(len(vetores), dtype=np.float32)
+    for inicio in range(0, len(vetores), BLOCO_ATRIBUICAO):
+        bloco = vetores[inicio:inicio + BLOCO_ATRIBUICAO]
+        # |v - c|² = |v|² - 2 v·c + |c|²; |v|² não muda o argmin e entra só na distância final
+        d2 = norma_c[None, :] - 2.0 * (bloco @ centroides.T)
+        j = d2.argmin(axis=1)
+        rotulos[inicio:inicio + len(bloco)] = j
+        minimos = d2[np.arange(len(bloco)), j] + np.einsum("ij,ij->i", bloco, bloco)
+        distancias[inicio:inicio + len(bloco)] = np.sqrt(np.maximum(minimos, 0.0))
+    return rotulos, distancias
+
+
+def _kmeans(amostra: np.ndarray, k: int, rng: np.random.Generator) -> np.ndarray:
+    centroides = amostra[rng.choice(len(amostra), k, replace=False)].copy()
+    for _ in range(ITERACOES_KMEANS):
+        rotulos, _ = _mais_proximos(amostra, centroides)
+        contagens = np.bincount(rotulos, minlength=k)
+        somas = np.zeros_like(centroides)
+        np.add.at(somas, rotulos, amostra)
+        cheios = contagens > 0
+        centroides[cheios] = somas[cheios] / contagens[cheios, None]
+        # Lista vazia recomeça num ponto qualquer da amostra
+        vazios = np.flatnonzero(~cheios)
+        if len(vazios):
+            centroides[vazios] = amostra[rng.choice(len(amostra), len(vazios), replace=False)]
+    return centroides
+
+
+class IndiceIVF:
+    """Listas invertidas sobre os encodings de uma partição: vetores agrupados por centroide."""
+
+    def __init__(self, rosto_ids: np.ndarray, foto_ids: np.ndarray, album_ids: np.ndarray, vetores: np.ndarray):
+        self.maior_rosto_id = int(rosto_ids.max()) if len(rosto_ids) else 0
+        n = len(vetores)
+        if n < MIN_ROSTOS_IVF:
+            centroides = vetores.mean(axis=0, keepdims=True) if n else np.zeros((1, facial.DIMENSOES), np.float32)
+        else:
+            rng = np.random.default_rng(0)
+            amostra = vetores[rng.choice(n, min(n, AMOSTRA_TREINO), replace=False)]
+            centroides = _kmeans(amostra, int(np.sqrt(n)), rng)
+        rotulos, distancias = _mais_proximos(vetores, centroides)
+        ordem = np.argsort(rotulos, kind="stable")
+        self.centroides = centroides.astype(np.float32)
+        self.vetores = np.ascontiguousarray(vetores[ordem])
+        self.foto_ids = foto_ids[ordem]
+        self.album_ids = album_ids[ordem]
+        self.inicios = np.searchsorted(rotulos[ordem], np.arange(len(centroides) + 1))
+        self.raios = np.zeros(len(centroides), dtype=np.float32)
+        np.maximum.at(self.raios, rotulos, distancias)
+
+    def __len__(self):
+        return len(self.vetores)
+
+    def buscar(self, selfie: np.ndarray, tolerancia: float) -> "tuple[np.ndarray, np.ndarray]":
+        """(foto_ids, album_ids) dos rostos a até `tolerancia` da selfie."""
+        ate_centroide = np.linalg.norm(self.centroides - selfie, axis=1)
+        listas = np.flatnonzero(ate_centroide - self.raios <= tolerancia)
+        listas = listas[np.argsort(ate_centroide[listas])][:MAX_LISTAS_SONDADAS]
+        if not len(listas):
+            return self.foto_ids[:0], self.album_ids[:0]
+        posicoes = np.concatenate([np.arange(self.inicios[l], self.inicios[l + 1]) for l in listas])
+        distancias = np.linalg.norm(self.vetores[posicoes] - selfie, axis=1)
+        achados = posicoes[distancias <= tolerancia]
+        return self.foto_ids[achados], self.album_ids[achados]
+
+
+# ==========================================
+# PARTIÇÕES (cidade, categoria)
+# ==========================================
+
+class _Particao:
+    def __init__(self):
+        self.indice: "IndiceIVF | None" = None
+        self.construido_em = 0.0
+        self.trava = threading.Lock()  # Presa enquanto uma montagem da partição está em andamento
+
+
+_particoes = OrderedDict()  # (cidade, categoria) normalizadas -> _Particao, da menos para a mais usada
+_trava_particoes = threading.Lock()
+
+
+def _normalizada(coluna):
+    return func.coalesce(func.lower(coluna), "")
+
+
+def _filtros(cidade: "str | None", categoria: "str | None") -> list:
+    filtros = []
+    if cidade:
+        filtros.append(_normalizada(Album.cidade) == cidade.strip().lower())
+    if categoria:
+        filtros.append(_normalizada(Album.categoria) == categoria.strip().lower())
+    return filtros
+
+
+def _colunas_rosto():
+    return RostoFoto.id, RostoFoto.foto_id, RostoFoto.album_id, RostoFoto.encoding
+
+
+def _construir(db, chave: tuple) -> IndiceIVF:
+    linhas = db.execute(
+        select(*_colunas_rosto())
+        .join(Album, Album.id == RostoFoto.album_id)
+        .where(_normalizada(Album.cidade) == chave[0], _normalizada(Album.categoria) == chave[1])
+    ).all()
+    inicio = time.perf_counter()
+    indice = IndiceIVF(
+        np.fromiter((l[0] for l in linhas), dtype=np.int64, count=len(linhas)),
+        np.fromiter((l[1] for l in linhas), dtype=np.int64, count=len(linhas)),
+        np.fromiter((l[2] for l in linhas), dtype=np.int64, count=len(linhas)),
+        facial._empilhar([l[3] for l in linhas]),
+    )
+    print(f"🧭 Índice facial {chave}: {len(indice)} rostos, {len(indice.centroides)} listas, "
+          f"{(time.perf_counter() - inicio) * 1000:.0f} ms")
+    return indice
+
+
+def _liberar_memoria():
+    """Descarta as partições menos usadas enquanto o total de rostos passar do limite."""
+    with _trava_particoes:
+        total = sum(len(p.indice) for p in _particoes.values() if p.indice is not None)
+        while total > INDICE_FACIAL_MAX_ROSTOS and len(_particoes) > 1:
+            _, antiga = _particoes.popitem(last=False)
+            total -= len(antiga.indice) if antiga.indice is not None else 0
+
+
+def _reconstruir(chave: tuple, particao: _Particao):
+    """Monta o índice da partição e troca o atual. Roda numa thread própria, com `particao.trava` já presa."""
+    db = SessionLocal()
+    try:
+        particao.indice = _construir(db, chave)
+        particao.construido_em = time.monotonic()
+    except Exception as exc:
+        print(f"⚠️  Falha ao montar o índice facial {chave}: {exc!r}")
+    finally:
+        db.close()
+        particao.trava.release()
+    _liberar_memoria()
+
+
+def _indice(chave: tuple) -> "IndiceIVF | None":
+    """Índice atual da partição, sem esperar montagem; None até a primeira ficar pronta."""
+    with _trava_particoes:
+        particao = _particoes.get(chave)
+        if particao is None:
+            particao = _particoes[chave] = _Particao()
+        _particoes.move_to_end(chave)
+    vencido = particao.indice is None or time.monotonic() - particao.construido_em > TTL_INDICE_SEGUNDOS
+    if vencido and particao.trava.acquire(blocking=False):
+        # Só uma montagem por partição; as buscas seguem com o índice anterior
+        threading.Thread(target=_reconstruir, args=(chave, particao), name=f"indice-facial-{chave}", daemon=True).start()
+    return particao.indice
+
+
+def _vencer(chave: tuple):
+    """Marca a partição para reconstrução na próxima busca."""
+    with _trava_particoes:
+        particao = _particoes.get(chave)
+        if particao is not None:
+            particao.construido_em = 0.0
+
+
+def _rostos_depois_de(db, chave: tuple, maior_rosto_id: int, limite: "int | None" = None) -> list:
+    """(id, foto_id, album_id, encoding) dos rostos da partição com id > maior_rosto_id."""
+    consulta = (
+        select(*_colunas_rosto())
+        .join(Album, Album.id == RostoFoto.album_id)
+        .where(_normalizada(Album.cidade) == chave[0], _normalizada(Album.categoria) == chave[1],
+               RostoFoto.id > maior_rosto_id)
+    )
+    if limite is not None:
+        consulta = consulta.limit(limite)
+    return db.execute(consulta).all()
+
+
+def buscar(cidade: "str | None", categoria: "str | None", selfie: np.ndarray,
+           tolerancia: float = facial.TOLERANCIA) -> dict:
+    """{album_id: [foto_id, ...]} com os rostos a até `tolerancia` da selfie nos álbuns da cidade/categoria.
+
+    Partição ainda sem índice vai por força bruta até FORCA_BRUTA_MAX_ROSTOS; maior que isso,
+    levanta facial.FacialOcupado para o cliente tentar depois da montagem.
+    """
+    selfie = np.asarray(selfie, dtype=np.float32)
+    db = SessionLocal()
+    try:
+        chaves = db.execute(
+            select(_normalizada(Album.cidade), _normalizada(Album.categoria)).where(*_filtros(cidade, categoria)).distinct()
+        ).all()
+        if not chaves:
+            return {}
+        fotos, albuns = [], []
+        for chave in map(tuple, chaves):
+            indice = _indice(chave)
+            if indice is None:
+                novos = _rostos_depois_de(db, chave, 0, FORCA_BRUTA_MAX_ROSTOS + 1)
+                if len(novos) > FORCA_BRUTA_MAX_ROSTOS:
+                    raise facial.FacialOcupado(TENTAR_EM_MONTAGEM_SEGUNDOS)
+            else:
+                f, a = indice.buscar(selfie, tolerancia)
+                fotos.append(f)
+                albuns.append(a)
+                # Rostos gravados depois da montagem: força bruta só sobre os desta partição
+                novos = _rostos_depois_de(db, chave, indice.maior_rosto_id)
+                if len(novos) > max(MIN_ROSTOS_IVF, FRACAO_NOVOS_RECONSTRUIR * len(indice)):
+                    _vencer(chave)
+            if novos:
+                matriz = facial._empilhar([l[3] for l in novos])
+                perto = np.linalg.norm(matriz - selfie, axis=1) <= tolerancia
+                fotos.append(np.fromiter((l[1] for l in novos), dtype=np.int64, count=len(novos))[perto])
+                albuns.append(np.fromiter((l[2] for l in novos), dtype=np.int64, count=len(novos))[perto])
+    finally:
+        db.close()
+
+    resultado = {}
+    for foto_id, album_id in zip(np.concatenate(fotos or [np.empty(0, np.int64)]).tolist(),
+                                 np.concatenate(albuns or [np.empty(0, np.int64)]).tolist()):
+        resultado.setdefault(album_id, set()).add(foto_id)
+    return {album_id: sorted(ids) for album_id, ids in resultado.items()}
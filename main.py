@@ -1,40 +1,80 @@
 import os
-import io
+import re
+import json
 import uuid
+import asyncio
 import hmac
 import hashlib
-import shutil
-import zipfile
-import smtplib
 import tempfile
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 from datetime import datetime, timedelta
 from typing import List, Optional
+from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, Request, HTTPException, Depends, File, UploadFile, Form
-from fastapi.responses import HTMLResponse, FileResponse, StreamingResponse, RedirectResponse
+from fastapi import FastAPI, Request, HTTPException, Depends, File, UploadFile, Form, BackgroundTasks, Header
+from fastapi.responses import HTMLResponse, FileResponse, StreamingResponse, RedirectResponse, Response, JSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 
-from sqlalchemy.orm import sessionmaker, Session
-from PIL import Image
-import mercadopago
+from sqlalchemy import func, or_, and_, select, table, literal_column, text, insert, delete
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, load_only
 
 # Importações dos nossos arquivos
-from models import Pedido, Foto, Cliente, Album, ItemPedido, PlataformaConfig, engine, Fotografo
-from pagamento_pix import gerar_cobranca_pix
-
-# Reconhecimento facial — importação opcional
-try:
-    import face_recognition as _fr
-    FACE_RECOGNITION_DISPONIVEL = True
-except ImportError:
-    _fr = None
-    FACE_RECOGNITION_DISPONIVEL = False
-
-app = FastAPI()
+from models import Pedido, Foto, Cliente, Album, ItemPedido, PlataformaConfig, RostoFoto, VendaDiaria, SessionLocal, AsyncSessionLocal, Fotografo, engine, async_engine
+from pagamento_pix import gerar_cobranca_pix, PIX_EXPIRACAO_MINUTOS
+import pagamento_pix
+from processamento import DIRETORIO_ALTA_RES, DIRETORIO_BAIXA_RES
+import processamento
+import facial
+import indice_facial
+import marca_dagua
+import cache_downloads
+import caixa_webhook
+import emails
+import eventos_pedido
+import expiracao_pedidos
+import metricas
+import migracoes
+import precos
+import qr_pix
+from zip_stream import ZipStream, EntradaZip
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # As migrações rodam fora do processo (python migracoes.py); aqui só conferimos a versão
+    migracoes.verificar_schema()
+    # Retoma vitrines que ficaram na fila quando o servidor parou
+    pendentes = processamento.retomar_pendentes()
+    if pendentes:
+        print(f"🔄 {pendentes} fotos pendentes reenfileiradas para processamento.")
+    # Fotos com marca d'água desatualizada (ou anteriores à marca no servidor) são regeradas em background
+    remarcacoes = processamento.retomar_remarcacoes()
+    if remarcacoes:
+        print(f"💧 Remarcação agendada para {remarcacoes} fotógrafos.")
+    limpeza_zip = asyncio.create_task(cache_downloads.limpeza_periodica(DOWNLOAD_DURACAO_DIAS))
+    # Drena a caixa de webhooks do Mercado Pago (inclusive o que chegou com o servidor fora)
+    worker_webhooks = asyncio.create_task(caixa_webhook.processar_periodicamente(_pos_pagamento))
+    # Envia a caixa de saída de e-mails por uma sessão SMTP reaproveitada
+    worker_emails = asyncio.create_task(emails.enviar_periodicamente())
+    # Expira os PIX vencidos em lote (as telas de pagamento só leem o status)
+    varredura_pix = asyncio.create_task(expiracao_pedidos.varrer_periodicamente())
+    # Retoma fotos reservadas por um worker que caiu no meio do processamento
+    retomada_fotos = asyncio.create_task(processamento.retomar_periodicamente())
+    yield
+    limpeza_zip.cancel()
+    worker_webhooks.cancel()
+    worker_emails.cancel()
+    varredura_pix.cancel()
+    retomada_fotos.cancel()
+    processamento.encerrar()
+    facial.encerrar()
+    await pagamento_pix.fechar()
+    await async_engine.dispose()
+
+app = FastAPI(lifespan=lifespan)
 
 # Chave secreta para assinar cookies de sessão. Defina SESSION_SECRET no .env em produção.
 SESSION_SECRET = os.getenv("SESSION_SECRET", os.urandom(32).hex())
@@ -47,49 +87,11 @@ OWNER_EMAIL = os.getenv("OWNER_EMAIL", "")
 # URL base pública (usada em links de e-mail e OG tags)
 BASE_URL = os.getenv("BASE_URL", "https://yshpics.com")
 
-# Configuração SMTP para notificações automáticas
-SMTP_HOST = os.getenv("SMTP_HOST", "")
-SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
-SMTP_USER = os.getenv("SMTP_USER", "")
-SMTP_PASS = os.getenv("SMTP_PASS", "")
-SMTP_FROM = os.getenv("SMTP_FROM", SMTP_USER)
-
 # Comissão e regras de preço
 COMISSAO_STARTER = 0.10          # 10% para plano starter
 COMISSAO_MINIMA = 0.50           # R$0,50 — abaixo disso não tentamos o split
 PRECO_MINIMO = 1.00              # R$1,00 — preço mínimo por foto
 
-def _enviar_email_download(email_cliente: str, nome_cliente: str, token_download: str, qtd_fotos: int):
-    """Envia e-mail com o link de download ao cliente após confirmação do pagamento."""
-    if not SMTP_HOST or not SMTP_USER:
-        return
-    try:
-        link = f"{BASE_URL}/baixar/{token_download}"
-        msg = MIMEMultipart("alternative")
-        msg["Subject"] = "✅ Suas fotos estão prontas! — yshpics"
-        msg["From"] = f"yshpics <{SMTP_FROM}>"
-        msg["To"] = email_cliente
-
-        html = f"""
-        <div style="font-family:Inter,sans-serif;max-width:520px;margin:0 auto;padding:32px 24px;color:#1f2937;">
-          <h2 style="color:#3b82f6;font-size:1.5rem;margin:0 0 8px;">Pagamento confirmado! 🎉</h2>
-          <p style="margin:0 0 20px;color:#6b7280;">Olá, <strong>{nome_cliente}</strong>! Suas <strong>{qtd_fotos} foto{'s' if qtd_fotos != 1 else ''}</strong> em alta resolução estão prontas para download.</p>
-          <a href="{link}" style="display:inline-block;background:#3b82f6;color:#fff;font-weight:700;padding:14px 32px;border-radius:12px;text-decoration:none;font-size:1rem;">
-            Baixar minhas fotos (ZIP)
-          </a>
-          <p style="margin:24px 0 0;font-size:0.8rem;color:#9ca3af;">O link expira em 7 dias. Caso precise de ajuda, responda este e-mail.</p>
-        </div>
-        """
-        msg.attach(MIMEText(html, "html"))
-
-        with smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=10) as server:
-            server.ehlo()
-            server.starttls()
-            server.login(SMTP_USER, SMTP_PASS)
-            server.sendmail(SMTP_FROM, email_cliente, msg.as_string())
-    except Exception as exc:
-        print(f"⚠️  Falha ao enviar e-mail para {email_cliente}: {exc}")
-
 def calcular_comissao(valor_total: float, plano: str) -> float:
     """Retorna a comissão da plataforma; 0 se o plano for pro ou o valor for pequeno demais."""
     if plano != "starter":
@@ -127,7 +129,7 @@ def _verificar_sessao(token: str) -> "int | None":
 # HELPERS DE AUTENTICAÇÃO (Cookie-based)
 # ==========================================
 
-def get_fotografo_logado(request: Request, db: Session) -> "Fotografo | None":
+async def get_fotografo_logado(request: Request, db: AsyncSession) -> "Fotografo | None":
     """Retorna o fotógrafo logado ou None se não houver sessão válida."""
     token = request.cookies.get("sessao_admin")
     if not token:
@@ -135,39 +137,131 @@ def get_fotografo_logado(request: Request, db: Session) -> "Fotografo | None":
     fotografo_id = _verificar_sessao(token)
     if fotografo_id is None:
         return None
-    return db.query(Fotografo).filter(Fotografo.id == fotografo_id).first()
+    return await db.get(Fotografo, fotografo_id)
 
-def get_owner(request: Request, db: Session) -> "Fotografo | None":
+async def get_owner(request: Request, db: AsyncSession) -> "Fotografo | None":
     """Retorna o fotógrafo logado somente se for o dono da plataforma."""
-    fotografo = get_fotografo_logado(request, db)
+    fotografo = await get_fotografo_logado(request, db)
     if fotografo and OWNER_EMAIL and fotografo.email == OWNER_EMAIL:
         return fotografo
     return None
-DIRETORIO_ALTA_RES = "./fotos_alta_res_seguras"
-DIRETORIO_BAIXA_RES = "./static/fotos_baixa_res"
 os.makedirs(DIRETORIO_ALTA_RES, exist_ok=True)
 os.makedirs(DIRETORIO_BAIXA_RES, exist_ok=True)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 templates = Jinja2Templates(directory="templates")
+templates.env.filters["srcset"] = processamento.srcset
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    """Sessão assíncrona por requisição: as consultas não travam o event loop.
+
+    Relacionamentos não carregam sozinhos numa AsyncSession — quem precisa deles
+    pede com joinedload/selectinload na própria consulta. Código síncrono que
+    recebe uma Session (precos, metricas, facial...) roda via `db.run_sync`.
+    """
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 # ==========================================
 # ROTAS DO SAAS E CHECKOUT
 # ==========================================
 
+# ==========================================
+# CHECKOUT IDEMPOTENTE
+# ==========================================
+
+REUSO_PIX_VALIDADE_MINIMA = timedelta(minutes=3)   # PIX reaproveitado precisa dar tempo de pagar
+ESPERA_PEDIDO_EM_ANDAMENTO_SEGUNDOS = 15
+TAMANHO_MAXIMO_CHAVE = 100
+
+def _assinatura_carrinho(itens) -> str:
+    """Hash do carrinho [(foto_id, qualidade), ...], independente da ordem dos itens."""
+    normalizado = sorted(f"{foto_id}:{'alta' if qualidade == 'alta' else 'baixa'}" for foto_id, qualidade in itens)
+    return hashlib.sha256("|".join(normalizado).encode()).hexdigest()
+
+def _assinatura_requisicao(itens, email: str) -> str:
+    """Hash do carrinho + e-mail do cliente: o que uma Idempotency-Key reenviada precisa repetir."""
+    return hashlib.sha256(f"{_assinatura_carrinho(itens)}|{email.strip().lower()}".encode()).hexdigest()
+
+async def _pedido_da_chave(db: AsyncSession, chave: Optional[str], assinatura: str) -> "dict | None":
+    """Resposta do pedido já criado com esta chave; se o PIX dele ainda está sendo gerado, espera.
+
+    A chave reenviada com outro carrinho ou outro e-mail é erro do cliente (422), não o mesmo pedido.
+    """
+    if not chave:
+        return None
+    loop = asyncio.get_running_loop()
+    prazo = loop.time() + ESPERA_PEDIDO_EM_ANDAMENTO_SEGUNDOS
+    while True:
+        pedido = (await db.execute(
+            select(Pedido.id, Pedido.pix_txid, Pedido.assinatura_requisicao).where(Pedido.chave_idempotencia == chave)
+        )).first()
+        await db.rollback()  # Encerra a leitura: a próxima volta enxerga o commit do outro request
+        if not pedido:
+            return None
+        if pedido.assinatura_requisicao and pedido.assinatura_requisicao != assinatura:
+            raise HTTPException(status_code=422, detail="Idempotency-Key já usada em outro pedido")
+        if pedido.pix_txid:
+            return {"sucesso": True, "pedido_id": pedido.id}
+        if loop.time() >= prazo:
+            return {"sucesso": False, "erro": "Seu pedido ainda está sendo gerado. Tente novamente em instantes."}
+        await asyncio.sleep(0.3)
+
+async def _pedido_da_chave_em_conflito(db: AsyncSession, chave: str, assinatura: str) -> dict:
+    """Depois do IntegrityError na chave: o pedido do request que chegou antes.
+
+    Se ele já não tem a chave (o PIX falhou e a liberou), responde 409 para o cliente repetir.
+    """
+    await db.rollback()
+    existente = await _pedido_da_chave(db, chave, assinatura)
+    if existente is None:
+        raise HTTPException(status_code=409, detail="Pedido com esta Idempotency-Key em conflito; tente novamente")
+    return existente
+
+async def _pedido_com_pix_vivo(db: AsyncSession, email: str, fotografo_id: int, assinatura: str, valor_total: float) -> "int | None":
+    """Pedido pendente do mesmo cliente, com o mesmo carrinho e valor, cujo PIX ainda vale."""
+    return await db.scalar(
+        select(Pedido.id)
+        .join(Cliente, Pedido.cliente_id == Cliente.id)
+        .where(
+            Cliente.email == email,
+            Pedido.assinatura_carrinho == assinatura,
+            Pedido.status_pagamento == "Pendente",
+            Pedido.fotografo_id == fotografo_id,
+            Pedido.valor_total == valor_total,
+            Pedido.pix_txid.isnot(None),
+            Pedido.pix_expiracao > datetime.utcnow() + REUSO_PIX_VALIDADE_MINIMA,
+        )
+        .order_by(Pedido.id.desc())
+        .limit(1)
+    )
+
+async def _gerar_pix(**dados) -> dict:
+    """gerar_cobranca_pix sem deixar exceção escapar: o pedido já está gravado e precisa ser cancelado."""
+    try:
+        return await gerar_cobranca_pix(**dados)
+    except Exception as exc:
+        print(f"⚠️  Falha inesperada ao gerar o PIX do pedido {dados.get('id_pedido_interno')}: {exc!r}")
+        return {"sucesso": False, "erro": "Falha ao gerar o PIX no Mercado Pago"}
+
+def _chave_idempotencia(valor: Optional[str]) -> Optional[str]:
+    if valor and len(valor) > TAMANHO_MAXIMO_CHAVE:
+        raise HTTPException(status_code=400, detail="Idempotency-Key muito longa")
+    return valor or None
+
 @app.post("/comprar/{foto_id}")
-def comprar_foto(foto_id: int, nome: str, email: str, qualidade: str = 'alta', db: Session = Depends(get_db)):
+async def comprar_foto(foto_id: int, nome: str, email: str, qualidade: str = 'alta', db: AsyncSession = Depends(get_db),
+                       idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")):
     """Rota direta para o Guest Checkout sem carrinho complexo."""
-    
-    foto = db.query(Foto).filter(Foto.id == foto_id).first()
+    chave = _chave_idempotencia(idempotency_key)
+    assinatura_requisicao = _assinatura_requisicao([(foto_id, qualidade)], email)
+    existente = await _pedido_da_chave(db, chave, assinatura_requisicao)
+    if existente:
+        return existente
+
+    foto = await db.scalar(
+        select(Foto).options(joinedload(Foto.album).joinedload(Album.fotografo)).where(Foto.id == foto_id)
+    )
     if not foto:
         return {"sucesso": False, "erro": "Foto não encontrada"}
         
@@ -179,29 +273,41 @@ def comprar_foto(foto_id: int, nome: str, email: str, qualidade: str = 'alta', d
     valor_venda = foto.preco_alta if qualidade == 'alta' else foto.preco_baixa
     sua_comissao = calcular_comissao(valor_venda, fotografo.plano_atual)
 
+    # Mesmo clique repetido: devolve o PIX que já está aberto em vez de gerar outro
+    assinatura = _assinatura_carrinho([(foto.id, qualidade)])
+    pedido_vivo = await _pedido_com_pix_vivo(db, email, fotografo.id, assinatura, valor_venda)
+    if pedido_vivo:
+        return {"sucesso": True, "pedido_id": pedido_vivo}
+
     # Registra cliente e pedido
-    cliente = db.query(Cliente).filter(Cliente.email == email).first()
+    cliente = await db.scalar(select(Cliente).where(Cliente.email == email).limit(1))
     if not cliente:
         cliente = Cliente(nome=nome, email=email)
         db.add(cliente)
-        db.flush()
+        await db.flush()
 
     novo_pedido = Pedido(
         cliente_id=cliente.id,
         fotografo_id=fotografo.id,
         valor_total=valor_venda,
-        taxa_plataforma=sua_comissao
+        taxa_plataforma=sua_comissao,
+        chave_idempotencia=chave,
+        assinatura_carrinho=assinatura,
+        assinatura_requisicao=assinatura_requisicao,
     )
     db.add(novo_pedido)
-    db.flush()
+    try:
+        await db.flush()
+    except IntegrityError:  # Outro request com a mesma chave chegou antes
+        return await _pedido_da_chave_em_conflito(db, chave, assinatura_requisicao)
     
     # Registra o item
     novo_item = ItemPedido(pedido_id=novo_pedido.id, foto_id=foto.id, qualidade=qualidade, preco_cobrado=valor_venda)
     db.add(novo_item)
-    db.commit()
+    await db.commit()
 
     # Chama o PIX
-    pix = gerar_cobranca_pix(
+    pix = await _gerar_pix(
         valor_pedido=valor_venda,
         email_cliente=cliente.email,
         nome_cliente=cliente.nome,
@@ -212,7 +318,8 @@ def comprar_foto(foto_id: int, nome: str, email: str, qualidade: str = 'alta', d
 
     if not pix["sucesso"]:
         novo_pedido.status_pagamento = "Cancelado"
-        db.commit()
+        novo_pedido.chave_idempotencia = None  # Libera a chave: repetir o envio tenta de novo
+        await db.commit()
         return {"sucesso": False, "erro": pix.get("erro", "Falha ao gerar o PIX no Mercado Pago")}
 
     # Ajusta comissão registrada ao que foi realmente aplicado
@@ -221,59 +328,155 @@ def comprar_foto(foto_id: int, nome: str, email: str, qualidade: str = 'alta', d
 
     novo_pedido.pix_txid = pix["txid"]
     novo_pedido.pix_copia_cola = pix["copia_cola"]
-    novo_pedido.pix_qr_code_base64 = pix["qr_code_img"]
+    await run_in_threadpool(qr_pix.guardar_imagem_mp, pix["txid"], pix["qr_code_img"])
     novo_pedido.pix_expiracao = pix.get("expiracao")
-    db.commit()
+    await db.commit()
 
     return {"sucesso": True, "pedido_id": novo_pedido.id}
 
 @app.post("/webhook/mercadopago")
-async def mercado_pago_webhook(request: Request, db: Session = Depends(get_db)):
+async def mercado_pago_webhook(request: Request, db: AsyncSession = Depends(get_db)):
     try:
         payload = await request.json()
     except Exception:
         raise HTTPException(status_code=400)
 
-    if payload.get("type") == "payment":
-        payment_id = payload.get("data", {}).get("id")
-        if payment_id:
-            # Encontra o pedido pelo TXID que salvamos
-            pedido = db.query(Pedido).filter(Pedido.pix_txid == str(payment_id)).first()
-            if pedido and pedido.status_pagamento == "Pendente":
-                
-                # Valida usando o SDK do Fotógrafo dono do pedido
-                sdk_fotografo = mercadopago.SDK(pedido.fotografo.mp_access_token)
-                payment_info = sdk_fotografo.payment().get(payment_id)
-                
-                if payment_info["status"] == 200:
-                    mp_status = payment_info["response"]["status"]
-                    if mp_status == "approved":
-                        pedido.status_pagamento = "Pago"
-                        db.commit()
-                        print(f"\n💰 SUCESSO! Pedido {pedido.id} foi pago.")
-                        # Notifica o cliente por e-mail com o link de download
-                        _enviar_email_download(
-                            email_cliente=pedido.cliente.email,
-                            nome_cliente=pedido.cliente.nome or "Cliente",
-                            token_download=pedido.token_download,
-                            qtd_fotos=len(pedido.itens),
-                        )
-                    elif mp_status in ("cancelled", "expired"):
-                        pedido.status_pagamento = "Expirado"
-                        db.commit()
-                        print(f"\n⏰ Pedido {pedido.id} expirado/cancelado no MP.")
-                    
+    # Só grava na caixa de entrada e responde; a consulta ao MP e a baixa do pedido ficam com o worker
+    if isinstance(payload, dict) and await db.run_sync(caixa_webhook.registrar, payload):
+        caixa_webhook.acordar()
     return {"status": "recebido com sucesso"}
 
+def _pos_pagamento(pedido_id: int):
+    """Chamado pelo worker da caixa de webhooks quando um pedido acaba de ser pago."""
+    # O cliente costuma clicar no link do e-mail em minutos: já deixa o ZIP pronto
+    _aquecer_cache_zip(pedido_id)
+
 # ==========================================
 # ROTAS DE VISUALIZAÇÃO E TELAS
 # ==========================================
 
+def _opcoes_card_album() -> list:
+    """Carrega só o que os cards de álbum exibem: capa e nome do fotógrafo vêm no mesmo SELECT."""
+    return [
+        load_only(
+            Album.id, Album.titulo, Album.hash_url, Album.data_evento, Album.categoria,
+            Album.cidade, Album.fotografo_id, Album.capa_foto_id, Album.qtd_fotos,
+        ),
+        joinedload(Album.capa).load_only(Foto.id, Foto.caminho_baixa_res, Foto.derivados),
+        joinedload(Album.fotografo).load_only(Fotografo.id, Fotografo.nome),
+    ]
+
+FEED_POR_PAGINA = 24
+FEED_MAX_POR_PAGINA = 60
+
+def _filtrar_titulo(consulta, termo: str):
+    """Busca por título usando o índice do banco: FTS5 (prefixo por palavra) no SQLite, trigram no Postgres."""
+    termo = termo.strip().lower()
+    if not termo:
+        return consulta
+    if engine.dialect.name == "sqlite":
+        palavras = re.findall(r"\w+", termo)
+        if not palavras:
+            return consulta
+        expressao = " ".join(f'"{p}"*' for p in palavras)
+        ids_fts = (
+            select(literal_column("rowid"))
+            .select_from(table("albuns_fts"))
+            .where(text("albuns_fts MATCH :busca_fts").bindparams(busca_fts=expressao))
+        )
+        return consulta.filter(Album.id.in_(ids_fts))
+    padrao = "%" + termo.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    return consulta.filter(func.lower(Album.titulo).like(padrao, escape="\\"))
+
+def _consulta_feed(categoria: Optional[str], cidade: Optional[str], busca: Optional[str]):
+    consulta = select(Album)
+    if categoria:
+        consulta = consulta.filter(func.lower(Album.categoria) == categoria.lower())
+    if cidade:
+        consulta = consulta.filter(func.lower(Album.cidade) == cidade.lower())
+    if busca:
+        consulta = _filtrar_titulo(consulta, busca)
+    return consulta
+
+def _cursor_feed(album: Album) -> str:
+    return f"{album.data_evento.isoformat()}_{album.id}"
+
+async def _pagina_feed(db: AsyncSession, cursor: Optional[str], limite: int, categoria: Optional[str] = None,
+                       cidade: Optional[str] = None, busca: Optional[str] = None):
+    """Uma página do feed em keyset pagination sobre (data_evento, id), mais recentes primeiro.
+
+    Retorna (albuns, proximo_cursor); proximo_cursor é None na última página.
+    """
+    consulta = _consulta_feed(categoria, cidade, busca).options(*_opcoes_card_album())
+    if cursor:
+        try:
+            data_iso, album_id = cursor.rsplit("_", 1)
+            data_cursor, id_cursor = datetime.fromisoformat(data_iso), int(album_id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Cursor inválido")
+        consulta = consulta.filter(or_(
+            Album.data_evento < data_cursor,
+            and_(Album.data_evento == data_cursor, Album.id < id_cursor),
+        ))
+    albuns = (await db.scalars(consulta.order_by(Album.data_evento.desc(), Album.id.desc()).limit(limite + 1))).all()
+    proximo = _cursor_feed(albuns[limite - 1]) if len(albuns) > limite else None
+    return albuns[:limite], proximo
+
+def _album_json(album: Album, agora: datetime) -> dict:
+    capa = album.capa
+    dias = (agora.date() - album.data_evento.date()).days
+    return {
+        "hash_url": album.hash_url,
+        "titulo": album.titulo,
+        "categoria": album.categoria,
+        "cidade": album.cidade,
+        "dia": album.data_evento.strftime("%d"),
+        "mes": album.data_evento.strftime("%b"),
+        "novo": 0 <= dias <= 7,
+        "qtd_fotos": album.qtd_fotos or 0,
+        "fotografo": album.fotografo.nome if album.fotografo else None,
+        "capa": {
+            "src": capa.caminho_baixa_res,
+            "srcset": {formato: processamento.srcset(capa, formato) for formato in ("avif", "webp", "jpeg")},
+        } if capa else None,
+    }
+
+@app.get("/api/albuns")
+async def feed_albuns(
+    cursor: Optional[str] = None,
+    limite: int = FEED_POR_PAGINA,
+    categoria: Optional[str] = None,
+    cidade: Optional[str] = None,
+    busca: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    """Feed paginado da home, com filtros aplicados no banco."""
+    limite = max(1, min(limite, FEED_MAX_POR_PAGINA))
+    albuns, proximo = await _pagina_feed(db, cursor, limite, categoria, cidade, busca)
+    agora = datetime.utcnow()
+    resposta = {"albuns": [_album_json(a, agora) for a in albuns], "proximo_cursor": proximo}
+    if not cursor:
+        # Total só na primeira página (para o "N resultados"); as seguintes não pagam o COUNT
+        resposta["total"] = await db.scalar(_consulta_feed(categoria, cidade, busca).with_only_columns(func.count(Album.id)))
+    return resposta
+
 @app.get("/", response_class=HTMLResponse)
-async def landing_page(request: Request, db: Session = Depends(get_db)):
-    albuns = db.query(Album).order_by(Album.data_evento.desc()).all()
-    fotografo = get_fotografo_logado(request, db)
-    return templates.TemplateResponse("home.html", {"request": request, "albuns": albuns, "fotografo": fotografo, "now": datetime.utcnow()})
+async def landing_page(request: Request, db: AsyncSession = Depends(get_db)):
+    # Só a primeira página vai no HTML; o resto vem de /api/albuns conforme o usuário rola
+    albuns, proximo_cursor = await _pagina_feed(db, None, FEED_POR_PAGINA)
+    total_albuns, total_fotos = (await db.execute(select(func.count(Album.id), func.coalesce(func.sum(Album.qtd_fotos), 0)))).one()
+    cidades = (await db.scalars(select(Album.cidade).where(Album.cidade.isnot(None)).distinct().order_by(Album.cidade))).all()
+    fotografo = await get_fotografo_logado(request, db)
+    return templates.TemplateResponse("home.html", {
+        "request": request,
+        "albuns": albuns,
+        "proximo_cursor": proximo_cursor,
+        "total_albuns": total_albuns,
+        "total_fotos": total_fotos,
+        "cidades": cidades,
+        "fotografo": fotografo,
+        "now": datetime.utcnow(),
+    })
 
 # ==========================================
 # AUTENTICAÇÃO (Login / Cadastro / Logout)
@@ -284,8 +487,8 @@ async def tela_cadastro(request: Request):
     return templates.TemplateResponse("cadastro.html", {"request": request})
 
 @app.post("/cadastro")
-async def processar_cadastro(request: Request, nome: str = Form(...), email: str = Form(...), senha: str = Form(...), db: Session = Depends(get_db)):
-    existente = db.query(Fotografo).filter(Fotografo.email == email).first()
+async def processar_cadastro(request: Request, nome: str = Form(...), email: str = Form(...), senha: str = Form(...), db: AsyncSession = Depends(get_db)):
+    existente = await db.scalar(select(Fotografo.id).where(Fotografo.email == email))
     if existente:
         return templates.TemplateResponse("cadastro.html", {"request": request, "erro": "Este e-mail já está em uso."})
 
@@ -296,20 +499,20 @@ async def processar_cadastro(request: Request, nome: str = Form(...), email: str
         plano_atual="starter"
     )
     db.add(novo_fotografo)
-    db.commit()
+    await db.commit()
     return RedirectResponse(url="/login", status_code=303)
 
 @app.get("/login", response_class=HTMLResponse)
-async def tela_login(request: Request, db: Session = Depends(get_db)):
-    fotografo = get_fotografo_logado(request, db)
+async def tela_login(request: Request, db: AsyncSession = Depends(get_db)):
+    fotografo = await get_fotografo_logado(request, db)
     if fotografo:
         destino = "/owner" if (OWNER_EMAIL and fotografo.email == OWNER_EMAIL) else "/admin"
         return RedirectResponse(url=destino, status_code=303)
     return templates.TemplateResponse("login.html", {"request": request})
 
 @app.post("/login")
-async def processar_login(request: Request, email: str = Form(...), senha: str = Form(...), db: Session = Depends(get_db)):
-    fotografo = db.query(Fotografo).filter(Fotografo.email == email).first()
+async def processar_login(request: Request, email: str = Form(...), senha: str = Form(...), db: AsyncSession = Depends(get_db)):
+    fotografo = await db.scalar(select(Fotografo).where(Fotografo.email == email))
     if not fotografo or not hmac.compare_digest(fotografo.senha_hash, _hash_senha(senha)):
         return templates.TemplateResponse("login.html", {"request": request, "erro": "E-mail ou senha incorretos."})
     destino = "/owner" if (OWNER_EMAIL and fotografo.email == OWNER_EMAIL) else "/admin"
@@ -338,54 +541,86 @@ class CriarPedidoIn(BaseModel):
     nome_cliente: str
     email_cliente: str
 
+class CotarCarrinhoIn(BaseModel):
+    itens: List[ItemPedidoIn]
+
+@app.post("/api/cotar-carrinho")
+async def cotar_carrinho(dados: CotarCarrinhoIn, db: AsyncSession = Depends(get_db)):
+    """Total do carrinho com pacote/desconto por volume, para a tela de revisão."""
+    try:
+        cotacao = await db.run_sync(precos.cotar, [(item.foto_id, item.qualidade) for item in dados.itens])
+    except precos.CarrinhoInvalido as exc:
+        return {"sucesso": False, "erro": str(exc)}
+    return {
+        "sucesso": True,
+        "subtotal": cotacao.subtotal,
+        "desconto": cotacao.desconto,
+        "total": cotacao.total,
+        "itens": {item.foto_id: item.preco_cobrado for item in cotacao.itens},
+    }
+
 @app.post("/criar-pedido")
-async def criar_pedido(dados: CriarPedidoIn, db: Session = Depends(get_db)):
-    """Cria um pedido com múltiplos itens e gera o PIX."""
-    if not dados.itens:
-        return {"sucesso": False, "erro": "Nenhum item no pedido"}
+async def criar_pedido(dados: CriarPedidoIn, db: AsyncSession = Depends(get_db),
+                       idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")):
+    """Cria um pedido com múltiplos itens e gera o PIX.
+
+    Idempotente: o mesmo Idempotency-Key devolve o pedido já criado, e o mesmo
+    carrinho do mesmo cliente reaproveita o PIX pendente que ainda vale.
+    """
+    chave = _chave_idempotencia(idempotency_key)
+    itens = [(item.foto_id, item.qualidade) for item in dados.itens]
+    assinatura_requisicao = _assinatura_requisicao(itens, dados.email_cliente)
+    existente = await _pedido_da_chave(db, chave, assinatura_requisicao)
+    if existente:
+        return existente
 
-    primeira_foto = db.query(Foto).filter(Foto.id == dados.itens[0].foto_id).first()
-    if not primeira_foto:
-        return {"sucesso": False, "erro": "Foto não encontrada"}
+    # Preço do carrinho inteiro numa consulta só (fotos + álbum + fotógrafo)
+    try:
+        cotacao = await db.run_sync(precos.cotar, itens)
+    except precos.CarrinhoInvalido as exc:
+        return {"sucesso": False, "erro": str(exc)}
 
-    fotografo = primeira_foto.album.fotografo
+    fotografo = cotacao.fotografo
     if not fotografo.mp_access_token:
         return {"sucesso": False, "erro": "Fotógrafo não configurado para receber"}
 
-    valor_total = 0.0
-    fotos_itens = []
-    for item in dados.itens:
-        foto = db.query(Foto).filter(Foto.id == item.foto_id).first()
-        if not foto:
-            return {"sucesso": False, "erro": f"Foto {item.foto_id} não encontrada"}
-        preco = foto.preco_alta if item.qualidade == 'alta' else foto.preco_baixa
-        valor_total += preco
-        fotos_itens.append((foto, item.qualidade, preco))
-
-    valor_total = round(valor_total, 2)
+    valor_total = cotacao.total
     sua_comissao = calcular_comissao(valor_total, fotografo.plano_atual)
 
-    cliente = db.query(Cliente).filter(Cliente.email == dados.email_cliente).first()
+    assinatura = _assinatura_carrinho([(item.foto_id, item.qualidade) for item in cotacao.itens])
+    pedido_vivo = await _pedido_com_pix_vivo(db, dados.email_cliente, fotografo.id, assinatura, valor_total)
+    if pedido_vivo:
+        return {"sucesso": True, "pedido_id": pedido_vivo}
+
+    cliente = await db.scalar(select(Cliente).where(Cliente.email == dados.email_cliente).limit(1))
     if not cliente:
         cliente = Cliente(nome=dados.nome_cliente, email=dados.email_cliente)
         db.add(cliente)
-        db.flush()
+        await db.flush()
 
     novo_pedido = Pedido(
         cliente_id=cliente.id,
         fotografo_id=fotografo.id,
         valor_total=valor_total,
-        taxa_plataforma=sua_comissao
+        taxa_plataforma=sua_comissao,
+        chave_idempotencia=chave,
+        assinatura_carrinho=assinatura,
+        assinatura_requisicao=assinatura_requisicao,
     )
     db.add(novo_pedido)
-    db.flush()
-
-    for foto, qualidade, preco in fotos_itens:
-        item_db = ItemPedido(pedido_id=novo_pedido.id, foto_id=foto.id, qualidade=qualidade, preco_cobrado=preco)
-        db.add(item_db)
-    db.commit()
-
-    pix = gerar_cobranca_pix(
+    try:
+        await db.flush()
+    except IntegrityError:  # Outro request com a mesma chave chegou antes
+        return await _pedido_da_chave_em_conflito(db, chave, assinatura_requisicao)
+
+    # Um INSERT em lote (executemany) para todos os itens
+    await db.execute(insert(ItemPedido), [
+        {"pedido_id": novo_pedido.id, "foto_id": item.foto_id, "qualidade": item.qualidade, "preco_cobrado": item.preco_cobrado}
+        for item in cotacao.itens
+    ])
+    await db.commit()
+
+    pix = await _gerar_pix(
         valor_pedido=valor_total,
         email_cliente=cliente.email,
         nome_cliente=cliente.nome,
@@ -396,7 +631,8 @@ async def criar_pedido(dados: CriarPedidoIn, db: Session = Depends(get_db)):
 
     if not pix["sucesso"]:
         novo_pedido.status_pagamento = "Cancelado"
-        db.commit()
+        novo_pedido.chave_idempotencia = None  # Libera a chave: repetir o envio tenta de novo
+        await db.commit()
         return {"sucesso": False, "erro": pix.get("erro", "Falha ao gerar o PIX no Mercado Pago")}
 
     # Ajusta comissão registrada ao que foi realmente aplicado
@@ -405,40 +641,38 @@ async def criar_pedido(dados: CriarPedidoIn, db: Session = Depends(get_db)):
 
     novo_pedido.pix_txid = pix["txid"]
     novo_pedido.pix_copia_cola = pix["copia_cola"]
-    novo_pedido.pix_qr_code_base64 = pix["qr_code_img"]
+    await run_in_threadpool(qr_pix.guardar_imagem_mp, pix["txid"], pix["qr_code_img"])
     novo_pedido.pix_expiracao = pix.get("expiracao")
-    db.commit()
+    await db.commit()
 
     return {"sucesso": True, "pedido_id": novo_pedido.id}
 
 @app.get("/pagamento/{pedido_id}", response_class=HTMLResponse)
-async def tela_pagamento(request: Request, pedido_id: int, db: Session = Depends(get_db)):
-    pedido = db.query(Pedido).filter(Pedido.id == pedido_id).first()
+async def tela_pagamento(request: Request, pedido_id: int, db: AsyncSession = Depends(get_db)):
+    pedido = await db.get(Pedido, pedido_id)
     if not pedido:
         raise HTTPException(status_code=404)
 
-    # Determina expiração (usa pix_expiracao se disponível, senão fallback para 30 min após criação)
-    expiracao = pedido.pix_expiracao or (pedido.data_pedido + timedelta(minutes=30))
-    if pedido.status_pagamento == "Pendente" and datetime.utcnow() > expiracao:
-        pedido.status_pagamento = "Expirado"
-        db.commit()
+    # Só leitura: PIX vencido aparece expirado mesmo antes da varredura gravar o status
+    expiracao = expiracao_pedidos.expiracao(pedido.pix_expiracao, pedido.data_pedido)
+    status = expiracao_pedidos.status_visivel(pedido.status_pagamento, pedido.pix_expiracao, pedido.data_pedido)
 
-    if pedido.status_pagamento == "Expirado":
+    if status == "Expirado":
         return templates.TemplateResponse("pagamento.html", {
             "request": request,
             "pedido_id": pedido.id,
             "valor_total": f"{pedido.valor_total:.2f}".replace('.', ','),
             "copia_cola": None,
-            "qr_code_base64": None,
+            "qr_code_url": None,
             "expirado": True,
             "expiracao_iso": None,
         })
 
-    if pedido.status_pagamento == "Pago":
+    if status == "Pago":
         return templates.TemplateResponse("sucesso.html", {
             "request": request,
             "pedido_id": pedido.id,
-            "qtd_fotos": len(pedido.itens),
+            "qtd_fotos": await _qtd_itens(db, pedido.id),
             "download_token": pedido.token_download,
         })
 
@@ -448,38 +682,116 @@ async def tela_pagamento(request: Request, pedido_id: int, db: Session = Depends
         "pedido_id": pedido.id,
         "valor_total": f"{pedido.valor_total:.2f}".replace('.', ','),
         "copia_cola": pedido.pix_copia_cola,
-        "qr_code_base64": pedido.pix_qr_code_base64,
+        "qr_code_url": _url_qr_code(pedido),
         "expirado": False,
         "expiracao_iso": expiracao_iso,
     })
 
+async def _qtd_itens(db: AsyncSession, pedido_id: int) -> int:
+    return await db.scalar(select(func.count(ItemPedido.id)).where(ItemPedido.pedido_id == pedido_id))
+
+def _url_qr_code(pedido: Pedido) -> str:
+    # O txid na URL muda quando o PIX é regenerado, então o navegador pode guardar a imagem
+    return f"/pagamento/{pedido.id}/qr.png?v={pedido.pix_txid}"
+
+@app.get("/pagamento/{pedido_id}/qr.png")
+async def qr_code_pix(request: Request, pedido_id: int, db: AsyncSession = Depends(get_db)):
+    """Imagem do QR code do PIX, gerada a partir do copia e cola (ou a guardada do Mercado Pago)."""
+    pedido = (await db.execute(select(Pedido.pix_txid, Pedido.pix_copia_cola).where(Pedido.id == pedido_id))).first()
+    if not pedido or not pedido.pix_txid:
+        raise HTTPException(status_code=404)
+    etag = f'"{pedido.pix_txid}"'
+    cabecalhos = {"Cache-Control": f"private, max-age={PIX_EXPIRACAO_MINUTOS * 60}", "ETag": etag}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=cabecalhos)
+    png = await run_in_threadpool(qr_pix.gerar_png, pedido.pix_txid, pedido.pix_copia_cola)
+    if png is None:
+        raise HTTPException(status_code=404)
+    return Response(content=png, media_type="image/png", headers=cabecalhos)
+
+async def _status_pedido(db: AsyncSession, pedido_id: int) -> "tuple | None":
+    """(status visível, expiração do PIX) do pedido, lendo só essas colunas."""
+    linha = (await db.execute(
+        select(Pedido.status_pagamento, Pedido.pix_expiracao, Pedido.data_pedido).where(Pedido.id == pedido_id)
+    )).first()
+    if not linha:
+        return None
+    status, pix_expiracao, data_pedido = linha
+    return (
+        expiracao_pedidos.status_visivel(status, pix_expiracao, data_pedido),
+        expiracao_pedidos.expiracao(pix_expiracao, data_pedido),
+    )
+
 @app.get("/api/status-pagamento/{pedido_id}")
-async def verificar_status_pagamento(pedido_id: int, db: Session = Depends(get_db)):
-    pedido = db.query(Pedido).filter(Pedido.id == pedido_id).first()
-    if not pedido:
+async def verificar_status_pagamento(pedido_id: int, db: AsyncSession = Depends(get_db)):
+    lido = await _status_pedido(db, pedido_id)
+    if lido is None:
+        raise HTTPException(status_code=404)
+    return {"status": lido[0]}
+
+SSE_RECHECAGEM_SEGUNDOS = 20        # Cobre pagamentos processados por outro worker
+SSE_DURACAO_MAXIMA_SEGUNDOS = 600   # Depois disso o navegador reconecta sozinho
+
+async def _ler_status_pedido(pedido_id: int) -> "tuple | None":
+    """_status_pedido numa sessão curta (o stream SSE não segura conexão do pool)."""
+    async with AsyncSessionLocal() as db:
+        return await _status_pedido(db, pedido_id)
+
+async def _eventos_status(request: Request, pedido_id: int):
+    loop = asyncio.get_running_loop()
+    fim = loop.time() + SSE_DURACAO_MAXIMA_SEGUNDOS
+    yield "retry: 3000\n\n"
+    with eventos_pedido.assinar(pedido_id) as fila:
+        # Lido depois de assinar: nenhuma mudança escapa entre a leitura e a assinatura
+        lido = await _ler_status_pedido(pedido_id)
+        enviado = None
+        while lido is not None:
+            status, expiracao = lido
+            if status != enviado:
+                yield f"event: status\ndata: {json.dumps({'status': status})}\n\n"
+                enviado = status
+            if status != "Pendente" or loop.time() >= fim:
+                return
+            # Acorda com a publicação do webhook, na expiração do PIX ou na rechecagem periódica
+            espera = min(SSE_RECHECAGEM_SEGUNDOS, max((expiracao - datetime.utcnow()).total_seconds(), 0) + 1)
+            try:
+                lido = (await asyncio.wait_for(fila.get(), timeout=espera), expiracao)
+                continue
+            except asyncio.TimeoutError:
+                pass
+            if await request.is_disconnected():
+                return
+            yield ": ping\n\n"
+            lido = await _ler_status_pedido(pedido_id)
+
+@app.get("/api/status-pagamento/{pedido_id}/stream")
+async def acompanhar_status_pagamento(request: Request, pedido_id: int):
+    """Server-Sent Events com o status do pedido: empurrado quando o webhook muda o pedido."""
+    if await _ler_status_pedido(pedido_id) is None:
         raise HTTPException(status_code=404)
-    # Auto-expirar se o tempo passou e ainda está Pendente
-    if pedido.status_pagamento == "Pendente":
-        expiracao = pedido.pix_expiracao or (pedido.data_pedido + timedelta(minutes=30))
-        if datetime.utcnow() > expiracao:
-            pedido.status_pagamento = "Expirado"
-            db.commit()
-    return {"status": pedido.status_pagamento}
+    return StreamingResponse(
+        _eventos_status(request, pedido_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 @app.post("/api/regenerar-pix/{pedido_id}")
-async def regenerar_pix(pedido_id: int, db: Session = Depends(get_db)):
+async def regenerar_pix(pedido_id: int, db: AsyncSession = Depends(get_db)):
     """Regenera o PIX de um pedido expirado ou cancelado."""
-    pedido = db.query(Pedido).filter(Pedido.id == pedido_id).first()
+    pedido = await db.scalar(
+        select(Pedido).options(joinedload(Pedido.fotografo), joinedload(Pedido.cliente)).where(Pedido.id == pedido_id)
+    )
     if not pedido:
         raise HTTPException(status_code=404)
-    if pedido.status_pagamento not in ("Expirado", "Cancelado"):
+    status = expiracao_pedidos.status_visivel(pedido.status_pagamento, pedido.pix_expiracao, pedido.data_pedido)
+    if status not in ("Expirado", "Cancelado"):
         return {"sucesso": False, "erro": "Este pedido não pode ser regenerado."}
 
     fotografo = pedido.fotografo
     if not fotografo.mp_access_token:
         return {"sucesso": False, "erro": "Fotógrafo não configurado para receber."}
 
-    pix = gerar_cobranca_pix(
+    pix = await _gerar_pix(
         valor_pedido=pedido.valor_total,
         email_cliente=pedido.cliente.email,
         nome_cliente=pedido.cliente.nome,
@@ -494,69 +806,109 @@ async def regenerar_pix(pedido_id: int, db: Session = Depends(get_db)):
     pedido.status_pagamento = "Pendente"
     pedido.pix_txid = pix["txid"]
     pedido.pix_copia_cola = pix["copia_cola"]
-    pedido.pix_qr_code_base64 = pix["qr_code_img"]
+    await run_in_threadpool(qr_pix.guardar_imagem_mp, pix["txid"], pix["qr_code_img"])
     pedido.pix_expiracao = pix.get("expiracao")
-    db.commit()
+    await db.commit()
 
     expiracao_iso = pedido.pix_expiracao.strftime("%Y-%m-%dT%H:%M:%S") if pedido.pix_expiracao else None
     return {
         "sucesso": True,
         "copia_cola": pedido.pix_copia_cola,
-        "qr_code_base64": pedido.pix_qr_code_base64,
+        "qr_code_url": _url_qr_code(pedido),
         "expiracao_iso": expiracao_iso,
     }
 
 @app.get("/sucesso/{pedido_id}", response_class=HTMLResponse)
-async def tela_sucesso(request: Request, pedido_id: int, db: Session = Depends(get_db)):
-    pedido = db.query(Pedido).filter(Pedido.id == pedido_id).first()
+async def tela_sucesso(request: Request, pedido_id: int, db: AsyncSession = Depends(get_db)):
+    pedido = await db.get(Pedido, pedido_id)
     if not pedido or pedido.status_pagamento != "Pago":
         raise HTTPException(status_code=403)
     return templates.TemplateResponse("sucesso.html", {
         "request": request,
         "pedido_id": pedido.id,
-        "qtd_fotos": len(pedido.itens),
+        "qtd_fotos": await _qtd_itens(db, pedido.id),
         "download_token": pedido.token_download,
     })
 
+def _entradas_zip_pedido(db, pedido_id: int) -> List[EntradaZip]:
+    """Arquivos do ZIP do pedido. Recebe uma Session síncrona (das rotas, via `db.run_sync`)."""
+    itens = db.query(ItemPedido).options(joinedload(ItemPedido.foto)).filter(ItemPedido.pedido_id == pedido_id).all()
+    entradas = []
+    for item in itens:
+        foto = item.foto
+        if item.qualidade == "alta":
+            caminho_real = os.path.join(DIRETORIO_ALTA_RES, foto.caminho_alta_res)
+        else:
+            # Versão web sem marca d'água; fotos antigas só têm a vitrine
+            caminho_real = processamento.caminho_web(foto)
+            if not os.path.exists(caminho_real):
+                caminho_real = processamento.caminho_baixa(foto)
+        nome_arq = f"original_{foto.id}.jpg" if item.qualidade == "alta" else f"web_{foto.id}.jpg"
+        if os.path.exists(caminho_real):
+            entradas.append(EntradaZip(caminho_real, nome_arq))
+    return entradas
+
+def _aquecer_cache_zip(pedido_id: int):
+    """Monta o ZIP do pedido no cache de downloads (roda em background, fora da requisição)."""
+    db = SessionLocal()
+    try:
+        pedido = db.query(Pedido).filter(Pedido.id == pedido_id).first()
+        if not pedido or pedido.status_pagamento != "Pago":
+            return
+        if os.path.exists(cache_downloads.caminho_cache(pedido.token_download)):
+            return
+        entradas = _entradas_zip_pedido(db, pedido.id)
+        token = pedido.token_download
+    finally:
+        db.close()
+    cache_downloads.montar(token, entradas)
+
 @app.get("/baixar/{token}")
-async def baixar_fotos_zip(token: str, db: Session = Depends(get_db)):
-    pedido = db.query(Pedido).filter(Pedido.token_download == token).first()
+async def baixar_fotos_zip(token: str, background_tasks: BackgroundTasks, db: AsyncSession = Depends(get_db)):
+    pedido = await db.scalar(select(Pedido).where(Pedido.token_download == token))
     if not pedido or pedido.status_pagamento != "Pago":
         raise HTTPException(status_code=403)
 
     # Verifica expiração do link de download (7 dias após a criação do pedido)
     if datetime.utcnow() > pedido.data_pedido + timedelta(days=DOWNLOAD_DURACAO_DIAS):
+        cache_downloads.remover(token)
         raise HTTPException(status_code=410, detail="Link de download expirado.")
 
-    memory_file = io.BytesIO()
-    with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_DEFLATED) as zf:
-        for item in pedido.itens:
-            foto = item.foto
-            caminho_real = os.path.join(DIRETORIO_ALTA_RES, foto.caminho_alta_res) if item.qualidade == "alta" else foto.caminho_baixa_res.lstrip('/')
-            nome_arq = f"original_{foto.id}.jpg" if item.qualidade == "alta" else f"web_{foto.id}.jpg"
-            if os.path.exists(caminho_real):
-                zf.write(caminho_real, arcname=nome_arq)
+    nome_download = f"yshpics_pedido_{pedido.id}.zip"
+
+    # ZIP já montado (aquecido no webhook ou num download anterior): sendfile + Range
+    em_cache = cache_downloads.obter(token)
+    if em_cache:
+        return FileResponse(em_cache, media_type="application/zip", filename=nome_download)
 
-    memory_file.seek(0)
+    # ZIP gerado enquanto é enviado (STORED, memória constante); o tamanho é conhecido de antemão
+    arquivo_zip = ZipStream(await db.run_sync(_entradas_zip_pedido, pedido.id))
+    background_tasks.add_task(_aquecer_cache_zip, pedido.id)
     return StreamingResponse(
-        memory_file, media_type="application/zip", 
-        headers={"Content-Disposition": f"attachment; filename=yshpics_pedido_{pedido.id}.zip"}
+        arquivo_zip, media_type="application/zip",
+        headers={
+            "Content-Disposition": f"attachment; filename={nome_download}",
+            "Content-Length": str(arquivo_zip.tamanho),
+        }
     )
 
 # ==========================================
 # ADMIN E UPLOAD
 # ==========================================
 @app.get("/admin", response_class=HTMLResponse)
-async def tela_admin(request: Request, db: Session = Depends(get_db)):
-    fotografo = get_fotografo_logado(request, db)
+async def tela_admin(request: Request, db: AsyncSession = Depends(get_db)):
+    fotografo = await get_fotografo_logado(request, db)
     if not fotografo:
         return RedirectResponse(url="/login", status_code=303)
 
-    meus_albuns = db.query(Album).filter(Album.fotografo_id == fotografo.id).order_by(Album.data_evento.desc()).all()
-    pedidos_pagos = db.query(Pedido).filter(Pedido.fotografo_id == fotografo.id, Pedido.status_pagamento == "Pago").all()
-
-    total_vendido = sum(p.valor_total for p in pedidos_pagos)
-    minhas_taxas = sum(p.taxa_plataforma for p in pedidos_pagos)
+    meus_albuns = (await db.scalars(
+        select(Album).options(*_opcoes_card_album())
+        .where(Album.fotografo_id == fotografo.id)
+        .order_by(Album.data_evento.desc())
+    )).all()
+    resumo = await db.run_sync(metricas.resumo_fotografo, fotografo.id)
+    total_vendido = resumo.totais.volume
+    minhas_taxas = resumo.totais.receita_plataforma
     lucro_limpo = total_vendido - minhas_taxas
 
     return templates.TemplateResponse("admin.html", {
@@ -566,7 +918,9 @@ async def tela_admin(request: Request, db: Session = Depends(get_db)):
         "lucro": f"{lucro_limpo:.2f}".replace('.', ','),
         "total_vendido": f"{total_vendido:.2f}".replace('.', ','),
         "taxa_cobrada": f"{minhas_taxas:.2f}".replace('.', ','),
-        "vendas": len(pedidos_pagos),
+        "vendas": resumo.totais.qtd_pedidos,
+        "vendas_por_album": resumo.por_album,
+        "fotos_mais_vendidas": resumo.mais_vendidas,
         "is_owner": bool(OWNER_EMAIL and fotografo.email == OWNER_EMAIL),
         "preco_minimo": f"{PRECO_MINIMO:.2f}".replace('.', ','),
         "preco_minimo_num": PRECO_MINIMO,
@@ -576,43 +930,99 @@ async def tela_admin(request: Request, db: Session = Depends(get_db)):
     })
 
 @app.post("/api/configurar-mp")
-async def configurar_mp(request: Request, mp_token: str = Form(...), db: Session = Depends(get_db)):
-    fotografo = get_fotografo_logado(request, db)
+async def configurar_mp(request: Request, mp_token: str = Form(...), db: AsyncSession = Depends(get_db)):
+    fotografo = await get_fotografo_logado(request, db)
     if fotografo:
         fotografo.mp_access_token = mp_token
-        db.commit()
+        await db.commit()
+    return RedirectResponse(url="/admin", status_code=303)
+
+@app.post("/api/marca-dagua")
+async def configurar_marca_dagua(request: Request, marca: str = Form(""), db: AsyncSession = Depends(get_db)):
+    """Troca o texto da marca d'água e regera, em background, as vitrines já publicadas."""
+    fotografo = await get_fotografo_logado(request, db)
+    if fotografo:
+        nova = marca_dagua.normalizar(marca) or None
+        if nova != fotografo.marca_dagua:
+            fotografo.marca_dagua = nova
+            fotografo.marca_dagua_versao = (fotografo.marca_dagua_versao or 0) + 1
+            await db.commit()
+            processamento.agendar_remarcacao(fotografo.id)
     return RedirectResponse(url="/admin", status_code=303)
 
 @app.post("/api/excluir-album")
 async def excluir_album_proprio(
     request: Request,
     album_id: int = Form(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    fotografo = get_fotografo_logado(request, db)
+    fotografo = await get_fotografo_logado(request, db)
     if not fotografo:
         raise HTTPException(status_code=401, detail="Não autenticado")
-    album = db.query(Album).filter(Album.id == album_id, Album.fotografo_id == fotografo.id).first()
-    if not album:
+    album_id = await db.scalar(select(Album.id).where(Album.id == album_id, Album.fotografo_id == fotografo.id))
+    if album_id is None:
         raise HTTPException(status_code=404, detail="Álbum não encontrado")
-    foto_ids = [f.id for f in album.fotos]
-    if foto_ids:
-        db.query(ItemPedido).filter(ItemPedido.foto_id.in_(foto_ids)).delete(synchronize_session=False)
-    for foto in album.fotos:
-        try:
-            caminho_alta = os.path.join(DIRETORIO_ALTA_RES, foto.caminho_alta_res)
-            if os.path.exists(caminho_alta):
-                os.remove(caminho_alta)
-            caminho_baixa = foto.caminho_baixa_res.lstrip('/')
-            if os.path.exists(caminho_baixa):
-                os.remove(caminho_baixa)
-        except Exception:
-            pass
-        db.delete(foto)
-    db.delete(album)
-    db.commit()
+    fotos = await _excluir_albuns(db, [album_id])
+    await db.commit()
+    await run_in_threadpool(processamento.remover_arquivos_das_fotos, fotos)
     return RedirectResponse(url="/admin", status_code=303)
 
+async def _excluir_albuns(db: AsyncSession, album_ids: List[int]) -> List[Foto]:
+    """Apaga os álbuns com as fotos, rostos e itens de pedido dessas fotos, em DELETEs em lote (sem commit).
+
+    Retorna as fotos apagadas, para remover os arquivos do disco depois do commit.
+    """
+    if not album_ids:
+        return []
+    fotos = (await db.scalars(select(Foto).where(Foto.album_id.in_(album_ids)))).all()
+    ids_fotos = select(Foto.id).where(Foto.album_id.in_(album_ids))
+    for comando in (
+        delete(ItemPedido).where(ItemPedido.foto_id.in_(ids_fotos)),
+        delete(RostoFoto).where(RostoFoto.album_id.in_(album_ids)),
+        delete(Foto).where(Foto.album_id.in_(album_ids)),
+        delete(Album).where(Album.id.in_(album_ids)),
+    ):
+        await db.execute(comando.execution_options(synchronize_session=False))
+    return fotos
+
+async def _receber_fotos(db: AsyncSession, album: Album, fotos: List[UploadFile], preco_baixa: float, preco_alta: float) -> List[Foto]:
+    """Grava só os originais (fora do event loop) e cria as fotos como 'Pendente'.
+
+    A vitrine é gerada depois pelo pool de `processamento`.
+    """
+    novas_fotos = []
+    for arquivo in fotos:
+        if not arquivo.filename:
+            continue
+        extensao = arquivo.filename.split(".")[-1]
+        nome_base = str(uuid.uuid4())
+        nome_alta = f"{nome_base}_original.{extensao}"
+        nome_baixa = f"{nome_base}_vitrine.jpg"
+
+        await run_in_threadpool(processamento.salvar_original, arquivo.file, os.path.join(DIRETORIO_ALTA_RES, nome_alta))
+
+        nova_foto = Foto(
+            album_id=album.id,
+            caminho_baixa_res=f"/static/fotos_baixa_res/{nome_baixa}",
+            caminho_alta_res=nome_alta,
+            preco_baixa=preco_baixa,
+            preco_alta=preco_alta,
+            status_processamento=processamento.STATUS_PENDENTE,
+        )
+        db.add(nova_foto)
+        novas_fotos.append(nova_foto)
+    await db.flush()
+    return novas_fotos
+
+def _resposta_upload(album: Album, novas_fotos: List[Foto]) -> dict:
+    return {
+        "sucesso": True,
+        "mensagem": f"{len(novas_fotos)} fotos recebidas! As vitrines estão sendo geradas.",
+        "link_album": f"/{album.hash_url}",
+        "album_id": album.id,
+        "progresso_url": f"/api/album/{album.id}/progresso",
+    }
+
 @app.post("/api/upload")
 async def processar_upload(
     request: Request,
@@ -622,15 +1032,18 @@ async def processar_upload(
     categoria: Optional[str] = Form(None),
     cidade: Optional[str] = Form(None),
     data_evento: Optional[str] = Form(None),
+    preco_pacote: Optional[float] = Form(None),
     fotos: List[UploadFile] = File(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    fotografo = get_fotografo_logado(request, db)
+    fotografo = await get_fotografo_logado(request, db)
     if not fotografo:
         raise HTTPException(status_code=401, detail="Não autenticado")
 
     if preco_baixa < PRECO_MINIMO or preco_alta < PRECO_MINIMO:
         raise HTTPException(status_code=400, detail=f"Preço mínimo por foto é R${PRECO_MINIMO:.2f}".replace('.', ','))
+    if preco_pacote is not None and 0 < preco_pacote < PRECO_MINIMO:
+        raise HTTPException(status_code=400, detail=f"Preço mínimo do pacote é R${PRECO_MINIMO:.2f}".replace('.', ','))
 
     # Parse event date; fall back to today if missing or invalid
     data_evento_dt = datetime.utcnow()
@@ -641,77 +1054,101 @@ async def processar_upload(
             pass
 
     hash_album = str(uuid.uuid4())[:8]
-    novo_album = Album(titulo=titulo_album, hash_url=hash_album, fotografo_id=fotografo.id, categoria=categoria or None, cidade=cidade or None, data_evento=data_evento_dt)
+    novo_album = Album(titulo=titulo_album, hash_url=hash_album, fotografo_id=fotografo.id, categoria=categoria or None, cidade=cidade or None, data_evento=data_evento_dt,
+                       preco_pacote=preco_pacote or None)
     db.add(novo_album)
-    db.flush()
+    await db.flush()
 
-    fotos_cadastradas = 0
-    for arquivo in fotos:
-        if not arquivo.filename: continue
-        extensao = arquivo.filename.split(".")[-1]
-        nome_base = str(uuid.uuid4())
-        nome_alta, nome_baixa = f"{nome_base}_original.{extensao}", f"{nome_base}_vitrine.jpg"
-        
-        caminho_alta = os.path.join(DIRETORIO_ALTA_RES, nome_alta)
-        caminho_baixa = os.path.join(DIRETORIO_BAIXA_RES, nome_baixa)
-
-        with open(caminho_alta, "wb") as buffer:
-            shutil.copyfileobj(arquivo.file, buffer)
-
-        try:
-            img = Image.open(caminho_alta)
-            if img.mode in ("RGBA", "P"): img = img.convert("RGB")
-            img.thumbnail((800, 800))
-            img.save(caminho_baixa, "JPEG", quality=70)
-        except Exception: continue
+    novas_fotos = await _receber_fotos(db, novo_album, fotos, preco_baixa, preco_alta)
+    resposta = _resposta_upload(novo_album, novas_fotos)
+    trabalhos = processamento.trabalhos(novas_fotos)
+    await db.commit()
+    processamento.enfileirar(trabalhos)
+    return resposta
 
-        nova_foto = Foto(
-            album_id=novo_album.id, caminho_baixa_res=f"/static/fotos_baixa_res/{nome_baixa}",
-            caminho_alta_res=nome_alta, preco_baixa=preco_baixa, preco_alta=preco_alta
-        )
-        db.add(nova_foto)
-        fotos_cadastradas += 1
+@app.get("/api/album/{album_id}/progresso")
+async def progresso_album(request: Request, album_id: int, db: AsyncSession = Depends(get_db)):
+    """Quantas fotos do álbum ainda estão na fila — consultado pelo painel após o upload."""
+    fotografo = await get_fotografo_logado(request, db)
+    if not fotografo:
+        raise HTTPException(status_code=401, detail="Não autenticado")
+    album = (await db.execute(select(Album.id, Album.fotografo_id).where(Album.id == album_id))).first()
+    if not album or (album.fotografo_id != fotografo.id and not await get_owner(request, db)):
+        raise HTTPException(status_code=404)
 
-    db.commit()
-    return {"sucesso": True, "mensagem": f"{fotos_cadastradas} fotos processadas!", "link_album": f"/{novo_album.hash_url}"}
+    contagem = dict((await db.execute(
+        select(Foto.status_processamento, func.count(Foto.id))
+        .where(Foto.album_id == album_id)
+        .group_by(Foto.status_processamento)
+    )).all())
+    pendentes = contagem.get(processamento.STATUS_PENDENTE, 0)
+    prontas = contagem.get(processamento.STATUS_PRONTA, 0)
+    falhas = contagem.get(processamento.STATUS_FALHA, 0)
+    return {
+        "total": pendentes + prontas + falhas,
+        "pendentes": pendentes,
+        "prontas": prontas,
+        "falhas": falhas,
+        "concluido": pendentes == 0,
+    }
 
 # ==========================================
 # PAINEL DO DONO DA PLATAFORMA
 # ==========================================
 
 @app.get("/owner", response_class=HTMLResponse)
-async def painel_dono(request: Request, db: Session = Depends(get_db)):
-    owner = get_owner(request, db)
+async def painel_dono(request: Request, db: AsyncSession = Depends(get_db)):
+    owner = await get_owner(request, db)
     if not owner:
         return RedirectResponse(url="/login", status_code=303)
 
-    todos_fotografos = db.query(Fotografo).order_by(Fotografo.id.desc()).all()
-    todos_albuns = db.query(Album).order_by(Album.data_evento.desc()).all()
-    todos_pedidos = db.query(Pedido).order_by(Pedido.data_pedido.desc()).all()
-
-    # Filtra métricas a partir do último reset (se houver)
-    config = db.query(PlataformaConfig).first()
-    metricas_reset_em = config.metricas_reset_em if config else None
-    if metricas_reset_em:
-        pedidos_pagos = [p for p in todos_pedidos if p.status_pagamento == "Pago" and p.data_pedido >= metricas_reset_em]
-    else:
-        pedidos_pagos = [p for p in todos_pedidos if p.status_pagamento == "Pago"]
+    todos_fotografos = (await db.scalars(select(Fotografo).order_by(Fotografo.id.desc()))).all()
+    albuns_por_fotografo = dict((await db.execute(select(Album.fotografo_id, func.count(Album.id)).group_by(Album.fotografo_id))).all())
+    todos_albuns = (await db.scalars(select(Album).options(*_opcoes_card_album()).order_by(Album.data_evento.desc()))).all()
+    ultimos_pedidos = (await db.scalars(
+        select(Pedido)
+        .options(
+            load_only(Pedido.id, Pedido.valor_total, Pedido.status_pagamento, Pedido.data_pedido, Pedido.cliente_id, Pedido.fotografo_id),
+            joinedload(Pedido.cliente).load_only(Cliente.id, Cliente.nome, Cliente.email),
+            joinedload(Pedido.fotografo).load_only(Fotografo.id, Fotografo.nome),
+        )
+        .order_by(Pedido.data_pedido.desc())
+        .limit(30)
+    )).all()
 
-    receita_total = sum(p.taxa_plataforma for p in pedidos_pagos)
-    volume_total = sum(p.valor_total for p in pedidos_pagos)
+    # Métricas a partir do último reset (se houver), somadas no banco
+    metricas_reset_em = await db.scalar(select(PlataformaConfig.metricas_reset_em).limit(1))
+    totais = await db.run_sync(metricas.totais_plataforma, metricas_reset_em)
 
     return templates.TemplateResponse("owner_admin.html", {
         "request": request,
         "owner": owner,
         "fotografos": todos_fotografos,
+        "albuns_por_fotografo": albuns_por_fotografo,
         "albuns": todos_albuns,
-        "pedidos": todos_pedidos[:30],
-        "pedidos_pagos": len(pedidos_pagos),
-        "receita_total": f"{receita_total:.2f}".replace('.', ','),
-        "volume_total": f"{volume_total:.2f}".replace('.', ','),
+        "pedidos": ultimos_pedidos,
+        "pedidos_pagos": totais.qtd_pedidos,
+        "receita_total": f"{totais.receita_plataforma:.2f}".replace('.', ','),
+        "volume_total": f"{totais.volume:.2f}".replace('.', ','),
         "metricas_reset_em": metricas_reset_em.strftime("%d/%m/%Y %H:%M") if metricas_reset_em else None,
     })
 
+@app.get("/owner/api/fila-emails")
+async def owner_fila_emails(request: Request, db: AsyncSession = Depends(get_db)):
+    """Profundidade da caixa de saída de e-mails (monitoramento)."""
+    owner = await get_owner(request, db)
+    if not owner:
+        raise HTTPException(status_code=401)
+    return await db.run_sync(emails.profundidade_fila)
+
+@app.get("/owner/api/facial")
+async def owner_facial(request: Request, db: AsyncSession = Depends(get_db)):
+    """Fila, cache e tempos (espera vs. cálculo) da busca facial (monitoramento)."""
+    owner = await get_owner(request, db)
+    if not owner:
+        raise HTTPException(status_code=401)
+    return facial.estatisticas()
+
 @app.post("/owner/upload")
 async def owner_upload(
     request: Request,
@@ -722,13 +1159,13 @@ async def owner_upload(
     categoria: Optional[str] = Form(None),
     cidade: Optional[str] = Form(None),
     fotos: List[UploadFile] = File(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    owner = get_owner(request, db)
+    owner = await get_owner(request, db)
     if not owner:
         raise HTTPException(status_code=401, detail="Não autenticado")
 
-    fotografo = db.query(Fotografo).filter(Fotografo.id == fotografo_id).first()
+    fotografo = await db.get(Fotografo, fotografo_id)
     if not fotografo:
         raise HTTPException(status_code=404, detail="Fotógrafo não encontrado")
 
@@ -738,106 +1175,64 @@ async def owner_upload(
     hash_album = str(uuid.uuid4())[:8]
     novo_album = Album(titulo=titulo_album, hash_url=hash_album, fotografo_id=fotografo.id, categoria=categoria or None, cidade=cidade or None)
     db.add(novo_album)
-    db.flush()
+    await db.flush()
 
-    fotos_cadastradas = 0
-    for arquivo in fotos:
-        if not arquivo.filename:
-            continue
-        extensao = arquivo.filename.split(".")[-1]
-        nome_base = str(uuid.uuid4())
-        nome_alta = f"{nome_base}_original.{extensao}"
-        nome_baixa = f"{nome_base}_vitrine.jpg"
-
-        caminho_alta = os.path.join(DIRETORIO_ALTA_RES, nome_alta)
-        caminho_baixa = os.path.join(DIRETORIO_BAIXA_RES, nome_baixa)
-
-        with open(caminho_alta, "wb") as buffer:
-            shutil.copyfileobj(arquivo.file, buffer)
-
-        try:
-            img = Image.open(caminho_alta)
-            if img.mode in ("RGBA", "P"):
-                img = img.convert("RGB")
-            img.thumbnail((800, 800))
-            img.save(caminho_baixa, "JPEG", quality=70)
-        except Exception:
-            continue
-
-        nova_foto = Foto(
-            album_id=novo_album.id,
-            caminho_baixa_res=f"/static/fotos_baixa_res/{nome_baixa}",
-            caminho_alta_res=nome_alta,
-            preco_baixa=preco_baixa,
-            preco_alta=preco_alta,
-        )
-        db.add(nova_foto)
-        fotos_cadastradas += 1
-
-    db.commit()
-    return {"sucesso": True, "mensagem": f"{fotos_cadastradas} fotos processadas!", "link_album": f"/{novo_album.hash_url}"}
+    novas_fotos = await _receber_fotos(db, novo_album, fotos, preco_baixa, preco_alta)
+    resposta = _resposta_upload(novo_album, novas_fotos)
+    trabalhos = processamento.trabalhos(novas_fotos)
+    await db.commit()
+    processamento.enfileirar(trabalhos)
+    return resposta
 
 @app.post("/owner/alterar-plano")
 async def owner_alterar_plano(
     request: Request,
     fotografo_id: int = Form(...),
     novo_plano: str = Form(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    owner = get_owner(request, db)
+    owner = await get_owner(request, db)
     if not owner:
         raise HTTPException(status_code=401)
     if novo_plano not in ("starter", "pro"):
         raise HTTPException(status_code=400, detail="Plano inválido")
-    fotografo = db.query(Fotografo).filter(Fotografo.id == fotografo_id).first()
+    fotografo = await db.get(Fotografo, fotografo_id)
     if not fotografo:
         raise HTTPException(status_code=404)
     fotografo.plano_atual = novo_plano
-    db.commit()
+    await db.commit()
     return RedirectResponse(url="/owner", status_code=303)
 
 @app.post("/owner/resetar-metricas")
-async def owner_resetar_metricas(request: Request, db: Session = Depends(get_db)):
+async def owner_resetar_metricas(request: Request, db: AsyncSession = Depends(get_db)):
     """Reseta as métricas do painel master a partir deste momento."""
-    owner = get_owner(request, db)
+    owner = await get_owner(request, db)
     if not owner:
         raise HTTPException(status_code=401)
-    config = db.query(PlataformaConfig).first()
+    config = await db.scalar(select(PlataformaConfig).limit(1))
     if not config:
         config = PlataformaConfig()
         db.add(config)
     config.metricas_reset_em = datetime.utcnow()
-    db.commit()
+    await db.commit()
     return RedirectResponse(url="/owner", status_code=303)
 
 @app.post("/owner/excluir-album")
 async def owner_excluir_album(
     request: Request,
     album_id: int = Form(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    owner = get_owner(request, db)
+    owner = await get_owner(request, db)
     if not owner:
         raise HTTPException(status_code=401)
-    album = db.query(Album).filter(Album.id == album_id).first()
-    if not album:
+    album_id = await db.scalar(select(Album.id).where(Album.id == album_id))
+    if album_id is None:
         raise HTTPException(status_code=404)
-    # Remove fotos do disco e do banco
-    for foto in album.fotos:
-        for item in db.query(ItemPedido).filter(ItemPedido.foto_id == foto.id).all():
-            db.delete(item)
-        try:
-            caminho_alta = os.path.join(DIRETORIO_ALTA_RES, foto.caminho_alta_res)
-            if os.path.exists(caminho_alta):
-                os.remove(caminho_alta)
-            caminho_baixa = foto.caminho_baixa_res.lstrip('/')
-            if os.path.exists(caminho_baixa):
-                os.remove(caminho_baixa)
-        except Exception:
-            pass
-        db.delete(foto)
-    db.delete(album)
-    db.commit()
+    # Remove fotos do banco e, depois do commit, do disco
+    fotos = await _excluir_albuns(db, [album_id])
+    await db.commit()
+    await run_in_threadpool(processamento.remover_arquivos_das_fotos, fotos)
     return RedirectResponse(url="/owner", status_code=303)
 
 
@@ -845,106 +1240,207 @@ async def owner_excluir_album(
 async def owner_excluir_fotografo(
     request: Request,
     fotografo_id: int = Form(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    owner = get_owner(request, db)
+    owner = await get_owner(request, db)
     if not owner:
         raise HTTPException(status_code=401)
     if fotografo_id == owner.id:
         raise HTTPException(status_code=400, detail="Não é possível excluir sua própria conta.")
-    fotografo = db.query(Fotografo).filter(Fotografo.id == fotografo_id).first()
+    fotografo = await db.get(Fotografo, fotografo_id)
     if not fotografo:
         raise HTTPException(status_code=404)
 
-    # Remove todos os álbuns e fotos do fotógrafo
-    foto_ids = []
-    for album in list(fotografo.albuns):
-        for foto in list(album.fotos):
-            foto_ids.append(foto.id)
-            try:
-                caminho_alta = os.path.join(DIRETORIO_ALTA_RES, foto.caminho_alta_res)
-                if os.path.exists(caminho_alta):
-                    os.remove(caminho_alta)
-                caminho_baixa = foto.caminho_baixa_res.lstrip('/')
-                if os.path.exists(caminho_baixa):
-                    os.remove(caminho_baixa)
-            except OSError as e:
-                print(f"⚠️  Erro ao remover arquivo da foto {foto.id}: {e}")
-            db.delete(foto)
-        db.delete(album)
-
-    # Remove itens de pedido ligados às fotos deletadas
-    if foto_ids:
-        db.query(ItemPedido).filter(ItemPedido.foto_id.in_(foto_ids)).delete(synchronize_session=False)
-
-    # Remove pedidos do fotógrafo
-    for pedido in db.query(Pedido).filter(Pedido.fotografo_id == fotografo_id).all():
-        db.delete(pedido)
-
-    db.delete(fotografo)
-    db.commit()
+    # Remove todos os álbuns e fotos do fotógrafo (com itens de pedido e rostos dessas fotos)
+    album_ids = (await db.scalars(select(Album.id).where(Album.fotografo_id == fotografo_id))).all()
+    fotos = await _excluir_albuns(db, album_ids)
+
+    # Remove pedidos do fotógrafo e o rollup de vendas dele (sai também dos totais da plataforma)
+    ids_pedidos = select(Pedido.id).where(Pedido.fotografo_id == fotografo_id)
+    for comando in (
+        delete(ItemPedido).where(ItemPedido.pedido_id.in_(ids_pedidos)),
+        delete(Pedido).where(Pedido.fotografo_id == fotografo_id),
+        delete(VendaDiaria).where(VendaDiaria.fotografo_id == fotografo_id),
+        delete(Fotografo).where(Fotografo.id == fotografo_id),
+    ):
+        await db.execute(comando.execution_options(synchronize_session=False))
+    await db.commit()
+    metricas.invalidar_fotografo(fotografo_id)
+    await run_in_threadpool(processamento.remover_arquivos_das_fotos, fotos)
     return RedirectResponse(url="/owner", status_code=303)
 
 
+GALERIA_POR_PAGINA = 60
+GALERIA_MAX_POR_PAGINA = 200
+
+async def _pagina_galeria(db: AsyncSession, album_id: int, cursor: Optional[str], limite: int):
+    """Uma página das fotos prontas do álbum em keyset pagination sobre o id.
+
+    Retorna (fotos, proximo_cursor); proximo_cursor é None na última página.
+    """
+    # Fotos ainda sem vitrine (na fila ou com falha) não aparecem na galeria
+    consulta = (
+        select(Foto)
+        .options(load_only(Foto.id, Foto.caminho_baixa_res, Foto.derivados, Foto.preco_baixa, Foto.preco_alta))
+        .where(Foto.album_id == album_id, Foto.status_processamento == processamento.STATUS_PRONTA)
+    )
+    if cursor:
+        try:
+            consulta = consulta.where(Foto.id > int(cursor))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Cursor inválido")
+    fotos = (await db.scalars(consulta.order_by(Foto.id).limit(limite + 1))).all()
+    proximo = str(fotos[limite - 1].id) if len(fotos) > limite else None
+    return fotos[:limite], proximo
+
+def _foto_json(foto: Foto) -> dict:
+    return {
+        "id": foto.id,
+        "src": foto.caminho_baixa_res,
+        "srcset": {formato: processamento.srcset(foto, formato) for formato in ("avif", "webp", "jpeg")},
+        "preco_baixa": foto.preco_baixa,
+        "preco_alta": foto.preco_alta,
+    }
+
+@app.get("/api/album/{hash_url}/fotos")
+async def fotos_do_album(hash_url: str, cursor: Optional[str] = None, limite: int = GALERIA_POR_PAGINA, db: AsyncSession = Depends(get_db)):
+    """Fotos da galeria paginadas, no formato compacto que a grade virtualizada consome."""
+    album_id = await db.scalar(select(Album.id).where(Album.hash_url == hash_url))
+    if album_id is None:
+        raise HTTPException(status_code=404)
+    limite = max(1, min(limite, GALERIA_MAX_POR_PAGINA))
+    fotos, proximo = await _pagina_galeria(db, album_id, cursor, limite)
+    return {"fotos": [_foto_json(f) for f in fotos], "proximo_cursor": proximo}
+
 @app.get("/{hash_url}", response_class=HTMLResponse)
-async def ver_album(request: Request, hash_url: str, db: Session = Depends(get_db)):
+async def ver_album(request: Request, hash_url: str, db: AsyncSession = Depends(get_db)):
     if hash_url == "favicon.ico":
         raise HTTPException(status_code=404)
 
-    album = db.query(Album).filter(Album.hash_url == hash_url).first()
+    album = await db.scalar(
+        select(Album).options(joinedload(Album.capa).load_only(Foto.id, Foto.caminho_baixa_res)).where(Album.hash_url == hash_url)
+    )
     if not album:
         raise HTTPException(status_code=404)
 
-    capa_url = ""
-    if album.fotos:
-        capa_url = f"{BASE_URL}{album.fotos[0].caminho_baixa_res}"
+    # Só a primeira página vai no HTML; a grade busca o resto em /api/album/{hash}/fotos
+    fotos, proximo_cursor = await _pagina_galeria(db, album.id, None, GALERIA_POR_PAGINA)
+
+    capa_url = f"{BASE_URL}{album.capa.caminho_baixa_res}" if album.capa else ""
 
     return templates.TemplateResponse("index.html", {
         "request": request,
         "titulo_album": album.titulo,
-        "fotos": album.fotos,
+        "fotos": fotos,
+        "proximo_cursor": proximo_cursor,
+        "total_fotos": album.qtd_fotos or 0,
         "album": album,
         "capa_url": capa_url,
         "base_url": BASE_URL,
     })
 
 
+def _resposta_ocupado(exc: "facial.FacialOcupado") -> JSONResponse:
+    """503 com Retry-After: a fila de selfies está cheia, o cliente tenta de novo em alguns segundos."""
+    return JSONResponse(
+        status_code=503,
+        headers={"Retry-After": str(exc.tentar_em)},
+        content={"sucesso": False, "ocupado": True, "tentar_em": exc.tentar_em,
+                 "erro": f"Muitas buscas agora. Tente de novo em {exc.tentar_em} s."},
+    )
+
+
 @app.post("/api/facial/{hash_url}")
-async def reconhecimento_facial(hash_url: str, selfie: UploadFile = File(...), db: Session = Depends(get_db)):
+async def reconhecimento_facial(hash_url: str, selfie: UploadFile = File(...), db: AsyncSession = Depends(get_db)):
     """Recebe uma selfie e retorna os IDs das fotos do álbum onde o rosto aparece."""
-    if not FACE_RECOGNITION_DISPONIVEL:
+    if not facial.disponivel():
         return {"sucesso": False, "erro": "Reconhecimento facial não disponível no momento."}
 
-    album = db.query(Album).filter(Album.hash_url == hash_url).first()
-    if not album:
+    album_id = await db.scalar(select(Album.id).where(Album.hash_url == hash_url))
+    if album_id is None:
         raise HTTPException(status_code=404)
 
-    # Decodifica a selfie
+    # Decodifica a selfie no pool facial (o dlib não é carregado no processo web)
     selfie_bytes = await selfie.read()
     try:
-        selfie_img = _fr.load_image_file(io.BytesIO(selfie_bytes))
-        selfie_encodings = _fr.face_encodings(selfie_img)
+        selfie_encoding = await facial.encoding_da_selfie(selfie_bytes)
+    except facial.FacialIndisponivel:
+        return {"sucesso": False, "erro": "Reconhecimento facial não disponível no momento."}
+    except facial.FacialOcupado as exc:
+        return _resposta_ocupado(exc)
     except Exception:
         return {"sucesso": False, "erro": "Não foi possível processar a selfie."}
 
-    if not selfie_encodings:
+    if selfie_encoding is None:
         return {"sucesso": False, "erro": "Nenhum rosto detectado na selfie. Tente uma foto frontal com boa iluminação."}
 
-    selfie_encoding = selfie_encodings[0]
-    fotos_encontradas = []
+    # Compara contra os encodings pré-computados no upload (uma única operação vetorizada)
+    fotos_encontradas = await db.run_sync(facial.buscar_no_album, album_id, selfie_encoding)
 
-    for foto in album.fotos:
-        caminho = foto.caminho_baixa_res.lstrip("/")
-        if not os.path.exists(caminho):
-            continue
-        try:
-            img = _fr.load_image_file(caminho)
-            encodings = _fr.face_encodings(img)
-            if encodings:
-                results = _fr.compare_faces(encodings, selfie_encoding, tolerance=0.55)
-                if True in results:
-                    fotos_encontradas.append(foto.id)
-        except Exception:
-            continue
+    # A grade é virtualizada e pode não ter carregado essas fotos ainda: devolve as linhas junto
+    fotos = []
+    if fotos_encontradas:
+        fotos = (await db.scalars(
+            select(Foto)
+            .options(load_only(Foto.id, Foto.caminho_baixa_res, Foto.derivados, Foto.preco_baixa, Foto.preco_alta))
+            .where(Foto.id.in_(fotos_encontradas), Foto.status_processamento == processamento.STATUS_PRONTA)
+            .order_by(Foto.id)
+        )).all()
+
+    return {
+        "sucesso": True,
+        "fotos_com_voce": fotos_encontradas,
+        "total": len(fotos_encontradas),
+        "fotos": [_foto_json(f) for f in fotos],
+    }
+
+
+@app.post("/api/encontrar-me")
+async def encontrar_me(
+    selfie: UploadFile = File(...),
+    cidade: Optional[str] = Form(None),
+    categoria: Optional[str] = Form(None),
+    db: AsyncSession = Depends(get_db),
+):
+    """Busca a selfie em todos os álbuns de uma cidade e/ou categoria; devolve os álbuns e as fotos de cada um."""
+    if not (cidade or categoria):
+        return {"sucesso": False, "erro": "Escolha a cidade ou a categoria dos eventos."}
+    if not facial.disponivel():
+        return {"sucesso": False, "erro": "Reconhecimento facial não disponível no momento."}
+
+    selfie_bytes = await selfie.read()
+    try:
+        selfie_encoding = await facial.encoding_da_selfie(selfie_bytes)
+    except facial.FacialIndisponivel:
+        return {"sucesso": False, "erro": "Reconhecimento facial não disponível no momento."}
+    except facial.FacialOcupado as exc:
+        return _resposta_ocupado(exc)
+    except Exception:
+        return {"sucesso": False, "erro": "Não foi possível processar a selfie."}
+    if selfie_encoding is None:
+        return {"sucesso": False, "erro": "Nenhum rosto detectado na selfie. Tente uma foto frontal com boa iluminação."}
 
-    return {"sucesso": True, "fotos_com_voce": fotos_encontradas, "total": len(fotos_encontradas)}
\ No newline at end of file
+    try:
+        por_album = await run_in_threadpool(indice_facial.buscar, cidade, categoria, selfie_encoding)
+    except facial.FacialOcupado as exc:  # Partição grande ainda sem índice
+        return _resposta_ocupado(exc)
+    if not por_album:
+        return {"sucesso": True, "albuns": [], "total_fotos": 0}
+
+    # O índice pode ter fotos de álbuns excluídos depois da montagem: vale o que existe e está pronto
+    ids_fotos = [foto_id for ids in por_album.values() for foto_id in ids]
+    prontas = set((await db.scalars(
+        select(Foto.id).where(Foto.id.in_(ids_fotos), Foto.status_processamento == processamento.STATUS_PRONTA)
+    )).all())
+    albuns = (await db.scalars(
+        select(Album).options(*_opcoes_card_album())
+        .where(Album.id.in_(list(por_album)))
+        .order_by(Album.data_evento.desc(), Album.id.desc())
+    )).all()
+    agora = datetime.utcnow()
+    resultado = []
+    for album in albuns:
+        fotos = [foto_id for foto_id in por_album[album.id] if foto_id in prontas]
+        if fotos:
+            resultado.append({**_album_json(album, agora), "fotos_com_voce": fotos})
+    return {"sucesso": True, "albuns": resultado, "total_fotos": sum(len(a["fotos_com_voce"]) for a in resultado)}
@@ -0,0 +1,79 @@
+"""Marca d'água queimada nos derivados públicos (vitrine e escada responsiva).
+
+A vitrine não é mais a foto limpa com um overlay CSS por cima: no
+processamento, cada derivado recebe o texto da marca do fotógrafo em
+diagonal, repetido em ladrilhos. O ladrilho RGBA é desenhado uma vez por
+(texto, tamanho) em cada processo do pool — desenhar e girar o texto é a parte
+cara — e a composição com a foto é um alpha blending vetorizado em NumPy.
+
+A cópia de 800px sem marca (entregue a quem compra a versão web e usada na
+extração de rostos) fica no diretório privado, ao lado do original.
+"""
+import os
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+MARCA_DAGUA_PADRAO = "PROVA"
+MARCA_DAGUA_FONTE = os.getenv("MARCA_DAGUA_FONTE", "DejaVuSans-Bold.ttf")
+TAMANHO_MAXIMO_TEXTO = 40
+OPACIDADE_TEXTO = 0.35
+OPACIDADE_SOMBRA = 0.25
+ANGULO = 30
+LADO_MINIMO = 96  # Abaixo disso o texto fica ilegível; a marca cobre a miniatura com menos repetições
+
+
+def normalizar(texto: "str | None") -> str:
+    """Espaços colapsados e no máximo TAMANHO_MAXIMO_TEXTO caracteres."""
+    return " ".join((texto or "").split())[:TAMANHO_MAXIMO_TEXTO]
+
+
+def texto_da_marca(texto: "str | None") -> str:
+    """Texto que vai na foto: a marca do fotógrafo ou, sem ela, MARCA_DAGUA_PADRAO."""
+    return normalizar(texto) or MARCA_DAGUA_PADRAO
+
+
+def _fonte(tamanho: int) -> ImageFont.ImageFont:
+    try:
+        return ImageFont.truetype(MARCA_DAGUA_FONTE, tamanho)
+    except OSError:
+        return ImageFont.load_default(size=tamanho)
+
+
+@lru_cache(maxsize=64)
+def ladrilho(texto: str, lado: int) -> "tuple[np.ndarray, np.ndarray]":
+    """(cor pré-multiplicada pelo alfa, alfa) do ladrilho lado x lado, em float32 (lado, lado, 3|1)."""
+    # Fonte dimensionada para o texto ocupar ~80% do lado antes da rotação
+    fonte = _fonte(100)
+    largura_100 = max(ImageDraw.Draw(Image.new("L", (1, 1))).textlength(texto, font=fonte), 1)
+    fonte = _fonte(max(8, int(100 * 0.8 * lado / largura_100)))
+
+    imagem = Image.new("RGBA", (lado, lado), (0, 0, 0, 0))
+    desenho = ImageDraw.Draw(imagem)
+    centro = lado / 2
+    deslocamento = max(1, fonte.size // 25)
+    desenho.text((centro + deslocamento, centro + deslocamento), texto, font=fonte, anchor="mm",
+                 fill=(0, 0, 0, int(255 * OPACIDADE_SOMBRA)))
+    desenho.text((centro, centro), texto, font=fonte, anchor="mm", fill=(255, 255, 255, int(255 * OPACIDADE_TEXTO)))
+    imagem = imagem.rotate(ANGULO, resample=Image.Resampling.BICUBIC)
+
+    rgba = np.asarray(imagem, dtype=np.float32) / 255.0
+    alfa = rgba[..., 3:]
+    return rgba[..., :3] * alfa * 255.0, alfa
+
+
+def aplicar(img: Image.Image, texto: str) -> Image.Image:
+    """Cópia RGB de `img` com a marca em ladrilhos (dois no lado menor). `img` não é alterada."""
+    # Pelo lado menor, 3:2 e 2:3 fecham em ladrilhos inteiros; poucos lados distintos por tamanho da escada
+    lado = max(LADO_MINIMO, -(-min(img.size) // 2))
+    cor, alfa = ladrilho(texto, lado)
+    largura, altura = img.size
+    repeticoes = (-(-altura // lado), -(-largura // lado), 1)
+    # Grade centralizada: o que sobra dos ladrilhos é cortado igualmente nas duas bordas
+    y0, x0 = (repeticoes[0] * lado - altura) // 2, (repeticoes[1] * lado - largura) // 2
+    recorte = (slice(y0, y0 + altura), slice(x0, x0 + largura))
+    pixels = np.asarray(img, dtype=np.float32)  # Cópia: asarray de uint8 para float32 não compartilha memória
+    pixels *= 1.0 - np.tile(alfa, repeticoes)[recorte]
+    pixels += np.tile(cor, repeticoes)[recorte]
+    return Image.fromarray(np.clip(pixels + 0.5, 0, 255).astype(np.uint8))
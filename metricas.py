@@ -0,0 +1,191 @@
+"""Métricas de vendas da plataforma.
+
+Os totais do painel do dono saem do rollup `vendas_diarias` (uma linha por dia
+e fotógrafo), atualizado na mesma transação em que o webhook marca o pedido
+como pago. Assim o custo do painel não cresce com o histórico de pedidos: só
+o dia do último reset de métricas é somado direto em `pedidos`, pelo índice
+(status_pagamento, data_pedido).
+
+O painel de cada fotógrafo (/admin) soma os pedidos dele pelo índice
+(fotografo_id, status_pagamento) e detalha as vendas por álbum e por foto a
+partir de `itens_pedido`. O resultado fica em cache por fotógrafo, invalidado
+quando um pedido dele é pago; o TTL cobre os outros workers, que não veem a
+invalidação.
+
+Reconstrução do rollup (ex.: depois de ajuste manual no banco):
+    python metricas.py --reconstruir
+"""
+import time
+import argparse
+import threading
+from datetime import datetime, timedelta
+from typing import NamedTuple, Optional
+
+from sqlalchemy import func, case
+from sqlalchemy.exc import IntegrityError
+
+from models import Album, Foto, ItemPedido, Pedido, VendaDiaria, SessionLocal
+
+CACHE_FOTOGRAFO_TTL_SEGUNDOS = 300
+MAIS_VENDIDAS_POR_FOTOGRAFO = 12
+
+_cache_fotografo = {}  # fotografo_id -> (expira_em, ResumoFotografo)
+_trava_cache = threading.Lock()
+
+
+class Totais(NamedTuple):
+    qtd_pedidos: int
+    volume: float
+    receita_plataforma: float
+
+
+def registrar_pagamento(db, pedido: Pedido):
+    """Soma o pedido recém-pago no rollup do dia. Não faz commit — vai junto com a mudança de status."""
+    dia = (pedido.data_pedido or datetime.utcnow()).date()
+    incremento = {
+        VendaDiaria.qtd_pedidos: VendaDiaria.qtd_pedidos + 1,
+        VendaDiaria.volume: VendaDiaria.volume + (pedido.valor_total or 0.0),
+        VendaDiaria.receita_plataforma: VendaDiaria.receita_plataforma + (pedido.taxa_plataforma or 0.0),
+    }
+    filtro = (VendaDiaria.dia == dia, VendaDiaria.fotografo_id == pedido.fotografo_id)
+
+    if db.query(VendaDiaria).filter(*filtro).update(incremento, synchronize_session=False):
+        return
+    try:
+        # Primeira venda do dia para o fotógrafo; o savepoint isola a corrida com outro webhook
+        with db.begin_nested():
+            db.add(VendaDiaria(
+                dia=dia,
+                fotografo_id=pedido.fotografo_id,
+                qtd_pedidos=1,
+                volume=pedido.valor_total or 0.0,
+                receita_plataforma=pedido.taxa_plataforma or 0.0,
+            ))
+    except IntegrityError:
+        db.query(VendaDiaria).filter(*filtro).update(incremento, synchronize_session=False)
+
+
+def totais_plataforma(db, desde: Optional[datetime] = None) -> Totais:
+    """Pedidos pagos, volume e receita da plataforma a partir de `desde` (ou de sempre)."""
+    consulta_rollup = db.query(
+        func.coalesce(func.sum(VendaDiaria.qtd_pedidos), 0),
+        func.coalesce(func.sum(VendaDiaria.volume), 0.0),
+        func.coalesce(func.sum(VendaDiaria.receita_plataforma), 0.0),
+    )
+    if desde is None:
+        return Totais(*consulta_rollup.one())
+
+    # Dias inteiros depois do reset vêm do rollup; o dia do reset é somado direto em pedidos
+    inicio_dia_seguinte = datetime.combine(desde.date() + timedelta(days=1), datetime.min.time())
+    qtd, volume, receita = consulta_rollup.filter(VendaDiaria.dia >= inicio_dia_seguinte.date()).one()
+    qtd_parcial, volume_parcial, receita_parcial = db.query(
+        func.count(Pedido.id),
+        func.coalesce(func.sum(Pedido.valor_total), 0.0),
+        func.coalesce(func.sum(Pedido.taxa_plataforma), 0.0),
+    ).filter(
+        Pedido.status_pagamento == "Pago",
+        Pedido.data_pedido >= desde,
+        Pedido.data_pedido < inicio_dia_seguinte,
+    ).one()
+    return Totais(qtd + qtd_parcial, volume + volume_parcial, receita + receita_parcial)
+
+
+class ResumoFotografo(NamedTuple):
+    totais: Totais
+    por_album: list   # [{album_id, titulo, hash_url, unidades, unidades_alta, unidades_baixa, receita}, ...]
+    mais_vendidas: list  # [{foto_id, caminho_baixa_res, album_titulo, unidades, unidades_alta, unidades_baixa, receita}, ...]
+
+
+def _colunas_itens() -> list:
+    return [
+        func.count(ItemPedido.id).label("unidades"),
+        func.coalesce(func.sum(case((ItemPedido.qualidade == "alta", 1), else_=0)), 0).label("unidades_alta"),
+        func.coalesce(func.sum(case((ItemPedido.qualidade == "alta", 0), else_=1)), 0).label("unidades_baixa"),
+        func.coalesce(func.sum(ItemPedido.preco_cobrado), 0.0).label("receita"),
+    ]
+
+
+def _calcular_resumo(db, fotografo_id: int) -> ResumoFotografo:
+    totais = Totais(*db.query(
+        func.count(Pedido.id),
+        func.coalesce(func.sum(Pedido.valor_total), 0.0),
+        func.coalesce(func.sum(Pedido.taxa_plataforma), 0.0),
+    ).filter(Pedido.fotografo_id == fotografo_id, Pedido.status_pagamento == "Pago").one())
+
+    itens_pagos = (
+        db.query(ItemPedido)
+        .join(Pedido, ItemPedido.pedido_id == Pedido.id)
+        .join(Foto, ItemPedido.foto_id == Foto.id)
+        .join(Album, Foto.album_id == Album.id)
+        .filter(Pedido.fotografo_id == fotografo_id, Pedido.status_pagamento == "Pago")
+    )
+    por_album = [
+        linha._asdict() for linha in itens_pagos.with_entities(
+            Album.id.label("album_id"), Album.titulo, Album.hash_url, *_colunas_itens(),
+        ).group_by(Album.id, Album.titulo, Album.hash_url).order_by(func.sum(ItemPedido.preco_cobrado).desc()).all()
+    ]
+    mais_vendidas = [
+        linha._asdict() for linha in itens_pagos.with_entities(
+            Foto.id.label("foto_id"), Foto.caminho_baixa_res, Album.titulo.label("album_titulo"), *_colunas_itens(),
+        ).group_by(Foto.id, Foto.caminho_baixa_res, Album.titulo)
+        .order_by(func.count(ItemPedido.id).desc(), Foto.id)
+        .limit(MAIS_VENDIDAS_POR_FOTOGRAFO).all()
+    ]
+    return ResumoFotografo(totais, por_album, mais_vendidas)
+
+
+def resumo_fotografo(db, fotografo_id: int) -> ResumoFotografo:
+    """Totais e detalhamento das vendas pagas do fotógrafo, do cache quando possível."""
+    agora = time.monotonic()
+    with _trava_cache:
+        em_cache = _cache_fotografo.get(fotografo_id)
+    if em_cache and em_cache[0] > agora:
+        return em_cache[1]
+    resumo = _calcular_resumo(db, fotografo_id)
+    with _trava_cache:
+        _cache_fotografo[fotografo_id] = (agora + CACHE_FOTOGRAFO_TTL_SEGUNDOS, resumo)
+    return resumo
+
+
+def invalidar_fotografo(fotografo_id: int):
+    """Descarta o resumo em cache do fotógrafo (chame depois do commit do pagamento)."""
+    with _trava_cache:
+        _cache_fotografo.pop(fotografo_id, None)
+
+
+def reconstruir_rollup(db) -> int:
+    """Recalcula `vendas_diarias` inteiro a partir dos pedidos pagos. Retorna quantas linhas gravou."""
+    db.query(VendaDiaria).delete(synchronize_session=False)
+    linhas = db.query(
+        func.date(Pedido.data_pedido),
+        Pedido.fotografo_id,
+        func.count(Pedido.id),
+        func.coalesce(func.sum(Pedido.valor_total), 0.0),
+        func.coalesce(func.sum(Pedido.taxa_plataforma), 0.0),
+    ).filter(
+        Pedido.status_pagamento == "Pago",
+        Pedido.data_pedido.isnot(None),
+        Pedido.fotografo_id.isnot(None),
+    ).group_by(func.date(Pedido.data_pedido), Pedido.fotografo_id).all()
+    for dia, fotografo_id, qtd, volume, receita in linhas:
+        if isinstance(dia, str):  # SQLite devolve date() como texto
+            dia = datetime.strptime(dia, "%Y-%m-%d").date()
+        db.add(VendaDiaria(dia=dia, fotografo_id=fotografo_id, qtd_pedidos=qtd, volume=volume, receita_plataforma=receita))
+    db.commit()
+    return len(linhas)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manutenção do rollup de vendas (vendas_diarias).")
+    parser.add_argument("--reconstruir", action="store_true", help="apaga e recalcula o rollup a partir dos pedidos pagos")
+    args = parser.parse_args()
+    if not args.reconstruir:
+        parser.print_help()
+        raise SystemExit(1)
+
+    db = SessionLocal()
+    try:
+        total = reconstruir_rollup(db)
+        print(f"✅ {total} linhas de vendas_diarias recalculadas.")
+    finally:
+        db.close()
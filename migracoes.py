@@ -0,0 +1,274 @@
+"""Migrações versionadas do schema.
+
+Rodam fora do processo web, uma vez por deploy:
+    python migracoes.py            # aplica as migrações pendentes
+    python migracoes.py --status   # mostra a versão do banco e o que falta
+
+Cada migração roda na sua própria transação e grava a versão em
+`schema_versao`. Todas são idempotentes (criam só o que falta), então um banco
+anterior ao versionamento entra direto pela versão 1. O startup da aplicação
+apenas confere se o banco está na versão que o código espera.
+"""
+import argparse
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+
+import qr_pix
+from models import Base, engine
+
+_TABELA_VERSAO = "schema_versao"
+
+
+def _colunas(conn, tabela: str) -> set:
+    return {c["name"] for c in inspect(conn).get_columns(tabela)}
+
+
+def _adicionar_coluna(conn, tabela: str, coluna: str, ddl: str):
+    if coluna not in _colunas(conn, tabela):
+        conn.execute(text(f"ALTER TABLE {tabela} ADD COLUMN {coluna} {ddl}"))
+
+
+def _criar_indice(conn, nome: str, definicao: str):
+    conn.execute(text(f"CREATE INDEX IF NOT EXISTS {nome} ON {definicao}"))
+
+
+# ==========================================
+# MIGRAÇÕES (nunca edite uma já publicada — crie a próxima)
+# ==========================================
+
+def _m001_schema_base(conn):
+    """Tabelas do modelo e colunas adicionadas antes do versionamento."""
+    Base.metadata.create_all(bind=conn)
+    _adicionar_coluna(conn, "pedidos", "pix_expiracao", "TIMESTAMP")
+    _adicionar_coluna(conn, "albuns", "categoria", "VARCHAR")
+    _adicionar_coluna(conn, "albuns", "cidade", "VARCHAR")
+    _adicionar_coluna(conn, "fotos", "rostos_indexados", "BOOLEAN DEFAULT FALSE")
+    _adicionar_coluna(conn, "fotos", "status_processamento", "VARCHAR DEFAULT 'Pronta'")
+    _adicionar_coluna(conn, "fotos", "derivados", "TEXT")
+    _adicionar_coluna(conn, "albuns", "capa_foto_id", "INTEGER")
+    _adicionar_coluna(conn, "albuns", "qtd_fotos", "INTEGER")
+    # Preenche capa/contagem dos álbuns antigos
+    conn.execute(text("""
+        UPDATE albuns SET
+            qtd_fotos = (SELECT COUNT(*) FROM fotos WHERE fotos.album_id = albuns.id AND fotos.status_processamento = 'Pronta'),
+            capa_foto_id = (SELECT MIN(fotos.id) FROM fotos WHERE fotos.album_id = albuns.id AND fotos.status_processamento = 'Pronta')
+        WHERE qtd_fotos IS NULL
+    """))
+
+
+def _m002_feed_e_busca(conn):
+    """Keyset do feed da home, filtros de categoria/cidade e busca por título."""
+    _criar_indice(conn, "ix_albuns_feed", "albuns (data_evento DESC, id DESC)")
+    _criar_indice(conn, "ix_albuns_categoria_feed", "albuns (lower(categoria), data_evento DESC, id DESC)")
+    _criar_indice(conn, "ix_albuns_cidade_feed", "albuns (lower(cidade), data_evento DESC, id DESC)")
+
+    # Trigram (substring) no Postgres, FTS5 (prefixo por palavra) no SQLite
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        _criar_indice(conn, "ix_albuns_titulo_trgm", "albuns USING gin (lower(titulo) gin_trgm_ops)")
+    elif conn.dialect.name == "sqlite":
+        conn.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS albuns_fts USING fts5("
+            "titulo, content='albuns', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+        ))
+        conn.execute(text("""
+            CREATE TRIGGER IF NOT EXISTS albuns_fts_insert AFTER INSERT ON albuns BEGIN
+                INSERT INTO albuns_fts(rowid, titulo) VALUES (new.id, new.titulo);
+            END
+        """))
+        conn.execute(text("""
+            CREATE TRIGGER IF NOT EXISTS albuns_fts_delete AFTER DELETE ON albuns BEGIN
+                INSERT INTO albuns_fts(albuns_fts, rowid, titulo) VALUES ('delete', old.id, old.titulo);
+            END
+        """))
+        conn.execute(text("""
+            CREATE TRIGGER IF NOT EXISTS albuns_fts_update AFTER UPDATE OF titulo ON albuns BEGIN
+                INSERT INTO albuns_fts(albuns_fts, rowid, titulo) VALUES ('delete', old.id, old.titulo);
+                INSERT INTO albuns_fts(rowid, titulo) VALUES (new.id, new.titulo);
+            END
+        """))
+        conn.execute(text("INSERT INTO albuns_fts(albuns_fts) VALUES ('rebuild')"))
+
+
+def _m003_paineis(conn):
+    """Índices dos painéis do dono e do fotógrafo, e o rollup diário de vendas."""
+    _criar_indice(conn, "ix_pedidos_status_data", "pedidos (status_pagamento, data_pedido)")
+    _criar_indice(conn, "ix_pedidos_data", "pedidos (data_pedido)")
+    _criar_indice(conn, "ix_pedidos_fotografo_status", "pedidos (fotografo_id, status_pagamento)")
+    _criar_indice(conn, "ix_itens_pedido_pedido", "itens_pedido (pedido_id)")
+    conn.execute(text("DELETE FROM vendas_diarias"))
+    conn.execute(text("""
+        INSERT INTO vendas_diarias (dia, fotografo_id, qtd_pedidos, volume, receita_plataforma)
+        SELECT date(data_pedido), fotografo_id, count(*), coalesce(sum(valor_total), 0), coalesce(sum(taxa_plataforma), 0)
+        FROM pedidos
+        WHERE status_pagamento = 'Pago' AND data_pedido IS NOT NULL AND fotografo_id IS NOT NULL
+        GROUP BY date(data_pedido), fotografo_id
+    """))
+
+
+def _m004_galeria(conn):
+    """Galeria paginada: fotos prontas do álbum em ordem de id (cobre também as buscas por album_id)."""
+    _criar_indice(conn, "ix_fotos_galeria", "fotos (album_id, status_processamento, id)")
+
+
+def _m005_indices_caminho_quente(conn):
+    """Buscas pontuais do webhook, do download, do checkout e dos itens de pedido."""
+    _criar_indice(conn, "ix_pedidos_pix_txid", "pedidos (pix_txid)")
+    _criar_indice(conn, "ix_pedidos_token_download", "pedidos (token_download)")
+    _criar_indice(conn, "ix_clientes_email", "clientes (email)")
+    _criar_indice(conn, "ix_itens_pedido_foto_id", "itens_pedido (foto_id)")
+
+
+def _m006_caixa_webhook(conn):
+    """Caixa de entrada dos webhooks do Mercado Pago."""
+    Base.metadata.tables["notificacoes_webhook"].create(bind=conn, checkfirst=True)
+    _criar_indice(conn, "ix_notificacoes_webhook_fila", "notificacoes_webhook (status, proxima_tentativa_em)")
+
+
+
+def _m007_caixa_emails(conn):
+    """Caixa de saída dos e-mails transacionais."""
+    Base.metadata.tables["emails_saida"].create(bind=conn, checkfirst=True)
+    _criar_indice(conn, "ix_emails_saida_fila", "emails_saida (status, proxima_tentativa_em)")
+
+
+
+def _m008_expiracao_pix(conn):
+    """Varredura de PIX vencidos: índice (status, expiração) e prazo dos pedidos pendentes antigos."""
+    _criar_indice(conn, "ix_pedidos_status_expiracao", "pedidos (status_pagamento, pix_expiracao)")
+    # Pendentes de antes do campo pix_expiracao: o prazo era de 30 min a partir da criação
+    prazo = "data_pedido + INTERVAL '30 minutes'" if conn.dialect.name == "postgresql" else "datetime(data_pedido, '+30 minutes')"
+    conn.execute(text(
+        f"UPDATE pedidos SET pix_expiracao = {prazo} "
+        "WHERE status_pagamento = 'Pendente' AND pix_expiracao IS NULL AND data_pedido IS NOT NULL"
+    ))
+
+
+
+def _m009_qr_fora_do_pedido(conn):
+    """QR code do PIX sai da linha do pedido (gerado do copia e cola ou guardado em disco)."""
+    if "pix_qr_code_base64" not in _colunas(conn, "pedidos"):
+        return
+    # PIX ainda abertos continuam com QR na tela de pagamento
+    for txid, qr_code_base64 in conn.execute(text(
+        "SELECT pix_txid, pix_qr_code_base64 FROM pedidos "
+        "WHERE status_pagamento = 'Pendente' AND pix_txid IS NOT NULL AND pix_qr_code_base64 IS NOT NULL"
+    )):
+        qr_pix.guardar_imagem_mp(txid, qr_code_base64)
+    conn.execute(text("ALTER TABLE pedidos DROP COLUMN pix_qr_code_base64"))
+
+
+
+def _m010_preco_pacote(conn):
+    """Preço de pacote opcional por álbum."""
+    _adicionar_coluna(conn, "albuns", "preco_pacote", "FLOAT")
+
+
+def _m011_checkout_idempotente(conn):
+    """Chave de idempotência e assinatura do carrinho nos pedidos."""
+    _adicionar_coluna(conn, "pedidos", "chave_idempotencia", "VARCHAR")
+    _adicionar_coluna(conn, "pedidos", "assinatura_carrinho", "VARCHAR")
+    conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS ix_pedidos_chave_idempotencia ON pedidos (chave_idempotencia)"))
+    _criar_indice(conn, "ix_pedidos_cliente_carrinho", "pedidos (cliente_id, assinatura_carrinho, status_pagamento)")
+
+
+def _m012_marca_dagua(conn):
+    """Marca d'água por fotógrafo, queimada nos derivados (versão usada em cada foto)."""
+    _adicionar_coluna(conn, "fotografos", "marca_dagua", "VARCHAR")
+    _adicionar_coluna(conn, "fotografos", "marca_dagua_versao", "INTEGER DEFAULT 0")
+    _adicionar_coluna(conn, "fotos", "marca_dagua_versao", "INTEGER")
+
+
+def _m013_reserva_processamento(conn):
+    """Reserva da foto pelo worker que a processa (vários workers retomam a fila)."""
+    _adicionar_coluna(conn, "fotos", "reserva", "VARCHAR")
+    _adicionar_coluna(conn, "fotos", "reservada_em", "TIMESTAMP")
+
+
+def _m014_assinatura_requisicao(conn):
+    """Hash do carrinho + e-mail guardado com a Idempotency-Key do pedido."""
+    _adicionar_coluna(conn, "pedidos", "assinatura_requisicao", "VARCHAR")
+
+
+def _m015_falhas_remarcacao(conn):
+    """Contador de falhas da remarcação por foto (desiste depois de algumas)."""
+    _adicionar_coluna(conn, "fotos", "remarcacao_falhas", "INTEGER DEFAULT 0")
+
+
+MIGRACOES = [
+    (1, _m001_schema_base),
+    (2, _m002_feed_e_busca),
+    (3, _m003_paineis),
+    (4, _m004_galeria),
+    (5, _m005_indices_caminho_quente),
+    (6, _m006_caixa_webhook),
+    (7, _m007_caixa_emails),
+    (8, _m008_expiracao_pix),
+    (9, _m009_qr_fora_do_pedido),
+    (10, _m010_preco_pacote),
+    (11, _m011_checkout_idempotente),
+    (12, _m012_marca_dagua),
+    (13, _m013_reserva_processamento),
+    (14, _m014_assinatura_requisicao),
+    (15, _m015_falhas_remarcacao),
+]
+VERSAO_ATUAL = MIGRACOES[-1][0]
+
+
+# ==========================================
+# RUNNER
+# ==========================================
+
+def versao_do_banco(conn) -> int:
+    if not inspect(conn).has_table(_TABELA_VERSAO):
+        return 0
+    return conn.execute(text(f"SELECT COALESCE(MAX(versao), 0) FROM {_TABELA_VERSAO}")).scalar()
+
+
+def migrar() -> list:
+    """Aplica as migrações pendentes, cada uma na sua transação. Retorna as versões aplicadas."""
+    with engine.begin() as conn:
+        conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {_TABELA_VERSAO} ("
+            "versao INTEGER PRIMARY KEY, descricao VARCHAR, aplicada_em TIMESTAMP)"
+        ))
+    aplicadas = []
+    for versao, migracao in MIGRACOES:
+        with engine.begin() as conn:
+            if versao <= versao_do_banco(conn):
+                continue
+            print(f"→ v{versao}: {migracao.__doc__}")
+            migracao(conn)
+            conn.execute(
+                text(f"INSERT INTO {_TABELA_VERSAO} (versao, descricao, aplicada_em) VALUES (:v, :d, :t)"),
+                {"v": versao, "d": migracao.__name__, "t": datetime.utcnow()},
+            )
+        aplicadas.append(versao)
+    return aplicadas
+
+
+def verificar_schema():
+    """Checagem do startup: um SELECT na versão; falha se faltar migração."""
+    with engine.connect() as conn:
+        versao = versao_do_banco(conn)
+    if versao < VERSAO_ATUAL:
+        raise RuntimeError(
+            f"Banco na versão {versao} do schema, o código espera a {VERSAO_ATUAL}. "
+            "Rode 'python migracoes.py' antes de subir a aplicação."
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrações versionadas do schema.")
+    parser.add_argument("--status", action="store_true", help="só mostra a versão atual e as pendentes")
+    args = parser.parse_args()
+
+    if args.status:
+        with engine.connect() as conn:
+            versao = versao_do_banco(conn)
+        pendentes = [v for v, _ in MIGRACOES if v > versao]
+        print(f"Versão do banco: {versao} · código: {VERSAO_ATUAL} · pendentes: {pendentes or 'nenhuma'}")
+    else:
+        aplicadas = migrar()
+        print(f"✅ Schema na versão {VERSAO_ATUAL}" + (f" (aplicadas: {aplicadas})." if aplicadas else " (nada a fazer)."))
@@ -1,14 +1,46 @@
 import os
 import uuid
 from datetime import datetime
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, ForeignKey, Text, text
-from sqlalchemy.orm import declarative_base, relationship
+from sqlalchemy import create_engine, make_url, Column, Integer, String, Float, Date, DateTime, ForeignKey, Text, Boolean, LargeBinary, UniqueConstraint
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import declarative_base, relationship, sessionmaker
 from dotenv import load_dotenv
 
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+# Engine síncrono: migrações, workers de background e scripts de linha de comando
 engine = create_engine(DATABASE_URL)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Engine assíncrono: as rotas do FastAPI (asyncpg no Postgres, aiosqlite no desenvolvimento)
+DRIVERS_ASYNC = {"postgresql": "postgresql+asyncpg", "postgresql+psycopg2": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+def _url_async(url: str):
+    url = make_url(url)
+    return url.set(drivername=DRIVERS_ASYNC.get(url.drivername, url.drivername))
+
+# Conexões por processo web: DB_POOL_SIZE fixas + DB_MAX_OVERFLOW em pico.
+# Com N workers do uvicorn, o banco precisa aceitar N * (pool + overflow) conexões além dos workers de background
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "5"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "10"))
+
+ASYNC_DATABASE_URL = _url_async(os.getenv("ASYNC_DATABASE_URL") or DATABASE_URL)
+if ASYNC_DATABASE_URL.get_backend_name() == "sqlite":
+    async_engine = create_async_engine(ASYNC_DATABASE_URL)
+else:
+    async_engine = create_async_engine(
+        ASYNC_DATABASE_URL,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_pre_ping=True,
+        pool_recycle=1800,
+    )
+# expire_on_commit=False: depois do commit os atributos continuam legíveis sem nova ida ao banco
+# (numa AsyncSession não existe lazy load implícito — relacionamentos vêm por eager load explícito)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
 # ==========================================
@@ -29,6 +61,10 @@ class Fotografo(Base):
     mp_user_id = Column(String, nullable=True) 
     mp_access_token = Column(String, nullable=True)
 
+    # Marca d'água queimada nas vitrines (vazio = "PROVA"); a versão sobe a cada troca e dispara a remarcação
+    marca_dagua = Column(String, nullable=True)
+    marca_dagua_versao = Column(Integer, default=0)
+
     # Ligações
     albuns = relationship("Album", back_populates="fotografo")
     pedidos = relationship("Pedido", back_populates="fotografo")
@@ -42,7 +78,7 @@ class Cliente(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     nome = Column(String)
-    email = Column(String)
+    email = Column(String, index=True)
     cpf = Column(String, nullable=True) # Essencial para o PIX/Cartão
     
     pedidos = relationship("Pedido", back_populates="cliente")
@@ -60,6 +96,7 @@ class Album(Base):
     data_evento = Column(DateTime, default=datetime.utcnow)
     categoria = Column(String, nullable=True)   # Ex: Esportes, Festas, Formaturas
     cidade = Column(String, nullable=True)       # Ex: Salvador/BA
+    preco_pacote = Column(Float, nullable=True)  # Teto para todas as fotos em alta do álbum num pedido
 
     # Agora o álbum tem um dono!
     fotografo_id = Column(Integer, ForeignKey("fotografos.id"))
@@ -67,6 +104,11 @@ class Album(Base):
     
     fotos = relationship("Foto", back_populates="album")
 
+    # Resumo denormalizado para os cards (atualizado quando uma foto fica pronta)
+    capa_foto_id = Column(Integer, nullable=True)  # Sem FK: albuns <-> fotos formaria um ciclo
+    qtd_fotos = Column(Integer, default=0)          # Só fotos com vitrine pronta
+    capa = relationship("Foto", primaryjoin="foreign(Album.capa_foto_id) == Foto.id", viewonly=True)
+
 class Foto(Base):
     __tablename__ = "fotos"
     
@@ -79,10 +121,41 @@ class Foto(Base):
     
     preco_baixa = Column(Float)
     preco_alta = Column(Float)
+
+    # Processamento da vitrine: 'Pendente' (na fila), 'Pronta' ou 'Falha'
+    status_processamento = Column(String, default="Pronta")
+    # Worker que está processando a foto (ver processamento._reservar); vence após RESERVA_EXPIRA_SEGUNDOS
+    reserva = Column(String, nullable=True)
+    reservada_em = Column(DateTime, nullable=True)
+    # Derivados responsivos em JSON: {"webp": [[240, "/static/..."], ...], "jpeg": [...]}
+    derivados = Column(Text, nullable=True)
+
+    # Versão da marca do fotógrafo queimada nos derivados (None = gerados antes da marca no servidor)
+    marca_dagua_versao = Column(Integer, nullable=True)
+    # Remarcações que falharam seguidas; em processamento.MAX_FALHAS_REMARCACAO a foto sai da remarcação
+    remarcacao_falhas = Column(Integer, default=0)
+
+    # Reconhecimento facial: True quando os rostos da vitrine já foram extraídos
+    rostos_indexados = Column(Boolean, default=False)
     
     album = relationship("Album", back_populates="fotos")
 
 
+class RostoFoto(Base):
+    """Um rosto detectado numa foto: encoding de 128 dimensões + caixa (top, right, bottom, left)."""
+    __tablename__ = "rostos_foto"
+
+    id = Column(Integer, primary_key=True, index=True)
+    foto_id = Column(Integer, ForeignKey("fotos.id"), index=True)
+    album_id = Column(Integer, ForeignKey("albuns.id"), index=True) # Denormalizado: o álbum inteiro sai numa query só
+
+    encoding = Column(LargeBinary, nullable=False) # 128 x float32
+    caixa_topo = Column(Integer)
+    caixa_direita = Column(Integer)
+    caixa_base = Column(Integer)
+    caixa_esquerda = Column(Integer)
+
+
 # ==========================================
 # 4. O FINANCEIRO E A LIBERAÇÃO
 # ==========================================
@@ -102,16 +175,21 @@ class Pedido(Base):
     data_pedido = Column(DateTime, default=datetime.utcnow)
     
     # Dados do Mercado Pago
-    pix_txid = Column(String, nullable=True)
+    pix_txid = Column(String, nullable=True, index=True)
     pix_copia_cola = Column(String, nullable=True)
-    pix_qr_code_base64 = Column(Text, nullable=True) # TIPO TEXT PARA NÃO QUEBRAR MAIS!
     
     # Guest Checkout: O token mágico de download sem senha
-    token_download = Column(String, default=lambda: str(uuid.uuid4()))
+    token_download = Column(String, default=lambda: str(uuid.uuid4()), index=True)
 
     # PIX: data/hora em que o código expira (30 min após criação)
     pix_expiracao = Column(DateTime, nullable=True)
 
+    # Checkout idempotente: chave enviada pelo cliente e hash do carrinho (foto:qualidade ordenados)
+    chave_idempotencia = Column(String, nullable=True, unique=True, index=True)
+    assinatura_carrinho = Column(String, nullable=True)
+    # Hash do carrinho + e-mail da requisição que usou a chave: a chave reenviada com outro conteúdo é recusada
+    assinatura_requisicao = Column(String, nullable=True)
+
     cliente = relationship("Cliente", back_populates="pedidos")
     fotografo = relationship("Fotografo", back_populates="pedidos")
     itens = relationship("ItemPedido", back_populates="pedido")
@@ -133,25 +211,60 @@ class ItemPedido(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     pedido_id = Column(Integer, ForeignKey("pedidos.id"))
-    foto_id = Column(Integer, ForeignKey("fotos.id"))
+    foto_id = Column(Integer, ForeignKey("fotos.id"), index=True)
     qualidade = Column(String) 
     preco_cobrado = Column(Float)
     
     pedido = relationship("Pedido", back_populates="itens")
     foto = relationship("Foto")
 
-# Cria as tabelas no banco de dados
-Base.metadata.create_all(bind=engine)
 
-# Migração: adiciona colunas que podem não existir em bancos já criados
-with engine.connect() as conn:
-    conn.execute(
-        text("ALTER TABLE pedidos ADD COLUMN IF NOT EXISTS pix_expiracao TIMESTAMP")
-    )
-    conn.execute(
-        text("ALTER TABLE albuns ADD COLUMN IF NOT EXISTS categoria VARCHAR")
-    )
-    conn.execute(
-        text("ALTER TABLE albuns ADD COLUMN IF NOT EXISTS cidade VARCHAR")
-    )
-    conn.commit()
\ No newline at end of file
+class NotificacaoWebhook(Base):
+    """Caixa de entrada dos webhooks do Mercado Pago: gravada e respondida na hora, processada pelo worker."""
+    __tablename__ = "notificacoes_webhook"
+    __table_args__ = (UniqueConstraint("payment_id", "acao", name="uq_notificacoes_webhook_payment_acao"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    payment_id = Column(String, nullable=False)
+    acao = Column(String, nullable=False, default="")   # 'payment.created', 'payment.updated'...
+    payload = Column(Text)                              # JSON cru, para auditoria
+    status = Column(String, default="Pendente")         # 'Pendente', 'Processando', 'Processada', 'Erro'
+    tentativas = Column(Integer, default=0)
+    proxima_tentativa_em = Column(DateTime, default=datetime.utcnow)
+    reserva = Column(String, nullable=True)             # Worker que pegou a notificação
+    reservada_em = Column(DateTime, nullable=True)
+    ultimo_erro = Column(Text, nullable=True)
+    recebida_em = Column(DateTime, default=datetime.utcnow)
+    processada_em = Column(DateTime, nullable=True)
+
+
+class EmailSaida(Base):
+    """Caixa de saída de e-mails: gravada na mesma transação do evento, enviada pelo worker SMTP."""
+    __tablename__ = "emails_saida"
+
+    id = Column(Integer, primary_key=True, index=True)
+    pedido_id = Column(Integer, ForeignKey("pedidos.id", ondelete="SET NULL"), nullable=True)
+    destinatario = Column(String, nullable=False)
+    assunto = Column(String, nullable=False)
+    html = Column(Text, nullable=False)
+    status = Column(String, default="Pendente")         # 'Pendente', 'Enviando', 'Enviado', 'Erro'
+    tentativas = Column(Integer, default=0)
+    proxima_tentativa_em = Column(DateTime, default=datetime.utcnow)
+    reserva = Column(String, nullable=True)             # Lote do worker que está enviando
+    reservada_em = Column(DateTime, nullable=True)
+    ultimo_erro = Column(Text, nullable=True)
+    criado_em = Column(DateTime, default=datetime.utcnow)
+    enviado_em = Column(DateTime, nullable=True)
+
+
+class VendaDiaria(Base):
+    """Rollup de vendas pagas por dia (de `data_pedido`) e fotógrafo, mantido pelo webhook."""
+    __tablename__ = "vendas_diarias"
+    __table_args__ = (UniqueConstraint("dia", "fotografo_id", name="uq_vendas_diarias_dia_fotografo"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    dia = Column(Date, nullable=False, index=True)
+    fotografo_id = Column(Integer, ForeignKey("fotografos.id"), nullable=False)
+    qtd_pedidos = Column(Integer, default=0, nullable=False)
+    volume = Column(Float, default=0.0, nullable=False)             # Soma de valor_total
+    receita_plataforma = Column(Float, default=0.0, nullable=False) # Soma de taxa_plataforma
@@ -1,10 +1,172 @@
-import mercadopago
+"""Cliente assíncrono da API de pagamentos do Mercado Pago (PIX).
+
+Todas as chamadas saem de um único `httpx.AsyncClient` com pool de conexões
+keep-alive, sem bloquear o event loop. Cada access token de fotógrafo ganha um
+`ClienteMP` (headers prontos + flag de split), reaproveitado entre pedidos.
+
+Falhas transitórias (rede, timeout, 429, 5xx) são repetidas com backoff,
+dentro de um orçamento global de retentativas para não multiplicar a carga
+quando o Mercado Pago estiver degradado. A criação usa a mesma chave de
+idempotência em todas as tentativas, então repetir nunca gera cobrança dupla.
+
+Conta que recusou o `application_fee` (não é marketplace) fica marcada por
+SPLIT_INDISPONIVEL_TTL: os próximos PIX dela já vão direto sem split. Só conta
+como recusa do split o erro que cita a taxa/marketplace, ou uma recusa seguida
+de sucesso sem a taxa — dados do pagador inválidos ou token revogado não tiram
+a comissão da plataforma.
+"""
+import os
 import uuid
+import time
 import random
+import asyncio
+from collections import OrderedDict
 from datetime import datetime, timedelta
 
+import httpx
+
 PIX_EXPIRACAO_MINUTOS = 30
 
+MP_API_URL = "https://api.mercadopago.com"
+MP_TIMEOUT = httpx.Timeout(10.0, connect=3.0)
+MP_MAX_CONEXOES = int(os.getenv("MP_MAX_CONEXOES", "50"))
+MP_TENTATIVAS = 3
+MP_BACKOFF_SEGUNDOS = 0.3
+SPLIT_INDISPONIVEL_TTL = 6 * 3600
+MAX_CLIENTES_EM_CACHE = 1000
+
+_STATUS_TRANSITORIOS = {429, 500, 502, 503, 504}
+# Trechos do corpo de erro do MP que indicam recusa do split (e não do pagamento em si)
+_TERMOS_ERRO_SPLIT = ("application_fee", "marketplace")
+
+_http: "httpx.AsyncClient | None" = None
+_clientes: "OrderedDict[str, ClienteMP]" = OrderedDict()
+
+
+class _OrcamentoRetentativas:
+    """Cada requisição deposita `proporcao` de ficha; cada retentativa gasta uma.
+
+    Com o Mercado Pago fora do ar, as retentativas param em ~proporcao das
+    requisições em vez de triplicar o tráfego.
+    """
+
+    def __init__(self, proporcao: float = 0.2, maximo: float = 10.0):
+        self.proporcao = proporcao
+        self.maximo = maximo
+        self.saldo = maximo
+
+    def registrar_requisicao(self):
+        self.saldo = min(self.maximo, self.saldo + self.proporcao)
+
+    def pode_repetir(self) -> bool:
+        if self.saldo >= 1:
+            self.saldo -= 1
+            return True
+        return False
+
+
+_orcamento = _OrcamentoRetentativas()
+
+
+class ErroMP(Exception):
+    """Falha definitiva numa chamada ao Mercado Pago (já esgotadas as retentativas)."""
+
+    def __init__(self, mensagem: str, resposta: "dict | None" = None, http_status: "int | None" = None):
+        super().__init__(mensagem)
+        self.resposta = resposta or {}
+        self.http_status = http_status
+
+    @property
+    def recusado(self) -> bool:
+        """A API respondeu e recusou o pedido (4xx) — não adianta repetir igual."""
+        return self.http_status is not None and 400 <= self.http_status < 500 and self.http_status not in _STATUS_TRANSITORIOS
+
+
+def _get_http() -> httpx.AsyncClient:
+    global _http
+    if _http is None:
+        _http = httpx.AsyncClient(
+            base_url=MP_API_URL,
+            timeout=MP_TIMEOUT,
+            limits=httpx.Limits(max_connections=MP_MAX_CONEXOES, max_keepalive_connections=MP_MAX_CONEXOES),
+        )
+    return _http
+
+
+async def fechar():
+    """Fecha o pool de conexões (shutdown da aplicação)."""
+    global _http
+    if _http is not None:
+        await _http.aclose()
+        _http = None
+
+
+class ClienteMP:
+    """Chamadas à API com o access token de um fotógrafo."""
+
+    def __init__(self, access_token: str):
+        self._headers = {"Authorization": f"Bearer {access_token}"}
+        self._split_indisponivel_ate = 0.0
+
+    @property
+    def split_disponivel(self) -> bool:
+        return time.monotonic() >= self._split_indisponivel_ate
+
+    def marcar_split_indisponivel(self):
+        self._split_indisponivel_ate = time.monotonic() + SPLIT_INDISPONIVEL_TTL
+
+    async def _requisitar(self, metodo: str, caminho: str, json: "dict | None" = None, headers: "dict | None" = None) -> dict:
+        _orcamento.registrar_requisicao()
+        tentativa = 0
+        while True:
+            tentativa += 1
+            try:
+                resp = await _get_http().request(metodo, caminho, json=json, headers={**self._headers, **(headers or {})})
+                if resp.status_code not in _STATUS_TRANSITORIOS:
+                    try:
+                        corpo = resp.json() if resp.content else {}
+                    except ValueError:  # Página de erro em HTML (proxy, WAF...) no lugar do JSON
+                        raise ErroMP(f"Resposta inválida do Mercado Pago (HTTP {resp.status_code})",
+                                     http_status=None if resp.is_success else resp.status_code)
+                    if resp.is_success:
+                        return corpo
+                    raise ErroMP(corpo.get("message", f"HTTP {resp.status_code}"), corpo, resp.status_code)
+                erro = ErroMP(f"HTTP {resp.status_code}", http_status=resp.status_code)
+            except httpx.TransportError as exc:  # Timeout, conexão recusada/resetada...
+                erro = ErroMP(f"Erro de comunicação com Mercado Pago: {exc!r}")
+            if tentativa >= MP_TENTATIVAS or not _orcamento.pode_repetir():
+                raise erro
+            await asyncio.sleep(MP_BACKOFF_SEGUNDOS * (2 ** (tentativa - 1)) * (0.5 + random.random()))
+
+    async def criar_pagamento(self, dados: dict) -> dict:
+        return await self._requisitar("POST", "/v1/payments", json=dados, headers={"X-Idempotency-Key": str(uuid.uuid4())})
+
+    async def consultar_pagamento(self, payment_id) -> dict:
+        return await self._requisitar("GET", f"/v1/payments/{payment_id}")
+
+
+def cliente_mp(access_token: str) -> ClienteMP:
+    """ClienteMP do token (criado na primeira vez, depois reaproveitado)."""
+    cliente = _clientes.get(access_token)
+    if cliente is None:
+        cliente = _clientes[access_token] = ClienteMP(access_token)
+        if len(_clientes) > MAX_CLIENTES_EM_CACHE:
+            _clientes.popitem(last=False)
+    else:
+        _clientes.move_to_end(access_token)
+    return cliente
+
+
+def _erro_de_split(resposta: dict) -> bool:
+    """O erro do MP cita a taxa da plataforma ou o marketplace (mensagem ou causas)."""
+    partes = [resposta.get("message"), resposta.get("error")]
+    for causa in resposta.get("cause") or []:
+        if isinstance(causa, dict):
+            partes += [causa.get("code"), causa.get("description")]
+    texto = " ".join(str(p) for p in partes if p).lower()
+    return any(termo in texto for termo in _TERMOS_ERRO_SPLIT)
+
+
 def gerar_cpf_valido():
     """Gera um CPF matematicamente válido para bypass no checkout."""
     cpf = [random.randint(0, 9) for _ in range(9)]
@@ -39,55 +201,69 @@ def _criar_payment_data(valor_pedido, email_cliente, nome_cliente, id_pedido_int
         }
     }, expiracao
 
-def gerar_cobranca_pix(valor_pedido, email_cliente, nome_cliente, id_pedido_interno, token_fotografo, taxa_plataforma):
+async def gerar_cobranca_pix(valor_pedido, email_cliente, nome_cliente, id_pedido_interno, token_fotografo, taxa_plataforma):
     """Gera cobrança PIX. Tenta com split de comissão; se falhar, tenta sem.
-    
+
     Retorna dict com 'sucesso', 'split_aplicado' (bool) e dados do PIX.
     """
-
-    sdk = mercadopago.SDK(token_fotografo)
-
+    cliente = cliente_mp(token_fotografo)
     payment_data, expiracao = _criar_payment_data(valor_pedido, email_cliente, nome_cliente, id_pedido_interno)
 
-    # Tenta primeiro com application_fee (split marketplace)
-    if taxa_plataforma > 0:
-        payment_data["application_fee"] = float(taxa_plataforma)
-
-    def _tentar(dados):
-        opts = mercadopago.config.RequestOptions()
-        opts.custom_headers = {'x-idempotency-key': str(uuid.uuid4())}
-        result = sdk.payment().create(dados, opts)
-        resp = result.get("response", {})
-        if resp.get("status") == "pending":
+    async def _tentar(dados):
+        try:
+            resp = await cliente.criar_pagamento(dados)
+        except ErroMP as exc:
+            return {"sucesso": False, "resp": exc.resposta or {"message": str(exc)}, "recusado": exc.recusado}
+        dados_pix = (resp.get("point_of_interaction") or {}).get("transaction_data") or {}
+        if resp.get("status") == "pending" and resp.get("id") and dados_pix.get("qr_code"):
             return {
                 "sucesso": True,
                 "txid": resp["id"],
-                "copia_cola": resp["point_of_interaction"]["transaction_data"]["qr_code"],
-                "qr_code_img": resp["point_of_interaction"]["transaction_data"]["qr_code_base64"],
+                "copia_cola": dados_pix["qr_code"],
+                "qr_code_img": dados_pix.get("qr_code_base64"),
                 "expiracao": expiracao,
             }
+        if resp.get("status") == "pending":
+            resp = {**resp, "message": "Mercado Pago não devolveu o código PIX."}
         return {"sucesso": False, "resp": resp}
 
-    try:
-        resultado = _tentar(payment_data)
+    # Tenta primeiro com application_fee (split marketplace), a menos que a conta já tenha recusado
+    recusa_com_taxa = None
+    if taxa_plataforma > 0 and cliente.split_disponivel:
+        resultado = await _tentar({**payment_data, "application_fee": float(taxa_plataforma)})
         if resultado["sucesso"]:
-            resultado["split_aplicado"] = "application_fee" in payment_data
+            resultado["split_aplicado"] = True
             return resultado
+        if not resultado.get("recusado"):
+            # Rede/MP fora: repetir sem split só arriscaria uma segunda cobrança
+            print("--- ERRO MERCADO PAGO ---", resultado["resp"])
+            return {"sucesso": False, "erro": resultado["resp"].get("message", "Falha na API do Mercado Pago.")}
+        recusa_com_taxa = resultado["resp"]
+        if _erro_de_split(recusa_com_taxa):
+            cliente.marcar_split_indisponivel()  # Conta não-marketplace: próximos PIX já vão sem split
+            print(f"⚠️  Split recusado pelo MP ({recusa_com_taxa.get('message', '')}); "
+                  f"PIX sem comissão para esta conta nas próximas {SPLIT_INDISPONIVEL_TTL // 3600}h.")
+            recusa_com_taxa = None
+        else:
+            print(f"⚠️  Falha com application_fee ({recusa_com_taxa.get('message', '')}). Tentando sem split...")
 
-        # Se falhou com application_fee, tenta sem (conta não-marketplace)
-        if "application_fee" in payment_data:
-            print(f"⚠️  Falha com application_fee ({resultado['resp'].get('message','')}). Tentando sem split...")
-            payment_data_sem_split = {k: v for k, v in payment_data.items() if k != "application_fee"}
-            resultado2 = _tentar(payment_data_sem_split)
-            if resultado2["sucesso"]:
-                resultado2["split_aplicado"] = False
-                return resultado2
-            print("--- ERRO MERCADO PAGO (sem split) ---", resultado2["resp"])
-            return {"sucesso": False, "erro": resultado2["resp"].get("message", "Falha na API do Mercado Pago.")}
-
-        print("--- ERRO MERCADO PAGO ---", resultado["resp"])
-        return {"sucesso": False, "erro": resultado["resp"].get("message", "Falha na API do Mercado Pago.")}
-
-    except Exception as e:
-        print(f"Erro de comunicação com Mercado Pago: {e}")
-        return {"sucesso": False, "erro": str(e)}
\ No newline at end of file
+    resultado = await _tentar(payment_data)
+    if resultado["sucesso"]:
+        if recusa_com_taxa is not None:
+            # Recusado com a taxa, aceito sem ela: a conta não aceita split
+            cliente.marcar_split_indisponivel()
+            print(f"⚠️  PIX só saiu sem application_fee (recusa: {recusa_com_taxa}); "
+                  f"PIX sem comissão para esta conta nas próximas {SPLIT_INDISPONIVEL_TTL // 3600}h.")
+        resultado["split_aplicado"] = False
+        return resultado
+    print("--- ERRO MERCADO PAGO ---", resultado["resp"])
+    return {"sucesso": False, "erro": resultado["resp"].get("message", "Falha na API do Mercado Pago.")}
+
+
+async def consultar_pagamento(token_fotografo: str, payment_id) -> "dict | None":
+    """Dados do pagamento no Mercado Pago, ou None se a consulta falhar."""
+    try:
+        return await cliente_mp(token_fotografo).consultar_pagamento(payment_id)
+    except ErroMP as exc:
+        print(f"⚠️  Falha ao consultar o pagamento {payment_id}: {exc}")
+        return None
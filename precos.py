@@ -0,0 +1,132 @@
+"""Preço do carrinho de fotos.
+
+Um carrinho inteiro (clientes de eventos esportivos levam 100–300 fotos) é
+cotado com um único SELECT ... IN que já traz o álbum e o fotógrafo de cada
+foto. No mesmo passo entram os descontos:
+
+- pacote do álbum (`Album.preco_pacote`): as fotos em alta de um álbum saem,
+  juntas, por no máximo esse valor — o "todas as fotos em que eu apareço";
+- faixas de volume (DESCONTOS_VOLUME="10:10,25:20" → 10% a partir de 10
+  fotos, 20% a partir de 25), sobre as fotos que não entraram num pacote.
+
+O desconto é rateado entre os itens, então a soma de `preco_cobrado` bate com
+o total do pedido e as métricas por foto/álbum continuam corretas.
+"""
+import os
+from typing import List, NamedTuple, Tuple
+
+from models import Album, Foto, Fotografo
+
+MAX_ITENS_POR_PEDIDO = 500
+
+
+def _ler_faixas(valor: str) -> "tuple[tuple[int, float], ...]":
+    faixas = []
+    for faixa in filter(None, (f.strip() for f in valor.split(","))):
+        quantidade, percentual = faixa.split(":")
+        faixas.append((int(quantidade), float(percentual) / 100))
+    return tuple(sorted(faixas, reverse=True))
+
+
+# (quantidade mínima, desconto) em ordem decrescente de quantidade; vazio = sem desconto por volume
+FAIXAS_VOLUME = _ler_faixas(os.getenv("DESCONTOS_VOLUME", ""))
+
+
+class CarrinhoInvalido(ValueError):
+    """Carrinho que não pode virar pedido; a mensagem é exibida ao cliente."""
+
+
+class ItemCotado(NamedTuple):
+    foto_id: int
+    qualidade: str
+    preco_cheio: float
+    preco_cobrado: float
+
+
+class Cotacao(NamedTuple):
+    fotografo: Fotografo
+    itens: List[ItemCotado]
+    subtotal: float   # Soma dos preços de tabela
+    total: float      # Com pacote e desconto por volume
+
+    @property
+    def desconto(self) -> float:
+        return round(self.subtotal - self.total, 2)
+
+
+def desconto_volume(quantidade: int) -> float:
+    return next((percentual for minimo, percentual in FAIXAS_VOLUME if quantidade >= minimo), 0.0)
+
+
+def _ratear(precos: List[float], total: float) -> List[float]:
+    """Distribui `total` entre os itens na proporção dos preços, em centavos, sem sobra."""
+    bruto = sum(precos)
+    if bruto <= 0:
+        return list(precos)
+    rateados = [round(p * total / bruto, 2) for p in precos]
+    diferenca = round(total - sum(rateados), 2)
+    if diferenca:
+        maior = max(range(len(rateados)), key=rateados.__getitem__)
+        rateados[maior] = round(rateados[maior] + diferenca, 2)
+    return rateados
+
+
+def cotar(db, itens: List[Tuple[int, str]]) -> Cotacao:
+    """Preço de cada item [(foto_id, qualidade), ...] e do carrinho. Levanta CarrinhoInvalido."""
+    if not itens:
+        raise CarrinhoInvalido("Nenhum item no pedido")
+    # Uma linha por foto: se a mesma foto vier duas vezes, vale a última qualidade escolhida
+    qualidades = {int(foto_id): ("alta" if qualidade == "alta" else "baixa") for foto_id, qualidade in itens}
+    if len(qualidades) > MAX_ITENS_POR_PEDIDO:
+        raise CarrinhoInvalido(f"Selecione no máximo {MAX_ITENS_POR_PEDIDO} fotos por pedido.")
+
+    linhas = (
+        db.query(Foto.id.label("foto_id"), Foto.preco_baixa, Foto.preco_alta,
+                 Album.id.label("album_id"), Album.preco_pacote, Fotografo)
+        .join(Album, Foto.album_id == Album.id)
+        .join(Fotografo, Album.fotografo_id == Fotografo.id)
+        .filter(Foto.id.in_(list(qualidades)))
+        .all()
+    )
+    encontradas = {linha.foto_id: linha for linha in linhas}
+    faltando = next((foto_id for foto_id in qualidades if foto_id not in encontradas), None)
+    if faltando is not None:
+        raise CarrinhoInvalido(f"Foto {faltando} não encontrada")
+    if len({linha.Fotografo.id for linha in linhas}) > 1:
+        raise CarrinhoInvalido("Todas as fotos do pedido precisam ser do mesmo fotógrafo.")
+
+    ordem = list(qualidades)
+    cheio = {}
+    for foto_id in ordem:
+        linha = encontradas[foto_id]
+        cheio[foto_id] = (linha.preco_alta if qualidades[foto_id] == "alta" else linha.preco_baixa) or 0.0
+    cobrado = dict(cheio)
+
+    # Pacote por álbum: as fotos em alta do álbum custam no máximo preco_pacote
+    em_pacote = set()
+    altas_por_album = {}
+    for foto_id in ordem:
+        if qualidades[foto_id] == "alta" and encontradas[foto_id].preco_pacote:
+            altas_por_album.setdefault(encontradas[foto_id].album_id, []).append(foto_id)
+    for fotos_album in altas_por_album.values():
+        preco_pacote = encontradas[fotos_album[0]].preco_pacote
+        if sum(cheio[f] for f in fotos_album) > preco_pacote:
+            for foto_id, preco in zip(fotos_album, _ratear([cheio[f] for f in fotos_album], preco_pacote)):
+                cobrado[foto_id] = preco
+            em_pacote.update(fotos_album)
+
+    # Desconto por volume sobre o que ficou fora dos pacotes
+    avulsas = [f for f in ordem if f not in em_pacote]
+    percentual = desconto_volume(len(avulsas))
+    if percentual:
+        alvo = round(sum(cheio[f] for f in avulsas) * (1 - percentual), 2)
+        for foto_id, preco in zip(avulsas, _ratear([cheio[f] for f in avulsas], alvo)):
+            cobrado[foto_id] = preco
+
+    itens_cotados = [ItemCotado(f, qualidades[f], cheio[f], cobrado[f]) for f in ordem]
+    return Cotacao(
+        fotografo=linhas[0].Fotografo,
+        itens=itens_cotados,
+        subtotal=round(sum(cheio.values()), 2),
+        total=round(sum(cobrado.values()), 2),
+    )
@@ -0,0 +1,519 @@
+"""Pipeline de ingestão das fotos.
+
+O upload só grava os originais e cria as fotos com status 'Pendente'. A
+geração da vitrine e dos derivados responsivos roda num pool de processos do
+tamanho do número de núcleos, fora do event loop; a extração dos rostos vai
+em seguida para o pool facial (ver facial.py), o único que carrega o dlib. O
+resultado volta para o banco como 'Pronta' ou 'Falha'; fotos que ficaram
+'Pendente' quando o servidor caiu são reenfileiradas no startup. Todos os
+workers do uvicorn retomam a fila; cada foto é reservada (UPDATE condicional,
+como na caixa de e-mails) antes de ir ao pool, então só um a processa.
+
+Os originais (JPEGs de câmera de 24–45 MP) não são decodificados em resolução
+cheia: o `draft()` do JPEG decodifica direto em 1/2, 1/4 ou 1/8 (escala na
+DCT), o menor que ainda cobre o maior derivado. Desse único decode sai toda a
+escada, já com a orientação do EXIF aplicada e sem metadados (só o perfil de
+cor é mantido). bench_derivados.py compara com a decodificação completa.
+
+Os derivados públicos saem com a marca d'água do fotógrafo (marca_dagua.py);
+a versão web vendida é uma cópia limpa no diretório privado. Quando o
+fotógrafo troca a marca, `agendar_remarcacao` regera os derivados das fotos
+dele em lotes reservados (a mesma reserva da ingestão), no mesmo pool.
+"""
+import os
+import json
+import uuid
+import asyncio
+import shutil
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageOps, features
+from sqlalchemy import func, case, or_, select
+from starlette.concurrency import run_in_threadpool
+
+import facial
+import marca_dagua
+from models import Album, Foto, Fotografo, SessionLocal
+
+DIRETORIO_ALTA_RES = "./fotos_alta_res_seguras"
+DIRETORIO_BAIXA_RES = "./static/fotos_baixa_res"
+
+STATUS_PENDENTE = "Pendente"
+STATUS_PRONTA = "Pronta"
+STATUS_FALHA = "Falha"
+
+# Escada de derivados: larguras máximas (px) geradas para cada foto, em WebP
+# (e AVIF quando o Pillow suporta) com JPEG de fallback. A de 800px em JPEG é
+# a própria vitrine (caminho_baixa_res).
+TAMANHOS_DERIVADOS = tuple(sorted(int(t) for t in os.getenv("TAMANHOS_DERIVADOS", "240,480,800,1600").split(",")))
+LARGURA_VITRINE = 800
+FORMATOS_DERIVADOS = ("avif", "webp", "jpeg") if features.check("avif") else ("webp", "jpeg")
+_PARAMETROS_FORMATO = {
+    "jpeg": ("JPEG", "jpg", {"quality": 70, "optimize": True, "progressive": True}),
+    "webp": ("WEBP", "webp", {"quality": 68, "method": 4}),
+    "avif": ("AVIF", "avif", {"quality": 50, "speed": 8}),
+}
+
+# Tamanho do pool; padrão = número de núcleos da máquina
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "0")) or os.cpu_count() or 1
+# Cada worker do uvicorn retoma a fila: a foto é reservada antes de ir ao pool, e a
+# reserva de um processo que morreu vence depois disso (a varredura periódica a retoma)
+RESERVA_EXPIRA_SEGUNDOS = 600
+
+_pool: "ProcessPoolExecutor | None" = None
+_tarefas = set()  # Referências fortes para as tasks não serem coletadas no meio
+_na_fila = set()  # foto_ids já enfileirados neste processo
+_vagas: "asyncio.Semaphore | None" = None  # Fotos reservadas e ainda não concluídas neste processo
+_remarcando = set()  # fotografo_ids com remarcação em andamento
+_remarcar_de_novo = set()  # Marca trocada de novo enquanto a remarcação do fotógrafo rodava
+
+
+def caminho_alta(foto: Foto) -> str:
+    return os.path.join(DIRETORIO_ALTA_RES, foto.caminho_alta_res)
+
+
+def caminho_baixa(foto: Foto) -> str:
+    return foto.caminho_baixa_res.lstrip("/")
+
+
+def _caminho_web(origem: str) -> str:
+    base = os.path.splitext(origem)[0]
+    return (base[:-len("_original")] if base.endswith("_original") else base) + "_web.jpg"
+
+
+def caminho_web(foto: Foto) -> str:
+    """Cópia limpa (sem marca d'água) da vitrine, no diretório privado — a versão web vendida."""
+    return _caminho_web(caminho_alta(foto))
+
+
+def salvar_original(arquivo, destino: str):
+    """Copia o upload para o disco. Bloqueante — chame via run_in_threadpool."""
+    with open(destino, "wb") as buffer:
+        shutil.copyfileobj(arquivo, buffer)
+
+
+def carregar_derivados(foto: Foto) -> dict:
+    """{formato: [[largura, url], ...]} — vazio para fotos anteriores à escada de derivados."""
+    return json.loads(foto.derivados) if foto.derivados else {}
+
+
+def srcset(foto: Foto, formato: str = "jpeg") -> str:
+    """Valor do atributo srcset da foto no formato pedido ('' se não houver derivados)."""
+    return ", ".join(f"{url} {largura}w" for largura, url in carregar_derivados(foto).get(formato, []))
+
+
+def remover_arquivos(foto: Foto):
+    """Apaga do disco o original, a vitrine e todos os derivados da foto."""
+    caminhos = [caminho_alta(foto), caminho_baixa(foto), caminho_web(foto)]
+    for variantes in carregar_derivados(foto).values():
+        caminhos.extend(url.lstrip("/") for _, url in variantes)
+    for caminho in set(caminhos):
+        try:
+            if os.path.exists(caminho):
+                os.remove(caminho)
+        except OSError as e:
+            print(f"⚠️  Erro ao remover arquivo da foto {foto.id}: {e}")
+
+
+def remover_arquivos_das_fotos(fotos: "list[Foto]"):
+    """remover_arquivos em cada foto. Bloqueante — chame via run_in_threadpool."""
+    for foto in fotos:
+        remover_arquivos(foto)
+
+
+# ==========================================
+# EXECUTADO NOS PROCESSOS DO POOL
+# ==========================================
+
+def _salvar_variante(img: Image.Image, destino: str, formato: str, perfil_cor: "bytes | None" = None):
+    nome_pil, _, opcoes = _PARAMETROS_FORMATO[formato]
+    if perfil_cor:
+        opcoes = {**opcoes, "icc_profile": perfil_cor}
+    # Grava ao lado e troca: na remarcação o arquivo antigo pode estar sendo servido.
+    # Nome único: outro processo pode estar gerando o mesmo derivado
+    temporario = f"{destino}.{uuid.uuid4().hex}.tmp"
+    try:
+        img.save(temporario, nome_pil, **opcoes)
+        os.replace(temporario, destino)
+    except BaseException:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+        raise
+
+
+def abrir_reduzida(origem: str, lado_minimo: int) -> "tuple[Image.Image, int, bytes | None]":
+    """Decodifica o original uma vez, já reduzido e na orientação certa.
+
+    Retorna (imagem RGB sem metadados, maior lado do original, perfil ICC).
+    O maior lado da imagem devolvida é >= lado_minimo sempre que o original
+    também for.
+    """
+    with Image.open(origem) as original:
+        maior_lado = max(original.size)
+        # JPEG: escolhe a escala da DCT (1/2, 1/4, 1/8) sem descer abaixo de lado_minimo; outros formatos ignoram
+        original.draft("RGB", (lado_minimo, lado_minimo))
+        perfil_cor = original.info.get("icc_profile")
+        img = ImageOps.exif_transpose(original)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    img.info = {}  # EXIF (GPS, câmera, serial), XMP e comentários não vão para os derivados
+    return img, maior_lado, perfil_cor
+
+
+def processar_foto(origem: str, destino_vitrine: str, marca: str = marca_dagua.MARCA_DAGUA_PADRAO) -> dict:
+    """Gera a vitrine 800px e a escada de derivados com a marca d'água, a partir de um único decode.
+
+    A cópia limpa de 800px vai para o diretório privado. Retorna {formato: [[largura, url], ...]}.
+    """
+    img, maior_lado, perfil_cor = abrir_reduzida(origem, max(max(TAMANHOS_DERIVADOS), LARGURA_VITRINE))
+    prefixo = destino_vitrine[:-len("_vitrine.jpg")]
+
+    # Do maior para o menor, cada tamanho reduz o anterior (bem mais barato que partir do original)
+    derivados = {formato: [] for formato in FORMATOS_DERIVADOS}
+    atual = img
+    for tamanho in sorted(set(TAMANHOS_DERIVADOS) | {LARGURA_VITRINE}, reverse=True):
+        if tamanho > maior_lado and tamanho not in (LARGURA_VITRINE, min(TAMANHOS_DERIVADOS)):
+            continue  # Foto pequena: não gera tamanhos que seriam só cópias maiores
+        # A escada segue reduzindo a imagem limpa; a marca entra só na cópia que é gravada
+        atual = atual.copy()
+        atual.thumbnail((tamanho, tamanho))
+        marcada = marca_dagua.aplicar(atual, marca)
+        if tamanho == LARGURA_VITRINE:
+            _salvar_variante(atual, _caminho_web(origem), "jpeg", perfil_cor)
+            _salvar_variante(marcada, destino_vitrine, "jpeg", perfil_cor)
+        for formato in FORMATOS_DERIVADOS:
+            if tamanho == LARGURA_VITRINE and formato == "jpeg":
+                destino = destino_vitrine
+            elif tamanho in TAMANHOS_DERIVADOS:
+                destino = f"{prefixo}_{tamanho}.{_PARAMETROS_FORMATO[formato][1]}"
+                _salvar_variante(marcada, destino, formato, perfil_cor)
+            else:
+                continue
+            derivados[formato].append([atual.width, "/" + destino])
+    for variantes in derivados.values():
+        variantes.sort()
+    return derivados
+
+
+# ==========================================
+# ORQUESTRAÇÃO (processo web)
+# ==========================================
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=INGEST_WORKERS)
+    return _pool
+
+
+def _marca_da_foto(foto_id: int) -> "tuple[str, int]":
+    """(texto, versão) da marca d'água do fotógrafo dono da foto."""
+    db = SessionLocal()
+    try:
+        linha = db.execute(
+            select(Fotografo.marca_dagua, Fotografo.marca_dagua_versao)
+            .join(Album, Album.fotografo_id == Fotografo.id)
+            .join(Foto, Foto.album_id == Album.id)
+            .where(Foto.id == foto_id)
+        ).first()
+        texto, versao = linha if linha else (None, 0)
+        return marca_dagua.texto_da_marca(texto), versao or 0
+    finally:
+        db.close()
+
+
+def _reserva_livre(agora: datetime):
+    return or_(Foto.reservada_em.is_(None),
+               Foto.reservada_em < agora - timedelta(seconds=RESERVA_EXPIRA_SEGUNDOS))
+
+
+def _reservar(foto_id: int, reserva: str) -> bool:
+    """Reserva a foto pendente para este processo. False se outro worker já a pegou (ou ela não está mais pendente)."""
+    agora = datetime.utcnow()
+    db = SessionLocal()
+    try:
+        # UPDATE condicional: entre os workers que retomam a mesma foto, só um afeta a linha
+        reservadas = db.query(Foto).filter(
+            Foto.id == foto_id, Foto.status_processamento == STATUS_PENDENTE, _reserva_livre(agora)
+        ).update({Foto.reserva: reserva, Foto.reservada_em: agora}, synchronize_session=False)
+        db.commit()
+        return reservadas == 1
+    finally:
+        db.close()
+
+
+def _registrar_resultado(foto_id: int, derivados: "dict | None", rostos: "list | None", erro: "Exception | None",
+                         versao_marca: int = 0, reserva: "str | None" = None):
+    """Grava a foto como 'Pronta' (ou 'Falha'). rostos=None deixa a foto sem índice facial, para o backfill."""
+    db = SessionLocal()
+    try:
+        foto = db.query(Foto).filter(Foto.id == foto_id).first()
+        if not foto or foto.status_processamento != STATUS_PENDENTE or foto.reserva != reserva:
+            return  # Álbum excluído na fila, ou a reserva venceu e outro worker ficou com a foto
+        foto.reserva = None
+        foto.reservada_em = None
+        if erro is not None:
+            print(f"⚠️  Falha ao processar a foto {foto_id}: {erro}")
+            foto.status_processamento = STATUS_FALHA
+        else:
+            foto.derivados = json.dumps(derivados)
+            foto.marca_dagua_versao = versao_marca
+            if rostos is not None:
+                facial.gravar_rostos(db, foto, rostos)
+            foto.status_processamento = STATUS_PRONTA
+            # Mantém o resumo do álbum (contagem e capa) num UPDATE atômico
+            db.query(Album).filter(Album.id == foto.album_id).update({
+                Album.qtd_fotos: func.coalesce(Album.qtd_fotos, 0) + 1,
+                # Capa = menor id pronto, como era o antigo album.fotos[0]
+                Album.capa_foto_id: case(
+                    (Album.capa_foto_id.is_(None), foto.id),
+                    (Album.capa_foto_id > foto.id, foto.id),
+                    else_=Album.capa_foto_id,
+                ),
+            }, synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+async def _processar(foto_id: int, origem: str, destino: str):
+    global _vagas
+    if _vagas is None:
+        _vagas = asyncio.Semaphore(2 * INGEST_WORKERS)
+    # Reserva só quando há vaga no pool: uma foto reservada não espera atrás de um upload inteiro
+    async with _vagas:
+        reserva = uuid.uuid4().hex
+        if await run_in_threadpool(_reservar, foto_id, reserva):
+            await _processar_reservada(foto_id, origem, destino, reserva)
+
+
+async def _processar_reservada(foto_id: int, origem: str, destino: str, reserva: str):
+    loop = asyncio.get_running_loop()
+    derivados, rostos, erro = None, None, None
+    # Lida na hora de processar (não no upload): uma troca de marca durante a fila já vale para esta foto
+    marca, versao_marca = await run_in_threadpool(_marca_da_foto, foto_id)
+    try:
+        derivados = await loop.run_in_executor(_get_pool(), processar_foto, origem, destino, marca)
+    except Exception as exc:
+        erro = exc
+    if erro is None and facial.disponivel():
+        # Rostos da cópia limpa: a marca d'água atrapalharia a detecção
+        try:
+            rostos = await facial.rostos_da_vitrine(_caminho_web(origem))
+        except facial.FacialIndisponivel:
+            pass
+        except Exception as exc:
+            print(f"⚠️  Falha ao extrair rostos de {destino}: {exc}")
+    await run_in_threadpool(_registrar_resultado, foto_id, derivados, rostos, erro, versao_marca, reserva)
+
+
+def trabalhos(fotos) -> list:
+    """(foto_id, origem, destino) de cada foto — capture antes do commit para não recarregar as fotos."""
+    return [(foto.id, caminho_alta(foto), caminho_baixa(foto)) for foto in fotos]
+
+
+def enfileirar(trabalhos_fotos):
+    """Agenda a geração das vitrines no pool. As fotos já precisam estar commitadas."""
+    loop = asyncio.get_running_loop()
+    for foto_id, origem, destino in trabalhos_fotos:
+        if foto_id in _na_fila:
+            continue
+        _na_fila.add(foto_id)
+        tarefa = loop.create_task(_processar(foto_id, origem, destino))
+        _tarefas.add(tarefa)
+        tarefa.add_done_callback(_tarefas.discard)
+        tarefa.add_done_callback(lambda _, foto_id=foto_id: _na_fila.discard(foto_id))
+
+
+def _pendentes_livres(ignorar: set) -> list:
+    """Trabalhos das fotos 'Pendente' sem reserva válida, fora de `ignorar`."""
+    db = SessionLocal()
+    try:
+        pendentes = db.query(Foto).filter(
+            Foto.status_processamento == STATUS_PENDENTE, _reserva_livre(datetime.utcnow()),
+            Foto.id.notin_(ignorar),
+        ).all()
+        return trabalhos(pendentes)
+    finally:
+        db.close()
+
+
+def retomar_pendentes() -> int:
+    """Reenfileira as fotos que ficaram 'Pendente' (ex.: servidor reiniciado no meio de um upload).
+
+    Roda em todos os workers; a reserva em `_processar` garante que cada foto é processada por um só.
+    """
+    pendentes = _pendentes_livres(set(_na_fila))
+    enfileirar(pendentes)
+    return len(pendentes)
+
+
+async def retomar_periodicamente():
+    """Loop de background: retoma as fotos (e remarcações) cuja reserva venceu — worker que caiu no meio."""
+    while True:
+        await asyncio.sleep(RESERVA_EXPIRA_SEGUNDOS)
+        try:
+            pendentes = await run_in_threadpool(_pendentes_livres, set(_na_fila))
+            enfileirar(pendentes)
+            if pendentes:
+                print(f"🔄 {len(pendentes)} fotos com reserva vencida reenfileiradas para processamento.")
+            for fotografo_id in await run_in_threadpool(_fotografos_a_remarcar):
+                agendar_remarcacao(fotografo_id)
+        except Exception as exc:
+            print(f"⚠️  Falha ao retomar fotos pendentes: {exc!r}")
+
+
+# ==========================================
+# REMARCAÇÃO (o fotógrafo trocou a marca d'água)
+# ==========================================
+
+# Lotes pequenos: fotos de uploads novos entram na fila do pool entre um lote e outro
+LOTE_REMARCACAO = 2 * INGEST_WORKERS
+MAX_FALHAS_REMARCACAO = 3
+
+
+def _precisa_remarcar(versao):
+    # Foto que já falhou MAX_FALHAS_REMARCACAO vezes (original sumido ou corrompido) fica com a marca antiga
+    return (or_(Foto.marca_dagua_versao.is_(None), Foto.marca_dagua_versao != versao)
+            & (func.coalesce(Foto.remarcacao_falhas, 0) < MAX_FALHAS_REMARCACAO))
+
+
+def _marca_do_fotografo(fotografo_id: int) -> "tuple[str, int]":
+    db = SessionLocal()
+    try:
+        fotografo = db.get(Fotografo, fotografo_id)
+        if fotografo is None:
+            return marca_dagua.MARCA_DAGUA_PADRAO, 0
+        return marca_dagua.texto_da_marca(fotografo.marca_dagua), fotografo.marca_dagua_versao or 0
+    finally:
+        db.close()
+
+
+def _reservar_remarcacao(fotografo_id: int, versao: int, ignorar: set, reserva: str) -> list:
+    """Reserva o próximo lote [(foto_id, origem, destino)] de fotos prontas do fotógrafo com marca de outra versão.
+
+    Fotos reservadas por outro worker ficam de fora: só um deles regera cada foto.
+    """
+    agora = datetime.utcnow()
+    db = SessionLocal()
+    try:
+        a_remarcar = (Foto.status_processamento == STATUS_PRONTA) & _precisa_remarcar(versao) & _reserva_livre(agora)
+        ids = db.execute(
+            select(Foto.id)
+            .join(Album, Album.id == Foto.album_id)
+            .where(Album.fotografo_id == fotografo_id, a_remarcar, Foto.id.notin_(ignorar))
+            .order_by(Foto.id)
+            .limit(LOTE_REMARCACAO)
+        ).scalars().all()
+        if not ids:
+            return []
+        # O UPDATE repete o filtro: o que outro processo reservou no meio não vem para nós
+        db.query(Foto).filter(Foto.id.in_(ids), a_remarcar).update(
+            {Foto.reserva: reserva, Foto.reservada_em: agora}, synchronize_session=False)
+        db.commit()
+        linhas = db.execute(
+            select(Foto.id, Foto.caminho_alta_res, Foto.caminho_baixa_res)
+            .where(Foto.reserva == reserva)
+            .order_by(Foto.id)
+        ).all()
+        return [(foto_id, os.path.join(DIRETORIO_ALTA_RES, alta), baixa.lstrip("/")) for foto_id, alta, baixa in linhas]
+    finally:
+        db.close()
+
+
+def _gravar_remarcacao(resultados: list, falhas: list, versao: int, reserva: str):
+    """Grava [(foto_id, derivados)] com a versão da marca usada e libera a reserva do lote.
+
+    As fotos de `falhas` somam uma falha e seguem reservadas até a reserva vencer; a varredura
+    periódica tenta de novo, até MAX_FALHAS_REMARCACAO.
+    """
+    db = SessionLocal()
+    try:
+        for foto_id, derivados in resultados:
+            db.query(Foto).filter(Foto.id == foto_id, Foto.reserva == reserva).update(
+                {Foto.derivados: json.dumps(derivados), Foto.marca_dagua_versao: versao, Foto.remarcacao_falhas: 0,
+                 Foto.reserva: None, Foto.reservada_em: None}, synchronize_session=False)
+        if falhas:
+            db.query(Foto).filter(Foto.id.in_(falhas), Foto.reserva == reserva).update(
+                {Foto.remarcacao_falhas: func.coalesce(Foto.remarcacao_falhas, 0) + 1}, synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+async def _remarcar(fotografo_id: int):
+    loop = asyncio.get_running_loop()
+    falhas, total = set(), 0
+    while True:
+        # Versão relida a cada lote: se a marca mudar no meio, o resto já sai com a nova
+        marca, versao = await run_in_threadpool(_marca_do_fotografo, fotografo_id)
+        reserva = uuid.uuid4().hex
+        lote = await run_in_threadpool(_reservar_remarcacao, fotografo_id, versao, falhas, reserva)
+        if not lote:
+            if fotografo_id in _remarcar_de_novo:
+                _remarcar_de_novo.discard(fotografo_id)
+                continue
+            break
+        resultados = await asyncio.gather(*(
+            loop.run_in_executor(_get_pool(), processar_foto, origem, destino, marca) for _, origem, destino in lote
+        ), return_exceptions=True)
+        prontas, falhas_lote = [], []
+        for (foto_id, _, _), resultado in zip(lote, resultados):
+            if isinstance(resultado, Exception):
+                print(f"⚠️  Falha ao remarcar a foto {foto_id}: {resultado}")
+                falhas_lote.append(foto_id)
+            else:
+                prontas.append((foto_id, resultado))
+        falhas.update(falhas_lote)
+        await run_in_threadpool(_gravar_remarcacao, prontas, falhas_lote, versao, reserva)
+        total += len(prontas)
+    if total:
+        print(f"💧 {total} fotos do fotógrafo {fotografo_id} regeradas com a marca d'água atual.")
+
+
+def agendar_remarcacao(fotografo_id: int):
+    """Regera em background, com a marca atual, os derivados das fotos prontas do fotógrafo."""
+    if fotografo_id in _remarcando:
+        _remarcar_de_novo.add(fotografo_id)
+        return
+    _remarcando.add(fotografo_id)
+    tarefa = asyncio.get_running_loop().create_task(_remarcar(fotografo_id))
+    _tarefas.add(tarefa)
+    tarefa.add_done_callback(_tarefas.discard)
+    tarefa.add_done_callback(lambda _: _remarcando.discard(fotografo_id))
+
+
+def _fotografos_a_remarcar() -> list:
+    db = SessionLocal()
+    try:
+        return db.execute(
+            select(Album.fotografo_id)
+            .join(Foto, Foto.album_id == Album.id)
+            .join(Fotografo, Fotografo.id == Album.fotografo_id)
+            .where(Foto.status_processamento == STATUS_PRONTA,
+                   _precisa_remarcar(func.coalesce(Fotografo.marca_dagua_versao, 0)),
+                   _reserva_livre(datetime.utcnow()))
+            .distinct()
+        ).scalars().all()
+    finally:
+        db.close()
+
+
+def retomar_remarcacoes() -> int:
+    """Agenda a remarcação de quem tem fotos prontas fora da versão atual da marca. Retorna quantos fotógrafos.
+
+    Pega também as fotos anteriores à marca d'água no servidor e remarcações interrompidas. Roda em
+    todos os workers; as fotos são reservadas em lotes, então cada uma é regerada por um só.
+    """
+    fotografo_ids = _fotografos_a_remarcar()
+    for fotografo_id in fotografo_ids:
+        agendar_remarcacao(fotografo_id)
+    return len(fotografo_ids)
+
+
+def encerrar():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
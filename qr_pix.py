@@ -0,0 +1,64 @@
+"""Imagem do QR code dos PIX, servida em /pagamento/{id}/qr.png.
+
+O QR é só o "copia e cola" codificado, então é gerado localmente a partir de
+`pix_copia_cola` quando a biblioteca `qrcode` está instalada — nada de PNG em
+base64 guardado na linha do pedido. Sem a biblioteca, a imagem que o Mercado
+Pago devolve na criação do PIX é gravada uma vez em disco (DIRETORIO_QR_PIX),
+identificada pelo txid, e os arquivos antigos são apagados pela varredura.
+"""
+import io
+import os
+import time
+import base64
+
+# Geração local do QR — importação opcional
+try:
+    import qrcode
+    QRCODE_DISPONIVEL = True
+except ImportError:
+    qrcode = None
+    QRCODE_DISPONIVEL = False
+
+DIRETORIO_QR_PIX = "./qr_pix"
+VALIDADE_ARQUIVO_SEGUNDOS = 24 * 3600  # Bem acima dos 30 min de validade do PIX
+
+os.makedirs(DIRETORIO_QR_PIX, exist_ok=True)
+
+
+def _caminho(txid: str) -> str:
+    return os.path.join(DIRETORIO_QR_PIX, f"{os.path.basename(str(txid))}.png")
+
+
+def guardar_imagem_mp(txid: str, qr_code_base64: "str | None"):
+    """Grava o PNG devolvido pelo Mercado Pago, se não formos gerar o QR localmente."""
+    if QRCODE_DISPONIVEL or not qr_code_base64:
+        return
+    with open(_caminho(txid), "wb") as f:
+        f.write(base64.b64decode(qr_code_base64))
+
+
+def gerar_png(txid: str, copia_cola: "str | None") -> "bytes | None":
+    """PNG do QR do PIX, ou None se não houver como montá-lo. Bloqueante — use via run_in_threadpool."""
+    if QRCODE_DISPONIVEL and copia_cola:
+        buffer = io.BytesIO()
+        qrcode.make(copia_cola, box_size=8, border=2).save(buffer, "PNG")
+        return buffer.getvalue()
+    try:
+        with open(_caminho(txid), "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def purgar_antigos() -> int:
+    """Apaga as imagens gravadas há mais de VALIDADE_ARQUIVO_SEGUNDOS."""
+    limite = time.time() - VALIDADE_ARQUIVO_SEGUNDOS
+    removidos = 0
+    for entrada in os.scandir(DIRETORIO_QR_PIX):
+        if entrada.is_file() and entrada.name.endswith(".png") and entrada.stat().st_mtime < limite:
+            try:
+                os.remove(entrada.path)
+                removidos += 1
+            except FileNotFoundError:
+                pass
+    return removidos
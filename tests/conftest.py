@@ -0,0 +1,29 @@
+"""Ambiente dos testes: SQLite temporário, migrado, e diretório de trabalho isolado.
+
+O app usa caminhos relativos (templates, static, fotos, QR dos PIX); os testes
+rodam numa pasta temporária com links para templates/ e static/, então nada
+é gravado na árvore do projeto.
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TRABALHO = tempfile.mkdtemp(prefix="yshpics_testes_")
+
+sys.path.insert(0, RAIZ)
+os.environ["DATABASE_URL"] = f"sqlite:///{TRABALHO}/testes.db"
+os.environ.pop("ASYNC_DATABASE_URL", None)
+os.environ.setdefault("OWNER_EMAIL", "dono@teste.com")
+os.environ.setdefault("SESSION_SECRET", "testes")
+for pasta in ("templates", "static"):
+    os.symlink(os.path.join(RAIZ, pasta), os.path.join(TRABALHO, pasta))
+os.chdir(TRABALHO)
+
+
+@pytest.fixture(scope="session", autouse=True)
+def banco():
+    import migracoes
+    migracoes.migrar()
@@ -0,0 +1,94 @@
+"""Idempotency-Key no checkout: o mesmo envio devolve o mesmo pedido; outro conteúdo com a chave é 422."""
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from models import SessionLocal, Album, Foto, Fotografo, Pedido
+
+
+@pytest.fixture(scope="module")
+def fotos():
+    db = SessionLocal()
+    try:
+        fotografo = Fotografo(nome="Vendedor", email=f"{uuid.uuid4().hex}@teste.com", senha_hash="x",
+                              mp_access_token="TEST-token")
+        db.add(fotografo)
+        db.flush()
+        album = Album(titulo="Corrida", hash_url=uuid.uuid4().hex[:8], fotografo_id=fotografo.id)
+        db.add(album)
+        db.flush()
+        fotos = [Foto(album_id=album.id, caminho_alta_res="a.jpg", caminho_baixa_res="/static/a.jpg",
+                      preco_baixa=5.0, preco_alta=15.0, status_processamento="Pronta") for _ in range(2)]
+        db.add_all(fotos)
+        db.commit()
+        return [foto.id for foto in fotos]
+    finally:
+        db.close()
+
+
+@pytest.fixture
+def cliente(monkeypatch):
+    cobrancas = []
+
+    async def gerar_cobranca_pix(**kwargs):
+        cobrancas.append(kwargs)
+        return {"sucesso": True, "txid": uuid.uuid4().hex, "copia_cola": "000201", "qr_code_img": None,
+                "split_aplicado": True}
+
+    monkeypatch.setattr(main, "gerar_cobranca_pix", gerar_cobranca_pix)
+    monkeypatch.setattr(main.qr_pix, "guardar_imagem_mp", lambda *_: None)
+    with TestClient(main.app) as cliente:
+        cliente.cobrancas = cobrancas
+        yield cliente
+
+
+def _pedido(cliente, chave: str, itens: list, email: str = "ana@teste.com"):
+    return cliente.post("/criar-pedido", headers={"Idempotency-Key": chave}, json={
+        "itens": [{"foto_id": foto_id, "qualidade": qualidade} for foto_id, qualidade in itens],
+        "nome_cliente": "Ana", "email_cliente": email,
+    })
+
+
+def test_mesma_chave_e_mesmo_carrinho_devolve_o_mesmo_pedido(cliente, fotos):
+    chave = uuid.uuid4().hex
+    primeiro = _pedido(cliente, chave, [(fotos[0], "alta"), (fotos[1], "baixa")]).json()
+    # Ordem dos itens e caixa do e-mail não mudam o envio
+    repetido = _pedido(cliente, chave, [(fotos[1], "baixa"), (fotos[0], "alta")], email=" ANA@teste.com").json()
+    assert primeiro["sucesso"] and repetido == primeiro
+    assert len(cliente.cobrancas) == 1
+
+
+@pytest.mark.parametrize("itens, email", [
+    ([(0, "alta")], "ana@teste.com"),                    # Outro carrinho
+    ([(0, "alta"), (1, "alta")], "ana@teste.com"),       # Outra qualidade
+    ([(0, "alta"), (1, "baixa")], "bia@teste.com"),      # Outro cliente
+])
+def test_mesma_chave_com_outro_conteudo_e_422(cliente, fotos, itens, email):
+    chave = uuid.uuid4().hex
+    assert _pedido(cliente, chave, [(fotos[0], "alta"), (fotos[1], "baixa")]).json()["sucesso"]
+    resposta = _pedido(cliente, chave, [(fotos[i], qualidade) for i, qualidade in itens], email=email)
+    assert resposta.status_code == 422
+    assert len(cliente.cobrancas) == 1
+
+
+def test_excecao_no_pix_cancela_o_pedido_e_libera_a_chave(cliente, fotos, monkeypatch):
+    async def gerar_cobranca_pix(**kwargs):
+        raise KeyError("point_of_interaction")
+
+    chave = uuid.uuid4().hex
+    with monkeypatch.context() as m:
+        m.setattr(main, "gerar_cobranca_pix", gerar_cobranca_pix)
+        resposta = _pedido(cliente, chave, [(fotos[0], "alta")])
+    assert resposta.status_code == 200 and resposta.json()["sucesso"] is False
+
+    db = SessionLocal()
+    try:
+        cancelado = db.query(Pedido).order_by(Pedido.id.desc()).first()
+        assert (cancelado.status_pagamento, cancelado.chave_idempotencia) == ("Cancelado", None)
+    finally:
+        db.close()
+    # A mesma chave tenta de novo em vez de esperar um PIX que nunca vem
+    novo = _pedido(cliente, chave, [(fotos[0], "alta")]).json()
+    assert novo["sucesso"] and novo["pedido_id"] != cancelado.id
@@ -0,0 +1,102 @@
+"""Número de consultas de /, /admin e /owner: constante no número de álbuns e pedidos.
+
+Conta os statements enviados ao banco (before_cursor_execute) em cada página
+com N e com 3N álbuns/pedidos; um N+1 (lazy load num loop do template, por
+exemplo) faz a contagem crescer junto com os dados.
+"""
+import json
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+import main
+import metricas
+import processamento
+from models import SessionLocal, Album, Cliente, Foto, Fotografo, ItemPedido, Pedido
+
+PAGINAS = ("/", "/admin", "/owner")
+
+
+def _popular(fotografo_id: int, quantidade: int):
+    """`quantidade` álbuns com duas fotos prontas e um pedido pago cada, de um fotógrafo novo e do dono."""
+    db = SessionLocal()
+    try:
+        outro = Fotografo(nome="Outro", email=f"{uuid.uuid4().hex}@teste.com", senha_hash="x")
+        db.add(outro)
+        db.flush()
+        for i in range(quantidade):
+            dono_album = fotografo_id if i % 2 else outro.id
+            album = Album(titulo=f"Evento {i}", hash_url=uuid.uuid4().hex[:8], cidade=f"Cidade {i % 3}",
+                          fotografo_id=dono_album, data_evento=datetime.utcnow() - timedelta(days=i))
+            db.add(album)
+            db.flush()
+            fotos = [
+                Foto(album_id=album.id, caminho_alta_res=f"{uuid.uuid4().hex}.jpg",
+                     caminho_baixa_res=f"/static/vitrine/{uuid.uuid4().hex}.jpg", preco_baixa=5.0, preco_alta=15.0,
+                     status_processamento=processamento.STATUS_PRONTA,
+                     derivados=json.dumps({"jpeg": [[240, "/static/vitrine/x_240.jpg"]]}))
+                for _ in range(2)
+            ]
+            db.add_all(fotos)
+            db.flush()
+            album.qtd_fotos, album.capa_foto_id = len(fotos), fotos[0].id
+
+            cliente = Cliente(nome=f"Cliente {i}", email=f"cliente{i}@teste.com")
+            db.add(cliente)
+            db.flush()
+            pedido = Pedido(cliente_id=cliente.id, fotografo_id=dono_album, valor_total=15.0,
+                            taxa_plataforma=1.5, status_pagamento="Pago")
+            db.add(pedido)
+            db.flush()
+            db.add(ItemPedido(pedido_id=pedido.id, foto_id=fotos[0].id, qualidade="alta", preco_cobrado=15.0))
+            metricas.registrar_pagamento(db, pedido)
+        db.commit()
+    finally:
+        db.close()
+
+
+@pytest.fixture(scope="module")
+def cliente_dono():
+    db = SessionLocal()
+    try:
+        dono = Fotografo(nome="Dono", email=main.OWNER_EMAIL, senha_hash="x")
+        db.add(dono)
+        db.commit()
+        dono_id = dono.id
+    finally:
+        db.close()
+    with TestClient(main.app) as cliente:
+        cliente.cookies.set("sessao_admin", main._assinar_sessao(dono_id))
+        yield cliente, dono_id
+
+
+def _contar_consultas(cliente) -> dict:
+    contagem = {}
+    atual = [0]
+
+    def contar(*_):
+        atual[0] += 1
+
+    motor = main.async_engine.sync_engine
+    event.listen(motor, "before_cursor_execute", contar)
+    try:
+        for pagina in PAGINAS:
+            metricas.invalidar_fotografo(cliente[1])  # Sem o cache do resumo: mede a consulta de verdade
+            atual[0] = 0
+            resposta = cliente[0].get(pagina, follow_redirects=False)
+            assert resposta.status_code == 200, pagina
+            contagem[pagina] = atual[0]
+    finally:
+        event.remove(motor, "before_cursor_execute", contar)
+    return contagem
+
+
+def test_consultas_nao_crescem_com_albuns_e_pedidos(cliente_dono):
+    _popular(cliente_dono[1], 4)
+    com_poucos = _contar_consultas(cliente_dono)
+    _popular(cliente_dono[1], 12)
+    com_muitos = _contar_consultas(cliente_dono)
+    assert com_muitos == com_poucos
@@ -0,0 +1,148 @@
+"""Caixa de saída de e-mails contra um SMTP local (aiosmtpd): sessão, backoff e queda no meio do lote."""
+import socket
+from datetime import datetime, timedelta
+
+import pytest
+from aiosmtpd.controller import Controller
+
+import emails
+from models import SessionLocal, EmailSaida
+
+RECUSA_TEMPORARIA = "temporario@teste.com"
+RECUSA_DEFINITIVA = "inexistente@teste.com"
+
+
+class _Caixa:
+    """Handler do aiosmtpd: guarda as mensagens e a sessão (conexão) de cada uma."""
+
+    def __init__(self):
+        self.recebidos = []
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address == RECUSA_TEMPORARIA:
+            return "451 4.3.0 Tente mais tarde"
+        if address == RECUSA_DEFINITIVA:
+            return "550 5.1.1 Caixa inexistente"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.recebidos.append((id(session), envelope.rcpt_tos[0]))
+        return "250 Message accepted for delivery"
+
+
+def _porta_livre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def smtp(monkeypatch):
+    caixa = _Caixa()
+    controlador = Controller(caixa, hostname="127.0.0.1", port=_porta_livre())
+    controlador.start()
+    monkeypatch.setattr(emails, "SMTP_HOST", "127.0.0.1")
+    monkeypatch.setattr(emails, "SMTP_PORT", controlador.port)
+    monkeypatch.setattr(emails, "SMTP_STARTTLS", False)
+    monkeypatch.setattr(emails, "SMTP_USER", "")
+    monkeypatch.setattr(emails, "SMTP_FROM", "loja@teste.com")
+    db = SessionLocal()
+    try:
+        db.query(EmailSaida).delete()
+        db.commit()
+    finally:
+        db.close()
+    try:
+        yield caixa
+    finally:
+        emails._sessao.fechar()
+        controlador.stop()
+
+
+def _enfileirar(*destinatarios: str):
+    db = SessionLocal()
+    try:
+        for destinatario in destinatarios:
+            emails.enfileirar(db, destinatario, "Assunto", "<p>Oi</p>")
+        db.commit()
+    finally:
+        db.close()
+
+
+def _por_destinatario() -> "dict[str, EmailSaida]":
+    db = SessionLocal()
+    try:
+        return {email.destinatario: email for email in db.query(EmailSaida).all()}
+    finally:
+        db.close()
+
+
+def test_lotes_reaproveitam_a_mesma_sessao(smtp):
+    _enfileirar("a@teste.com", "b@teste.com")
+    assert emails._enviar_lote() == 2
+    _enfileirar("c@teste.com")
+    assert emails._enviar_lote() == 1
+
+    assert [destinatario for _, destinatario in smtp.recebidos] == ["a@teste.com", "b@teste.com", "c@teste.com"]
+    assert len({sessao for sessao, _ in smtp.recebidos}) == 1
+    assert {e.status for e in _por_destinatario().values()} == {emails.STATUS_ENVIADO}
+
+
+def test_recusa_temporaria_volta_com_backoff_e_definitiva_vai_para_erro(smtp):
+    _enfileirar("a@teste.com", RECUSA_TEMPORARIA, RECUSA_DEFINITIVA)
+    antes = datetime.utcnow()
+    assert emails._enviar_lote() == 3
+
+    emails_ = _por_destinatario()
+    assert emails_["a@teste.com"].status == emails.STATUS_ENVIADO
+    adiado = emails_[RECUSA_TEMPORARIA]
+    assert (adiado.status, adiado.tentativas, adiado.reserva) == (emails.STATUS_PENDENTE, 1, None)
+    espera = adiado.proxima_tentativa_em - antes
+    assert timedelta(seconds=emails.BACKOFF_BASE_SEGUNDOS * 0.5) <= espera
+    assert espera <= timedelta(seconds=emails.BACKOFF_BASE_SEGUNDOS * 1.5 + 5)
+    assert (emails_[RECUSA_DEFINITIVA].status, emails_[RECUSA_DEFINITIVA].tentativas) == (emails.STATUS_ERRO, 1)
+
+    # O adiado só volta a ser enviado depois do backoff
+    assert emails._enviar_lote() == 0
+    db = SessionLocal()
+    try:
+        assert emails.profundidade_fila(db) | {"mais_antigo_em": None} == {
+            "pendentes": 1, "enviando": 0, "com_erro": 1, "mais_antigo_em": None,
+        }
+    finally:
+        db.close()
+
+
+def test_queda_no_meio_do_lote_nao_reenvia_o_que_ja_saiu(smtp, monkeypatch):
+    class Queda(BaseException):
+        """Processo morrendo no meio do lote (não é tratada como falha SMTP)."""
+
+    montar = emails._montar_mensagem
+
+    def montar_e_cair(email):
+        if email.destinatario == "c@teste.com":
+            raise Queda()
+        return montar(email)
+
+    _enfileirar("a@teste.com", "b@teste.com", "c@teste.com")
+    monkeypatch.setattr(emails, "_montar_mensagem", montar_e_cair)
+    with pytest.raises(Queda):
+        emails._enviar_lote()
+
+    status = {destinatario: email.status for destinatario, email in _por_destinatario().items()}
+    assert status == {"a@teste.com": emails.STATUS_ENVIADO, "b@teste.com": emails.STATUS_ENVIADO,
+                      "c@teste.com": emails.STATUS_ENVIANDO}
+    db = SessionLocal()
+    try:
+        assert emails.profundidade_fila(db)["enviando"] == 1
+        # Reserva vencida: outro worker retoma só o que não saiu
+        db.query(EmailSaida).filter(EmailSaida.status == emails.STATUS_ENVIANDO).update(
+            {EmailSaida.reservada_em: datetime.utcnow() - timedelta(seconds=emails.RESERVA_EXPIRA_SEGUNDOS + 1)})
+        db.commit()
+    finally:
+        db.close()
+
+    monkeypatch.setattr(emails, "_montar_mensagem", montar)
+    assert emails._enviar_lote() == 1
+    assert [destinatario for _, destinatario in smtp.recebidos] == ["a@teste.com", "b@teste.com", "c@teste.com"]
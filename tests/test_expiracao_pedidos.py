@@ -0,0 +1,57 @@
+"""Varredura dos PIX vencidos e o pagamento que chega depois dela."""
+import uuid
+from datetime import datetime, timedelta
+
+import caixa_webhook
+import expiracao_pedidos
+from models import SessionLocal, Cliente, Fotografo, Pedido
+
+
+def _pedido(pix_expiracao, data_pedido=None) -> "tuple[int, str]":
+    db = SessionLocal()
+    try:
+        fotografo = Fotografo(nome="F", email=f"{uuid.uuid4().hex}@teste.com", senha_hash="x", mp_access_token="TEST")
+        cliente = Cliente(nome="Ana", email="ana@teste.com")
+        db.add_all([fotografo, cliente])
+        db.flush()
+        txid = uuid.uuid4().hex
+        pedido = Pedido(cliente_id=cliente.id, fotografo_id=fotografo.id, valor_total=15.0, pix_txid=txid,
+                        pix_expiracao=pix_expiracao, data_pedido=data_pedido or datetime.utcnow())
+        db.add(pedido)
+        db.commit()
+        return pedido.id, txid
+    finally:
+        db.close()
+
+
+def _status(pedido_id: int) -> str:
+    db = SessionLocal()
+    try:
+        return db.get(Pedido, pedido_id).status_pagamento
+    finally:
+        db.close()
+
+
+def test_pix_pago_depois_da_varredura_vira_pago():
+    pedido_id, txid = _pedido(datetime.utcnow() - timedelta(seconds=5))
+    assert pedido_id in expiracao_pedidos.expirar_vencidos()
+    assert _status(pedido_id) == "Expirado"
+
+    assert caixa_webhook._pedido_a_verificar(txid)[0] == pedido_id
+    assert caixa_webhook._aplicar_status(pedido_id, txid, "approved") == "Pago"
+    assert _status(pedido_id) == "Pago"
+
+
+def test_cancelamento_no_mp_nao_mexe_no_pedido_expirado():
+    pedido_id, txid = _pedido(datetime.utcnow() - timedelta(seconds=5))
+    expiracao_pedidos.expirar_vencidos()
+    assert caixa_webhook._aplicar_status(pedido_id, txid, "cancelled") is None
+    assert _status(pedido_id) == "Expirado"
+
+
+def test_pedido_sem_pix_expiracao_vence_pela_data_do_pedido():
+    antigo, _ = _pedido(None, datetime.utcnow() - expiracao_pedidos.EXPIRACAO_PADRAO - timedelta(minutes=1))
+    recente, _ = _pedido(None)
+    vencidos = expiracao_pedidos.expirar_vencidos()
+    assert antigo in vencidos and recente not in vencidos
+    assert (_status(antigo), _status(recente)) == ("Expirado", "Pendente")
@@ -0,0 +1,112 @@
+"""Reconstrução do índice facial em background: uma por partição, sem travar a busca."""
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import facial
+import indice_facial
+from models import SessionLocal, Album, Foto, Fotografo, RostoFoto
+
+CHAVE = ("salvador", "esportes")
+
+
+def _indice_com(n: int) -> indice_facial.IndiceIVF:
+    ids = np.arange(1, n + 1, dtype=np.int64)
+    return indice_facial.IndiceIVF(ids, ids, ids, np.random.default_rng(n).normal(size=(n, 128)).astype(np.float32))
+
+
+@pytest.fixture
+def construcao_lenta(monkeypatch):
+    """_construir só termina quando o teste libera; conta quantas montagens começaram."""
+    liberar, chamadas = threading.Event(), []
+
+    def construir(_db, chave):
+        chamadas.append(chave)
+        assert liberar.wait(5)
+        return _indice_com(10 * len(chamadas))
+
+    monkeypatch.setattr(indice_facial, "_construir", construir)
+    monkeypatch.setattr(indice_facial, "_particoes", indice_facial.OrderedDict())
+    return liberar, chamadas
+
+
+def _esperar(condicao):
+    limite = time.monotonic() + 5
+    while not condicao():
+        assert time.monotonic() < limite
+        time.sleep(0.01)
+
+
+def test_primeira_busca_nao_espera_a_montagem(construcao_lenta):
+    liberar, chamadas = construcao_lenta
+    assert indice_facial._indice(CHAVE) is None  # Busca vai por força bruta enquanto monta
+    indice_facial._indice(CHAVE)
+    assert chamadas == [CHAVE]
+
+    liberar.set()
+    _esperar(lambda: len(indice_facial._indice(CHAVE) or []) == 10)
+
+
+def test_indice_vencido_segue_servindo_o_anterior_ate_a_troca(construcao_lenta):
+    liberar, chamadas = construcao_lenta
+    liberar.set()
+    indice_facial._indice(CHAVE)
+    _esperar(lambda: len(indice_facial._indice(CHAVE) or []) == 10)
+    anterior = indice_facial._indice(CHAVE)
+    _esperar(lambda: not indice_facial._particoes[CHAVE].trava.locked())
+
+    liberar.clear()
+    indice_facial._vencer(CHAVE)
+    assert indice_facial._indice(CHAVE) is anterior
+    assert indice_facial._indice(CHAVE) is anterior
+    assert len(chamadas) == 2  # Uma reconstrução só, mesmo com várias buscas no meio
+
+    liberar.set()
+    _esperar(lambda: indice_facial._indice(CHAVE) is not anterior)
+    assert len(indice_facial._indice(CHAVE)) == 20
+
+
+@pytest.fixture(scope="module")
+def particao_recife():
+    """Álbum de (Recife, Festas) com três rostos; devolve (album_id, encoding do rosto procurado)."""
+    alvo = np.full(128, 0.05, np.float32)
+    db = SessionLocal()
+    try:
+        fotografo = Fotografo(nome="F", email="indice@teste.com", senha_hash="x")
+        db.add(fotografo)
+        db.flush()
+        album = Album(titulo="Festa", hash_url="indice01", cidade="Recife", categoria="Festas", fotografo_id=fotografo.id)
+        db.add(album)
+        db.flush()
+        for encoding in (alvo, -alvo, np.ones(128, np.float32)):
+            foto = Foto(album_id=album.id, caminho_alta_res="a.jpg", caminho_baixa_res="/a.jpg")
+            db.add(foto)
+            db.flush()
+            db.add(RostoFoto(foto_id=foto.id, album_id=album.id, encoding=encoding.tobytes(),
+                             caixa_topo=0, caixa_direita=0, caixa_base=0, caixa_esquerda=0))
+        db.commit()
+        return album.id, alvo
+    finally:
+        db.close()
+
+
+def test_particao_sem_indice_pequena_vai_por_forca_bruta(construcao_lenta, particao_recife, monkeypatch):
+    liberar, _ = construcao_lenta
+    album_id, alvo = particao_recife
+    monkeypatch.setattr(indice_facial, "FORCA_BRUTA_MAX_ROSTOS", 3)
+    try:
+        assert list(indice_facial.buscar("Recife", "Festas", alvo)) == [album_id]
+    finally:
+        liberar.set()
+
+
+def test_particao_sem_indice_grande_demais_responde_ocupado(construcao_lenta, particao_recife, monkeypatch):
+    liberar, _ = construcao_lenta
+    monkeypatch.setattr(indice_facial, "FORCA_BRUTA_MAX_ROSTOS", 2)
+    try:
+        with pytest.raises(facial.FacialOcupado):
+            indice_facial.buscar("Recife", "Festas", particao_recife[1])
+    finally:
+        liberar.set()
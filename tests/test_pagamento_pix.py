@@ -0,0 +1,117 @@
+"""Split da comissão no PIX: quando a conta do fotógrafo passa a receber sem application_fee."""
+import json
+import asyncio
+import uuid
+
+import httpx
+import pytest
+
+import pagamento_pix
+
+PIX_CRIADO = {
+    "id": 123, "status": "pending",
+    "point_of_interaction": {"transaction_data": {"qr_code": "copia-e-cola", "qr_code_base64": "Zm9v"}},
+}
+
+
+@pytest.fixture
+def mercado_pago():
+    """Instala um Mercado Pago falso; `responder(corpo) -> (status, json) | httpx.Response` decide cada POST /v1/payments."""
+    chamadas = []
+
+    def instalar(responder):
+        def handler(requisicao: httpx.Request):
+            corpo = json.loads(requisicao.content)
+            chamadas.append(corpo)
+            resposta = responder(corpo)
+            if isinstance(resposta, httpx.Response):
+                return resposta
+            return httpx.Response(resposta[0], json=resposta[1])
+        pagamento_pix._http = httpx.AsyncClient(base_url=pagamento_pix.MP_API_URL, transport=httpx.MockTransport(handler))
+        return chamadas
+
+    yield instalar
+    pagamento_pix._http = None
+
+
+def _gerar(token: str) -> dict:
+    return asyncio.run(pagamento_pix.gerar_cobranca_pix(15.0, "a@b.com", "Ana Souza", 1, token, 1.5))
+
+
+def _token() -> str:
+    return f"TOKEN-{uuid.uuid4()}"
+
+
+def test_erro_que_cita_a_taxa_desliga_o_split(mercado_pago):
+    def responder(corpo):
+        if "application_fee" in corpo:
+            return 400, {"message": "Invalid application_fee: collector is not a marketplace", "status": 400}
+        return 201, PIX_CRIADO
+    chamadas = mercado_pago(responder)
+    token = _token()
+
+    resultado = _gerar(token)
+
+    assert resultado["sucesso"] and resultado["split_aplicado"] is False
+    assert not pagamento_pix.cliente_mp(token).split_disponivel
+    # O próximo PIX já vai direto sem a taxa
+    _gerar(token)
+    assert ["application_fee" in c for c in chamadas] == [True, False, False]
+
+
+def test_recusa_generica_seguida_de_sucesso_sem_taxa_desliga_o_split(mercado_pago):
+    def responder(corpo):
+        if "application_fee" in corpo:
+            return 400, {"message": "bad request", "cause": [{"code": 4020, "description": "unauthorized use"}]}
+        return 201, PIX_CRIADO
+    mercado_pago(responder)
+    token = _token()
+
+    resultado = _gerar(token)
+
+    assert resultado["sucesso"] and resultado["split_aplicado"] is False
+    assert not pagamento_pix.cliente_mp(token).split_disponivel
+
+
+@pytest.mark.parametrize("status, resposta", [
+    (400, {"message": "Invalid payer.identification.number", "cause": [{"code": 2067, "description": "Invalid user identification number"}]}),
+    (401, {"message": "invalid access token", "status": 401}),
+    (403, {"message": "At least one policy returned UNAUTHORIZED.", "status": 403}),
+])
+def test_recusa_que_nao_e_do_split_mantem_a_comissao(mercado_pago, status, resposta):
+    chamadas = mercado_pago(lambda corpo: (status, resposta))
+    token = _token()
+
+    resultado = _gerar(token)
+
+    assert resultado["sucesso"] is False
+    assert pagamento_pix.cliente_mp(token).split_disponivel
+    assert "application_fee" in chamadas[0]
+
+
+def test_split_aceito(mercado_pago):
+    chamadas = mercado_pago(lambda corpo: (201, PIX_CRIADO))
+
+    resultado = _gerar(_token())
+
+    assert resultado["sucesso"] and resultado["split_aplicado"] is True
+    assert chamadas[0]["application_fee"] == 1.5
+
+
+def test_erro_em_html_vira_falha_e_nao_excecao(mercado_pago):
+    mercado_pago(lambda corpo: httpx.Response(403, text="<html><body>Forbidden</body></html>"))
+    token = _token()
+
+    resultado = _gerar(token)
+
+    assert resultado["sucesso"] is False and resultado["erro"]
+    assert pagamento_pix.cliente_mp(token).split_disponivel  # Não é recusa do split
+
+
+def test_pagamento_sem_codigo_pix_vira_falha(mercado_pago):
+    chamadas = mercado_pago(lambda corpo: (201, {"id": 123, "status": "pending"}))
+
+    resultado = _gerar(_token())
+
+    assert resultado["sucesso"] is False and resultado["erro"]
+    assert len(chamadas) == 1  # Pagamento pode ter sido criado: não tenta de novo sem a taxa
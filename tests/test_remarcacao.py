@@ -0,0 +1,41 @@
+"""Remarcação: foto que sempre falha sai da fila depois de MAX_FALHAS_REMARCACAO tentativas."""
+import uuid
+from datetime import datetime, timedelta
+
+import processamento
+from models import SessionLocal, Album, Foto, Fotografo
+
+
+def test_foto_que_sempre_falha_sai_da_remarcacao():
+    db = SessionLocal()
+    try:
+        fotografo = Fotografo(nome="F", email=f"{uuid.uuid4().hex}@teste.com", senha_hash="x", marca_dagua_versao=2)
+        db.add(fotografo)
+        db.flush()
+        album = Album(titulo="A", hash_url=uuid.uuid4().hex[:8], fotografo_id=fotografo.id)
+        db.add(album)
+        db.flush()
+        foto = Foto(album_id=album.id, caminho_alta_res="sumiu.jpg", caminho_baixa_res="/static/sumiu.jpg",
+                    status_processamento=processamento.STATUS_PRONTA, marca_dagua_versao=1)
+        db.add(foto)
+        db.commit()
+        fotografo_id, foto_id = fotografo.id, foto.id
+    finally:
+        db.close()
+
+    for _ in range(processamento.MAX_FALHAS_REMARCACAO):
+        assert fotografo_id in processamento._fotografos_a_remarcar()
+        reserva = uuid.uuid4().hex
+        lote = processamento._reservar_remarcacao(fotografo_id, 2, set(), reserva)
+        assert [foto_id] == [f for f, _, _ in lote]
+        processamento._gravar_remarcacao([], [foto_id], 2, reserva)
+        # Reserva vencida: a varredura periódica pegaria a foto de novo
+        db = SessionLocal()
+        try:
+            db.query(Foto).filter(Foto.id == foto_id).update({Foto.reservada_em: datetime.utcnow() - timedelta(days=1)})
+            db.commit()
+        finally:
+            db.close()
+
+    assert fotografo_id not in processamento._fotografos_a_remarcar()
+    assert processamento._reservar_remarcacao(fotografo_id, 2, set(), uuid.uuid4().hex) == []
@@ -0,0 +1,52 @@
+"""ZIP em streaming: STORED com CRC e tamanhos no cabeçalho local, sem data descriptor."""
+import io
+import os
+import struct
+import zipfile
+import zlib
+
+import pytest
+
+from zip_stream import ZipStream, EntradaZip
+
+
+@pytest.fixture
+def entradas(tmp_path):
+    resultado = []
+    for i in range(3):
+        caminho = tmp_path / f"foto_{i}.jpg"
+        caminho.write_bytes(os.urandom(10000 * (i + 1)))
+        resultado.append(EntradaZip(str(caminho), f"Evento/original_{i}.jpg"))
+    return resultado
+
+
+def test_zip_completo_e_do_tamanho_anunciado(entradas):
+    fluxo = ZipStream(entradas, tamanho_bloco=4096)
+    dados = b"".join(fluxo)
+    assert len(dados) == fluxo.tamanho
+    with zipfile.ZipFile(io.BytesIO(dados)) as zf:
+        assert zf.testzip() is None
+        for entrada in entradas:
+            info = zf.getinfo(entrada.nome)
+            assert info.compress_type == zipfile.ZIP_STORED
+            assert not info.flag_bits & 0x08
+            with open(entrada.caminho, "rb") as f:
+                assert zf.read(entrada.nome) == f.read()
+
+
+def test_cabecalho_local_traz_crc_e_tamanhos(entradas):
+    dados = b"".join(ZipStream(entradas[:1]))
+    assinatura, _, flags, metodo, _, _, crc, comprimido, tamanho, _, _ = struct.unpack("<IHHHHHIIIHH", dados[:30])
+    with open(entradas[0].caminho, "rb") as f:
+        conteudo = f.read()
+    assert (assinatura, flags & 0x08, metodo) == (0x04034B50, 0, 0)
+    assert (crc, comprimido, tamanho) == (zlib.crc32(conteudo), len(conteudo), len(conteudo))
+
+
+def test_arquivo_alterado_no_meio_aborta(entradas):
+    fluxo = iter(ZipStream(entradas[:1], tamanho_bloco=4096))
+    next(fluxo)  # Cabeçalho local, com o CRC do conteúdo original
+    with open(entradas[0].caminho, "r+b") as f:
+        f.write(b"\0" * 16)
+    with pytest.raises(IOError):
+        list(fluxo)
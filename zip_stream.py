@@ -0,0 +1,168 @@
+"""ZIP em streaming para os downloads de pedidos.
+
+O arquivo é gerado enquanto é enviado: cabeçalho local e dados lidos do
+disco em blocos. As fotos já são JPEG, então tudo vai STORED (sem compressão)
+— o tamanho final é conhecido antes do primeiro byte e pode ir no
+Content-Length. CRC e tamanhos vão no próprio cabeçalho local, sem data
+descriptor (que alguns leitores não aceitam em entradas STORED): o CRC de
+cada foto é lido do disco antes do cabeçalho e fica em cache por arquivo.
+
+A memória por download fica limitada ao tamanho do bloco, independente do
+tamanho do pedido. Passa de 4 GB? Usa as extensões ZIP64 para os offsets.
+"""
+import os
+import struct
+import zlib
+from datetime import datetime
+from functools import lru_cache
+from typing import Iterator, List, NamedTuple
+
+TAMANHO_BLOCO = 256 * 1024
+
+_LIMITE_32 = 0xFFFFFFFF
+_LIMITE_16 = 0xFFFF
+
+_FLAGS = 0x0800   # bit 11: nomes em UTF-8
+_STORED = 0
+_VERSAO = 20
+_VERSAO_ZIP64 = 45
+
+_LOCAL = struct.Struct("<IHHHHHIIIHH")           # 30 bytes
+_CENTRAL = struct.Struct("<IHHHHHHIIIHHHHHII")    # 46 bytes
+_ZIP64_EXTRA_OFFSET = struct.Struct("<HHQ")       # 12 bytes
+_ZIP64_FIM = struct.Struct("<IQHHIIQQQQ")         # 56 bytes
+_ZIP64_LOCALIZADOR = struct.Struct("<IIQI")       # 20 bytes
+_FIM = struct.Struct("<IHHHHIIH")                 # 22 bytes
+
+
+class EntradaZip(NamedTuple):
+    caminho: str   # Arquivo no disco
+    nome: str      # Nome dentro do ZIP
+
+
+class _Arquivo(NamedTuple):
+    caminho: str
+    nome: bytes
+    tamanho: int
+    modificado_ns: int
+    hora_dos: int
+    data_dos: int
+
+
+def _data_hora_dos(timestamp: float) -> "tuple[int, int]":
+    dt = datetime.fromtimestamp(timestamp)
+    if dt.year < 1980:
+        dt = datetime(1980, 1, 1)
+    hora = (dt.hour << 11) | (dt.minute << 5) | (dt.second // 2)
+    data = ((dt.year - 1980) << 9) | (dt.month << 5) | dt.day
+    return hora, data
+
+
+def _blocos(caminho: str, tamanho: int, tamanho_bloco: int) -> Iterator[bytes]:
+    restante = tamanho
+    with open(caminho, "rb") as f:
+        while restante > 0:
+            bloco = f.read(min(tamanho_bloco, restante))
+            if not bloco:
+                raise IOError(f"Arquivo encolheu durante o download: {caminho}")
+            restante -= len(bloco)
+            yield bloco
+
+
+@lru_cache(maxsize=4096)
+def _crc_arquivo(caminho: str, tamanho: int, modificado_ns: int, tamanho_bloco: int) -> int:
+    """CRC-32 do arquivo; tamanho e mtime na chave do cache: arquivo regravado tem outro CRC."""
+    crc = 0
+    for bloco in _blocos(caminho, tamanho, tamanho_bloco):
+        crc = zlib.crc32(bloco, crc)
+    return crc
+
+
+class ZipStream:
+    """Iterável de bytes de um ZIP STORED; `tamanho` é o tamanho exato do arquivo final."""
+
+    def __init__(self, entradas: List[EntradaZip], tamanho_bloco: int = TAMANHO_BLOCO):
+        self.tamanho_bloco = tamanho_bloco
+        self.arquivos = []
+        for entrada in entradas:
+            st = os.stat(entrada.caminho)
+            if st.st_size >= _LIMITE_32:
+                raise ValueError(f"Arquivo grande demais para o ZIP: {entrada.caminho}")
+            hora, data = _data_hora_dos(st.st_mtime)
+            self.arquivos.append(_Arquivo(entrada.caminho, entrada.nome.encode("utf-8"), st.st_size, st.st_mtime_ns,
+                                          hora, data))
+        self.tamanho = self._calcular_tamanho()
+
+    def _calcular_tamanho(self) -> int:
+        offset = 0
+        central = 0
+        for arq in self.arquivos:
+            central += _CENTRAL.size + len(arq.nome)
+            if offset >= _LIMITE_32:
+                central += _ZIP64_EXTRA_OFFSET.size
+            offset += _LOCAL.size + len(arq.nome) + arq.tamanho
+        total = offset + central + _FIM.size
+        if self._precisa_zip64(offset, central):
+            total += _ZIP64_FIM.size + _ZIP64_LOCALIZADOR.size
+        return total
+
+    def _precisa_zip64(self, offset_central: int, tamanho_central: int) -> bool:
+        return offset_central >= _LIMITE_32 or tamanho_central >= _LIMITE_32 or len(self.arquivos) >= _LIMITE_16
+
+    def __iter__(self) -> Iterator[bytes]:
+        offset = 0
+        registros = []  # (arquivo, crc, offset do cabeçalho local)
+
+        for arq in self.arquivos:
+            crc = _crc_arquivo(arq.caminho, arq.tamanho, arq.modificado_ns, self.tamanho_bloco)
+            cabecalho = _LOCAL.pack(
+                0x04034B50, _VERSAO, _FLAGS, _STORED, arq.hora_dos, arq.data_dos,
+                crc, arq.tamanho, arq.tamanho,
+                len(arq.nome), 0,
+            ) + arq.nome
+            yield cabecalho
+
+            lido = 0
+            for bloco in _blocos(arq.caminho, arq.tamanho, self.tamanho_bloco):
+                lido = zlib.crc32(bloco, lido)
+                yield bloco
+            if lido != crc:
+                # O cabeçalho já saiu: o melhor é abortar o download em vez de entregar um ZIP corrompido
+                raise IOError(f"Arquivo mudou durante o download: {arq.caminho}")
+            registros.append((arq, crc, offset))
+            offset += len(cabecalho) + arq.tamanho
+
+        # Diretório central
+        inicio_central = offset
+        tamanho_central = 0
+        for arq, crc, offset_local in registros:
+            extra = b""
+            offset_campo = offset_local
+            versao = _VERSAO
+            if offset_local >= _LIMITE_32:
+                extra = _ZIP64_EXTRA_OFFSET.pack(0x0001, 8, offset_local)
+                offset_campo = _LIMITE_32
+                versao = _VERSAO_ZIP64
+            entrada = _CENTRAL.pack(
+                0x02014B50, versao, versao, _FLAGS, _STORED, arq.hora_dos, arq.data_dos,
+                crc, arq.tamanho, arq.tamanho,
+                len(arq.nome), len(extra), 0, 0, 0, 0, offset_campo,
+            ) + arq.nome + extra
+            tamanho_central += len(entrada)
+            yield entrada
+
+        total = len(registros)
+        if self._precisa_zip64(inicio_central, tamanho_central):
+            inicio_zip64 = inicio_central + tamanho_central
+            yield _ZIP64_FIM.pack(
+                0x06064B50, _ZIP64_FIM.size - 12, _VERSAO_ZIP64, _VERSAO_ZIP64, 0, 0,
+                total, total, tamanho_central, inicio_central,
+            )
+            yield _ZIP64_LOCALIZADOR.pack(0x07064B50, 0, inicio_zip64, 1)
+
+        yield _FIM.pack(
+            0x06054B50, 0, 0,
+            min(total, _LIMITE_16), min(total, _LIMITE_16),
+            min(tamanho_central, _LIMITE_32), min(inicio_central, _LIMITE_32),
+            0,
+        )